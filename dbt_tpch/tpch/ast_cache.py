@@ -0,0 +1,125 @@
+"""
+Parsed-AST cache for compiled dbt SQL.
+
+Parsing every compiled model with `sqlglot.parse_one` (and walking it to pop
+comments) dominates optimizer startup on large projects, and both the rewriter
+and `generate_basic_sqls_wo_optimization.py` parse the same files. ASTs are
+therefore cached in two layers:
+  1. an in-process LRU, so repeated parses within one run are free
+  2. an on-disk cache of the comment-stripped AST serialized with sqlglot's
+     `Expression.dump()`, so unchanged models are not re-parsed across runs
+
+Entries are keyed by the SHA-256 of the SQL text, the read dialect and the
+sqlglot version, so edits and sqlglot upgrades never hit stale entries.
+Callers always receive a private copy, since rules modify ASTs in place.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Optional
+
+import sqlglot
+from sqlglot import exp
+
+ENABLE_AST_CACHE = True
+AST_CACHE_DIR = ".ast_cache"
+LRU_SIZE = 1024
+
+_LRU: "OrderedDict[str, exp.Expression]" = OrderedDict()
+_STATS = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def strip_comments(ast: exp.Expression) -> exp.Expression:
+    for ast_node in ast.walk():
+        ast_node.pop_comments()
+    return ast
+
+
+def cache_key(sql_str: str, read: Optional[str] = None) -> str:
+    h = hashlib.sha256()
+    h.update(sqlglot.__version__.encode())
+    h.update(b"\0")
+    h.update((read or "").encode())
+    h.update(b"\0")
+    h.update(sql_str.encode())
+    return h.hexdigest()
+
+
+def _disk_path(key: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+
+def _load_from_disk(key: str, cache_dir: str) -> Optional[exp.Expression]:
+    path = _disk_path(key, cache_dir)
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return exp.Expression.load(json.load(f))
+    except Exception as e:
+        print(f"[WARN] Ignoring unreadable AST cache entry {path}: {e}")
+        return None
+
+
+def _store_on_disk(key: str, ast: exp.Expression, cache_dir: str) -> None:
+    path = _disk_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(ast.dump(), f)
+    # atomic, so concurrent runs never read a half-written entry
+    os.replace(tmp_path, path)
+
+
+def _remember(key: str, ast: exp.Expression) -> None:
+    _LRU[key] = ast
+    _LRU.move_to_end(key)
+    while len(_LRU) > LRU_SIZE:
+        _LRU.popitem(last=False)
+
+
+def parse_sql_cached(
+    sql_str: str,
+    read: Optional[str] = None,
+    cache_dir: str = AST_CACHE_DIR,
+) -> exp.Expression:
+    """`sqlglot.parse_one(sql_str, read=read)` with comments stripped, served from cache when possible."""
+    if not ENABLE_AST_CACHE:
+        return strip_comments(sqlglot.parse_one(sql_str, read=read))
+
+    key = cache_key(sql_str, read)
+    ast = _LRU.get(key)
+    if ast is not None:
+        _STATS["memory_hits"] += 1
+        _LRU.move_to_end(key)
+        return ast.copy()
+
+    ast = _load_from_disk(key, cache_dir)
+    if ast is not None:
+        _STATS["disk_hits"] += 1
+    else:
+        _STATS["misses"] += 1
+        ast = strip_comments(sqlglot.parse_one(sql_str, read=read))
+        try:
+            _store_on_disk(key, ast, cache_dir)
+        except OSError as e:
+            print(f"[WARN] Could not write AST cache entry: {e}")
+    _remember(key, ast)
+    return ast.copy()
+
+
+def parse_file_cached(path: str, read: Optional[str] = None, cache_dir: str = AST_CACHE_DIR) -> exp.Expression:
+    with open(path, "r") as f:
+        return parse_sql_cached(f.read(), read=read, cache_dir=cache_dir)
+
+
+def cache_stats() -> dict:
+    return dict(_STATS)
+
+
+def clear_memory_cache() -> None:
+    _LRU.clear()
@@ -0,0 +1,81 @@
+"""
+Summary statistics of benchmark samples.
+
+`duckdb_sql_execution.py --benchmark` times every node, and the whole DAG,
+over several measured iterations; `compare_final_perf.py` compares two such
+runs. Confidence intervals are percentile bootstrap intervals: the statistic
+is recomputed on `resamples` resamples drawn with replacement, and the
+interval spans the middle `confidence` of the results. A speedup (mean
+baseline time / mean optimized time) is significant if its interval
+excludes 1.
+"""
+
+from __future__ import annotations
+
+import math
+import random
+import statistics
+from typing import Callable, List, Optional, Sequence, Tuple
+
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_RESAMPLES = 2000
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """The q-th percentile (0-100) of `values`, interpolating linearly between ranks."""
+    ordered = sorted(values)
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * q / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _bootstrap(rng: random.Random, statistic: Callable[..., float], samples: List[Sequence[float]],
+               confidence: float, resamples: int) -> Tuple[float, float]:
+    estimates = [
+        statistic(*[[rng.choice(s) for _ in s] for s in samples])
+        for _ in range(resamples)
+    ]
+    alpha = (1 - confidence) / 2
+    return percentile(estimates, 100 * alpha), percentile(estimates, 100 * (1 - alpha))
+
+
+def summarize(samples: Sequence[float], confidence: float = DEFAULT_CONFIDENCE,
+              resamples: int = DEFAULT_RESAMPLES, seed: int = 0) -> dict:
+    """n, mean, median, p95, p99, standard deviation and the bootstrap interval of the mean."""
+    if not samples:
+        return {"n": 0}
+    ci_low, ci_high = (None, None)
+    if len(samples) > 1:
+        ci_low, ci_high = _bootstrap(random.Random(seed), statistics.fmean, [samples], confidence, resamples)
+    return {
+        "n": len(samples),
+        "mean": statistics.fmean(samples),
+        "median": statistics.median(samples),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "std": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+    }
+
+
+def compare(baseline: Sequence[float], candidate: Sequence[float], confidence: float = DEFAULT_CONFIDENCE,
+            resamples: int = DEFAULT_RESAMPLES, seed: int = 0) -> Optional[dict]:
+    """
+    Speedup of `candidate` over `baseline` (ratio of mean times), its bootstrap
+    interval and whether the interval excludes 1. None without samples.
+    """
+    if not baseline or not candidate or statistics.fmean(candidate) <= 0:
+        return None
+
+    def speedup(base, cand):
+        return statistics.fmean(base) / max(statistics.fmean(cand), 1e-12)
+
+    result = {"speedup": speedup(baseline, candidate), "ci_low": None, "ci_high": None, "significant": False}
+    if len(baseline) > 1 and len(candidate) > 1:
+        low, high = _bootstrap(random.Random(seed), speedup, [baseline, candidate], confidence, resamples)
+        result.update(ci_low=low, ci_high=high, significant=low > 1 or high < 1)
+    return result
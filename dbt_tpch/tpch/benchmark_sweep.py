@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Scale-factor and thread-count sweep of the benchmark.
+
+`ddl.sql` generates TPC-H at one scale factor and nodes run on one DuckDB
+thread, which hides how the rewrites behave on larger data and more cores:
+a shared temp table that pays off at SF 0.1 may not at SF 10 or on 16
+threads. For each workload folder (`models/<workload>`) this
+  1. compiles the workload and generates its not-optimized SQL,
+  2. per scale factor, initializes a database from `ddl.sql` at that scale
+     factor, once: it is kept in `--db-cache-dir` and reused by later sweeps,
+     and optimizes the workload against it (the rewrites' statistics depend
+     on the data), checking that the optimized DAG builds the workload's
+     models and no others,
+  3. per thread count, benchmarks both DAGs on a copy of that database
+     (`duckdb_sql_execution.py --benchmark --threads`),
+and writes the DAG speedup per workload, scale factor and thread count, with
+its bootstrap interval (`bench_stats.py`), to `sweep_report.csv`, and the
+benchmark summaries to `sweep_report.json`.
+
+    python benchmark_sweep.py --workloads tpch_queries cte --scale-factors 0.1 1 10 --threads 1 4 16
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+import duckdb
+
+from bench_stats import DEFAULT_CONFIDENCE, compare
+from column_stats import DDL_FILE
+from dead_nodes import final_models
+from parse_dbt_manifest_select_model_dir import build_full_graph, gather_subgraph
+from utils import load_dag_file, load_dbt_manifest
+
+DB_CACHE_DIR = ".tpch_db_cache"
+REPORT_PREFIX = "sweep_report"
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = "dev.duckdb"
+MANIFEST_PATH = os.path.join("target", "manifest.json")
+OPTIMIZED_DAG_FILE = "dag_optimized.json"
+
+_DBGEN_RE = re.compile(r"dbgen\s*\(\s*sf\s*=\s*[\d.]+\s*\)", re.IGNORECASE)
+
+
+def database_for(scale_factor, cache_dir=DB_CACHE_DIR, ddl_path=DDL_FILE):
+    """Path of the database initialized from `ddl_path` at `scale_factor`, built if not cached."""
+    # ddl.sql names the "dev" catalog, so the file keeps the name of DB_PATH
+    sf_dir = os.path.join(cache_dir, f"sf{scale_factor:g}")
+    path = os.path.join(sf_dir, DB_PATH)
+    if os.path.isfile(path):
+        print(f"[INFO] Using cached SF {scale_factor:g} database {path}")
+        return path
+    with open(ddl_path, "r") as f:
+        ddl = f.read()
+    if not _DBGEN_RE.search(ddl):
+        raise ValueError(f"No dbgen(sf = ...) call in {ddl_path}")
+    ddl = _DBGEN_RE.sub(f"dbgen(sf = {scale_factor:g})", ddl, count=1)
+    # built in another directory, so an interrupted build is not taken for a cached one
+    partial = sf_dir + ".partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    print(f"[INFO] Generating SF {scale_factor:g} database {path}")
+    con = duckdb.connect(os.path.join(partial, DB_PATH))
+    try:
+        con.execute(ddl)
+    finally:
+        con.close()
+    os.replace(partial, sf_dir)
+    return path
+
+
+def _run(cmd):
+    print(f"[INFO] Running: {' '.join(cmd)}")
+    return subprocess.run(cmd).returncode == 0
+
+
+def _script(name):
+    return [sys.executable, os.path.join(SCRIPT_DIR, name)]
+
+
+def _load_benchmark(mode):
+    path = f"{mode}_benchmark.json"
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def benchmark_pair(database, threads, args):
+    """Benchmark both DAGs on a copy of `database`. Returns their reports (None if a run failed)."""
+    reports = {}
+    for mode in ("not_optimized", "optimized"):
+        if os.path.exists(f"{mode}_benchmark.json"):
+            os.remove(f"{mode}_benchmark.json")
+        ok = _run(_script("duckdb_sql_execution.py") + [
+            mode, "--benchmark", "--no-save-results", "--database", database,
+            "--threads", str(threads), "--warmup", str(args.warmup), "--iterations", str(args.iterations),
+            "--cache-state", args.cache_state, "--confidence", str(args.confidence)])
+        reports[mode] = _load_benchmark(mode) if ok else None
+    return reports
+
+
+def workload_mismatch(folder, manifest_path=MANIFEST_PATH, dag_path=OPTIMIZED_DAG_FILE):
+    """
+    Why the optimized DAG does not optimize the workload in `folder`: models it
+    builds from outside the workload (its models and their upstream models), or
+    final models of the workload it does not build. None if it matches.
+    """
+    manifest = load_dbt_manifest(manifest_path)
+    workload = gather_subgraph(build_full_graph(manifest), manifest, folder)
+    if not workload.nodes:
+        return f"no models in {folder}"
+    built = {n["node_id"] for n in load_dag_file(dag_path) if not n.get("intermediate")}
+    outside = sorted(built - set(workload.nodes))
+    missing = sorted(final_models(workload) - built)
+    if outside or missing:
+        return f"models outside of {folder}: {outside}; final models not built: {missing}"
+    return None
+
+
+def _summary(report):
+    """A benchmark report without its samples."""
+    strip = lambda s: {k: v for k, v in s.items() if k != "samples_ms"}
+    return dict(report, dag=strip(report["dag"]), nodes={n: strip(s) for n, s in report["nodes"].items()})
+
+
+def print_matrix(rows, scale_factors, threads):
+    """Speedup of each workload by scale factor (rows) and thread count (columns)."""
+    for workload in dict.fromkeys(r["workload"] for r in rows):
+        speedups = {(r["scale_factor"], r["threads"]): r for r in rows if r["workload"] == workload}
+        print(f"[INFO] {workload}: DAG speedup by scale factor and threads (* = significant)")
+        print("  SF \\ threads" + "".join(f"{t:>10}" for t in threads))
+        for sf in scale_factors:
+            cells = []
+            for t in threads:
+                row = speedups.get((sf, t))
+                if row is None or row["speedup"] is None:
+                    cells.append(f"{'-':>10}")
+                else:
+                    cells.append(f"{row['speedup']:>9.3f}{'*' if row['significant'] else ' '}")
+            print(f"  {sf:<13g}" + "".join(cells))
+
+
+def write_report(rows, details, prefix=REPORT_PREFIX):
+    with open(f"{prefix}.csv", "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Workload", "ScaleFactor", "Threads", "UnoptimizedMeanMs", "OptimizedMeanMs",
+                         "Speedup", "SpeedupCILow", "SpeedupCIHigh", "Significant"])
+        for row in rows:
+            writer.writerow([row["workload"], f"{row['scale_factor']:g}", row["threads"]] + [
+                "" if row[k] is None else f"{row[k]:.3f}"
+                for k in ("unoptimized_ms", "optimized_ms", "speedup", "ci_low", "ci_high")
+            ] + [row["significant"]])
+    with open(f"{prefix}.json", "w") as f:
+        json.dump(details, f, indent=2)
+    print(f"[INFO] Wrote {prefix}.csv and {prefix}.json")
+
+
+def sweep(args):
+    rows, details = [], []
+    for workload in args.workloads:
+        folder = f"models/{workload}"
+        # compiling may introspect the database, so have one in place
+        shutil.copyfile(database_for(args.scale_factors[0], args.db_cache_dir), DB_PATH)
+        if not args.skip_compile:
+            if not (_run(["dbt", "compile", "--model", workload])
+                    and _run(_script("generate_basic_sqls_wo_optimization.py") + ["--folder", folder])):
+                print(f"[ERROR] Could not compile {workload}; skipping it.")
+                continue
+        for sf in args.scale_factors:
+            database = database_for(sf, args.db_cache_dir)
+            shutil.copyfile(database, DB_PATH)
+            # results cached by earlier runs would stand in for the rewrites being measured
+            no_cache = ["--cache-dir", os.path.join(args.db_cache_dir, "no_result_cache")]
+            if not _run(_script("parse_dbt_manifest_select_model_dir.py") + ["--folder", folder]
+                        + no_cache + args.optimizer_args):
+                print(f"[ERROR] Could not optimize {workload} at SF {sf:g}; skipping it.")
+                continue
+            mismatch = workload_mismatch(folder)
+            if mismatch is not None:
+                print(f"[ERROR] The optimized DAG is not the {workload} workload ({mismatch}); skipping it.")
+                continue
+            for threads in args.threads:
+                reports = benchmark_pair(database, threads, args)
+                base, cand = reports["not_optimized"], reports["optimized"]
+                row = {"workload": workload, "scale_factor": sf, "threads": threads,
+                       "unoptimized_ms": None, "optimized_ms": None, "speedup": None,
+                       "ci_low": None, "ci_high": None, "significant": False}
+                result = None
+                if base is not None and cand is not None:
+                    result = compare(base["dag"]["samples_ms"], cand["dag"]["samples_ms"], args.confidence)
+                if result is None:
+                    print(f"[WARN] No speedup for {workload} at SF {sf:g} on {threads} thread(s)")
+                else:
+                    row.update(result, unoptimized_ms=base["dag"]["mean"], optimized_ms=cand["dag"]["mean"])
+                    print(f"[INFO] {workload} at SF {sf:g} on {threads} thread(s): "
+                          f"DAG speedup {result['speedup']:.3f}"
+                          + ("" if result["significant"] else " (not significant)"))
+                rows.append(row)
+                details.append(dict(row, not_optimized=base and _summary(base),
+                                    optimized=cand and _summary(cand)))
+                # written after every cell, so a long sweep can be inspected while it runs
+                write_report(rows, details)
+    print_matrix(rows, args.scale_factors, args.threads)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workloads", nargs="+", required=True,
+                        help="Model folders under models/ to benchmark")
+    parser.add_argument("--scale-factors", nargs="+", type=float, default=[0.1, 1.0],
+                        help="TPC-H scale factors")
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, 4],
+                        help="DuckDB thread counts")
+    parser.add_argument("--db-cache-dir", default=DB_CACHE_DIR,
+                        help="Where the generated databases are kept between sweeps")
+    parser.add_argument("--skip-compile", action="store_true",
+                        help="Reuse the compiled manifest and not-optimized SQL of a previous run "
+                             "(single workload only)")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--cache-state", choices=["cold", "warm"], default="cold")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument("--optimizer-args", nargs=argparse.REMAINDER, default=[],
+                        help="Passed on to parse_dbt_manifest_select_model_dir.py, e.g. --cost-based")
+    args = parser.parse_args()
+    if args.skip_compile and len(args.workloads) > 1:
+        parser.error("--skip-compile reuses one compiled workload; pass a single --workloads folder")
+    sweep(args)
+
+
+if __name__ == "__main__":
+    main()
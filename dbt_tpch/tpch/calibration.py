@@ -0,0 +1,179 @@
+"""
+Calibration of the cost-model constants from recorded execution profiles.
+
+The cost comparisons of `selectivity.py` count the rows flowing through the
+operators of a plan, and weigh writing and scanning a row of
+REFERENCE_ROW_WIDTH bytes by hand-picked constants. This fits them to the
+machine from the operator profiles of `profile_store.py`, as seconds per
+  * row through an operator (all operators not listed below): the unit,
+  * row scanned from a table (SEQ_SCAN), per REFERENCE_ROW_WIDTH bytes,
+  * row read from Parquet (READ_PARQUET), per REFERENCE_ROW_WIDTH bytes,
+  * build and probe row of a hash join, fitted together by least squares,
+  * row written by CREATE TABLE AS, per REFERENCE_ROW_WIDTH bytes.
+Divided by the unit, they replace MATERIALIZE_SCAN_COST, SUBRESULT_SCAN_COST
+and MATERIALIZE_WRITE_COST, and hash joins are counted by their build and
+probe inputs (`selectivity.HASH_JOIN_WEIGHTS`) instead of their output. A
+class with fewer than MIN_SAMPLES operators keeps its default.
+
+    python duckdb_sql_execution.py not_optimized --profile   # record profiles
+    python calibration.py                                    # fit, write cost_calibration.json
+
+The optimizer loads `cost_calibration.json` if it exists (`--calibration`).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from typing import Iterable, Optional
+
+import selectivity
+from profile_store import PROFILE_STORE_PATH, ProfileStore
+from selectivity import REFERENCE_ROW_WIDTH
+
+CALIBRATION_FILE = "cost_calibration.json"
+MIN_SAMPLES = 3
+
+
+def _operator_class(record: dict) -> str:
+    if record["operator"] == "READ_PARQUET":
+        return "parquet_scan"
+    if record["operator"] == "SEQ_SCAN":
+        return "scan"
+    if record["type"] == "HASH_JOIN" and len(record["input_rows"]) == 2:
+        return "hash_join"
+    if record["type"].endswith("CREATE_TABLE_AS"):
+        return "write"
+    return "operator"
+
+
+def _reference_rows(rows: float, total_bytes: float, output_rows: float) -> float:
+    """`rows` rows as wide as `total_bytes` / `output_rows`, in rows of REFERENCE_ROW_WIDTH bytes."""
+    width = total_bytes / output_rows if output_rows else REFERENCE_ROW_WIDTH
+    return rows * width / REFERENCE_ROW_WIDTH
+
+
+def _per_unit(samples) -> Optional[float]:
+    """Seconds per unit through the origin, from (units, seconds) samples."""
+    if len(samples) < MIN_SAMPLES:
+        return None
+    units = sum(u for u, _ in samples)
+    return sum(s for _, s in samples) / units if units > 0 else None
+
+
+def _fit_hash_join(samples):
+    """(seconds per build row, per probe row) from (build, probe, seconds) samples."""
+    if len(samples) < MIN_SAMPLES:
+        return None
+    bb = sum(b * b for b, _, _ in samples)
+    pp = sum(p * p for _, p, _ in samples)
+    bp = sum(b * p for b, p, _ in samples)
+    tb = sum(t * b for b, _, t in samples)
+    tp = sum(t * p for _, p, t in samples)
+    det = bb * pp - bp * bp
+    if det > 0:
+        build = (tb * pp - tp * bp) / det
+        probe = (tp * bb - tb * bp) / det
+        if build >= 0 and probe >= 0:
+            return build, probe
+    # collinear sides, or a negative coefficient: the better fit of one side alone
+    candidates = []
+    if bb > 0:
+        candidates.append((max(tb / bb, 0.0), 0.0))
+    if pp > 0:
+        candidates.append((0.0, max(tp / pp, 0.0)))
+    if not candidates:
+        return None
+    return min(candidates, key=lambda c: sum((t - c[0] * b - c[1] * p) ** 2 for b, p, t in samples))
+
+
+def fit(records: Iterable[dict]) -> dict:
+    """Fit the constants to profile records. Values without enough samples are None."""
+    samples = {"operator": [], "scan": [], "parquet_scan": [], "write": [], "hash_join": []}
+    for record in records:
+        kind = _operator_class(record)
+        seconds = record["seconds"]
+        if kind == "operator":
+            samples[kind].append((record["rows"], seconds))
+        elif kind in ("scan", "parquet_scan"):
+            scanned = record["rows_scanned"] or record["rows"]
+            samples[kind].append((_reference_rows(scanned, record["bytes"], record["rows"]), seconds))
+        elif kind == "write":
+            written = sum(record["input_rows"])
+            samples[kind].append((_reference_rows(written, sum(record["input_bytes"]), written), seconds))
+        else:
+            probe, build = record["input_rows"]
+            samples[kind].append((build, probe, seconds))
+
+    unit = _per_unit(samples["operator"])
+    calibration = {
+        "unit_seconds": unit,
+        "samples": {kind: len(s) for kind, s in samples.items()},
+        "materialize_scan_cost": None,
+        "subresult_scan_cost": None,
+        "materialize_write_cost": None,
+        "hash_join_build": None,
+        "hash_join_probe": None,
+    }
+    if not unit:
+        return calibration
+    for kind, key in (("scan", "materialize_scan_cost"), ("parquet_scan", "subresult_scan_cost"),
+                      ("write", "materialize_write_cost")):
+        seconds = _per_unit(samples[kind])
+        if seconds is not None:
+            calibration[key] = seconds / unit
+    join = _fit_hash_join(samples["hash_join"])
+    if join is not None:
+        calibration["hash_join_build"], calibration["hash_join_probe"] = (s / unit for s in join)
+    return calibration
+
+
+def load_calibration(path: str = CALIBRATION_FILE) -> Optional[dict]:
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def apply_calibration(calibration: dict) -> None:
+    """Use fitted constants in the cost comparisons of `selectivity.py` (missing ones keep their defaults)."""
+    for key, name in (("materialize_scan_cost", "MATERIALIZE_SCAN_COST"),
+                      ("subresult_scan_cost", "SUBRESULT_SCAN_COST"),
+                      ("materialize_write_cost", "MATERIALIZE_WRITE_COST")):
+        if calibration.get(key) is not None:
+            setattr(selectivity, name, calibration[key])
+    if calibration.get("hash_join_build") is not None and calibration.get("hash_join_probe") is not None:
+        selectivity.HASH_JOIN_WEIGHTS = (calibration["hash_join_build"], calibration["hash_join_probe"])
+    print(f"[INFO] Calibrated cost constants: write={selectivity.MATERIALIZE_WRITE_COST:.3f} "
+          f"scan={selectivity.MATERIALIZE_SCAN_COST:.3f} subresult scan={selectivity.SUBRESULT_SCAN_COST:.3f} "
+          f"hash join (build, probe)={selectivity.HASH_JOIN_WEIGHTS}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default=PROFILE_STORE_PATH,
+                        help="Operator profiles recorded by duckdb_sql_execution.py --profile")
+    parser.add_argument("--output", default=CALIBRATION_FILE,
+                        help="Where to write the fitted constants")
+    parser.add_argument("--mode", choices=["optimized", "not_optimized"],
+                        help="Only fit to the profiles of runs in this mode")
+    args = parser.parse_args()
+
+    records = [r for r in ProfileStore(args.store).records() if args.mode is None or r["mode"] == args.mode]
+    if not records:
+        print(f"[ERROR] No profiles in {args.store}; run duckdb_sql_execution.py with --profile first.")
+        return
+    calibration = fit(records)
+    print(f"[INFO] Fitted {len(records)} operators from {len({r['run'] for r in records})} runs: "
+          f"{calibration['samples']}")
+    for key, value in calibration.items():
+        if key != "samples":
+            print(f"  {key}: {'default (too few samples)' if value is None else f'{value:.6g}'}")
+    with open(args.output, "w") as f:
+        json.dump(calibration, f, indent=2)
+    print(f"[INFO] Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@
 import sys
 import os
 
+from dead_nodes import PRUNED_MODELS_FILE
+
 def main():
     # expect a single argument: either "optimized" or "not_optimized"
     if len(sys.argv) < 2:
@@ -30,10 +32,19 @@ def main():
     with open(materialized_tables_file, "r") as f:
         lines = f.readlines()
 
+    # models dead-node elimination left out of the optimized DAG are not built
+    pruned = set()
+    if mode == "optimized" and os.path.exists(PRUNED_MODELS_FILE):
+        with open(PRUNED_MODELS_FILE, "r") as f:
+            pruned = {line.strip() for line in f if line.strip()}
+
     for line in lines:
         line = line.strip()
         if not line:
             continue
+        if line in pruned:
+            print(f"[INFO] Skipping {line}: not built by the optimized DAG (unused by the targets)")
+            continue
         # line example:  "dev"."main"."q06"
         # remove quotes and split by dot to get the final segment (e.g. q06)
         cleaned = line.replace('"', '')
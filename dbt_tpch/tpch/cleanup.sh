@@ -7,4 +7,9 @@ rm ./benchmark_results.csv
 rm materialized_tables.txt
 rm materialized_tables_optimized.txt
 rm topo_sort_order.txt
-rm topo_sort_order_optimized.txt
\ No newline at end of file
+rm topo_sort_order_optimized.txt
+rm pruned_models_optimized.txt
+rm dag.json
+rm dag_optimized.json
+rm optimizer_snapshot.json
+rm column_stats.json
@@ -0,0 +1,420 @@
+"""
+Histogram- and sample-based column statistics for selectivity estimation.
+
+DuckDB's `EXPLAIN` estimates are crude for range and LIKE predicates (they fall
+back to fixed default selectivities), which drives wrong pushdown decisions.
+This module keeps, per column of the base tables created by `ddl.sql`:
+  * the null fraction and (approximate) number of distinct values
+  * the most common values and their frequencies
+  * an equi-depth histogram (bucket bounds) of the non-null values
+  * for string columns, a small value sample to evaluate LIKE patterns on
+The table is sampled once into a temp table (a reservoir sample) and all
+statistics are computed from it; the number of distinct values of the table is
+estimated from the sample's distinct values and how many of them occur once.
+
+Statistics are stored in a local JSON file and refreshed incrementally: a table
+is only re-sampled when its row count or column list changed. Estimating a
+predicate is then pure Python, without a DuckDB round trip.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import re
+from typing import Dict, List, Optional
+
+import duckdb
+import sqlglot
+import sqlglot.optimizer.simplify
+from sqlglot import exp
+
+from utils import REWRITER_DIALECT
+
+STATS_FILE = "column_stats.json"
+DDL_FILE = "ddl.sql"
+SAMPLE_ROWS = 10_000
+HISTOGRAM_BUCKETS = 32
+MCV_COUNT = 16
+# string values kept per column to evaluate LIKE patterns on
+LIKE_SAMPLE_VALUES = 1_000
+# temp table holding the sample of the table being analyzed
+_SAMPLE_TABLE = "_column_stats_sample"
+
+_DDL_TABLE_RE = re.compile(r'CREATE\s+TABLE\s+((?:"?\w+"?\.){0,2}"?\w+"?)', re.IGNORECASE)
+_NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT",
+                  "UINTEGER", "UBIGINT", "FLOAT", "REAL", "DOUBLE", "DECIMAL")
+
+
+def base_tables_from_ddl(ddl_path: str = DDL_FILE) -> List[str]:
+    with open(ddl_path, "r") as f:
+        return _DDL_TABLE_RE.findall(f.read())
+
+
+def _column_kind(type_name: str) -> str:
+    base = type_name.upper().split("(")[0].strip()
+    if base in _NUMERIC_TYPES:
+        return "numeric"
+    if base == "DATE" or base.startswith("TIMESTAMP"):
+        return "date"
+    if base in ("VARCHAR", "TEXT", "STRING", "CHAR", "BPCHAR"):
+        return "string"
+    return "other"
+
+
+def _to_number(value, kind: str) -> Optional[float]:
+    """Values are compared/interpolated as floats; dates as days since epoch."""
+    if value is None:
+        return None
+    try:
+        if kind == "date":
+            if isinstance(value, str):
+                value = datetime.date.fromisoformat(value[:10])
+            if isinstance(value, datetime.datetime):
+                value = value.date()
+            return float(value.toordinal())
+        if kind == "numeric":
+            return float(value)
+    except (TypeError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def _encode(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return float(value) if hasattr(value, "__float__") else str(value)
+
+
+def _table_signature(con, relation: str) -> dict:
+    columns = con.execute(f"DESCRIBE {relation}").fetchall()
+    row_count = con.execute(f"SELECT count(*) FROM {relation}").fetchone()[0]
+    return {"row_count": int(row_count), "columns": [[c[0], c[1]] for c in columns]}
+
+
+def _estimated_ndv(rows: int, sample_size: int, distinct: int, singletons: int) -> int:
+    """
+    Distinct values of a column of `rows` rows, from a sample of `sample_size`
+    rows with `distinct` values, `singletons` of which occur once: the Duj1
+    estimator n * d / (n - f1 + f1 * n / N) that PostgreSQL uses, exact for a
+    full sample and N for a sample of unique values.
+    """
+    if sample_size <= 0 or distinct <= 0:
+        return 0
+    rows = max(rows, sample_size)
+    estimate = sample_size * distinct / (sample_size - singletons + singletons * sample_size / rows)
+    return int(round(min(max(estimate, distinct), rows)))
+
+
+def build_table_stats(con: duckdb.DuckDBPyConnection, relation: str, sample_rows: int = SAMPLE_ROWS) -> dict:
+    signature = _table_signature(con, relation)
+    # sampled once; every statistic, the distinct count included, is computed on the same rows
+    con.execute(
+        f"CREATE OR REPLACE TEMP TABLE {_SAMPLE_TABLE} AS "
+        f"SELECT * FROM {relation} USING SAMPLE reservoir({sample_rows} ROWS) REPEATABLE (42)"
+    )
+    try:
+        sample = _SAMPLE_TABLE
+        sample_size = con.execute(f"SELECT count(*) FROM {sample}").fetchone()[0]
+        columns = {}
+        for name, type_name in signature["columns"]:
+            kind = _column_kind(type_name)
+            col = f'"{name}"'
+            nulls, distinct, singletons = con.execute(
+                f"SELECT {sample_size} - coalesce(sum(n), 0), count(*), count(*) FILTER (WHERE n = 1) "
+                f"FROM (SELECT count(*) AS n FROM {sample} WHERE {col} IS NOT NULL GROUP BY {col})"
+            ).fetchone()
+            mcv_rows = con.execute(
+                f"SELECT {col}, count(*) AS n FROM {sample} WHERE {col} IS NOT NULL "
+                f"GROUP BY 1 ORDER BY n DESC, 1 LIMIT {MCV_COUNT}"
+            ).fetchall()
+            # a value is only "common" if it is more frequent than an average value of the sample
+            avg_count = (sample_size - nulls) / max(distinct, 1)
+            mcvs = [[_encode(v), n / max(sample_size, 1)] for v, n in mcv_rows if n > avg_count]
+            stats = {
+                "kind": kind,
+                "type": type_name,
+                "null_frac": nulls / max(sample_size, 1),
+                "ndv": _estimated_ndv(signature["row_count"], sample_size, distinct, singletons),
+                "mcv": mcvs,
+                "histogram": [],
+            }
+            if kind in ("numeric", "date"):
+                fractions = ", ".join(str(i / HISTOGRAM_BUCKETS) for i in range(HISTOGRAM_BUCKETS + 1))
+                bounds = con.execute(
+                    f"SELECT quantile_disc({col}, [{fractions}]) FROM {sample} WHERE {col} IS NOT NULL"
+                ).fetchone()[0]
+                stats["histogram"] = [_encode(b) for b in (bounds or [])]
+            elif kind == "string":
+                values = con.execute(
+                    f"SELECT {col} FROM {sample} WHERE {col} IS NOT NULL LIMIT {LIKE_SAMPLE_VALUES}"
+                ).fetchall()
+                stats["values"] = [v[0] for v in values]
+            columns[name.lower()] = stats
+    finally:
+        con.execute(f"DROP TABLE IF EXISTS {_SAMPLE_TABLE}")
+    return {"signature": signature, "sample_rows": int(sample_size), "columns": columns}
+
+
+def load_stats(path: str = STATS_FILE) -> Dict[str, dict]:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def refresh_stats(
+    con: duckdb.DuckDBPyConnection,
+    tables: List[str],
+    path: str = STATS_FILE,
+    force: bool = False,
+) -> Dict[str, dict]:
+    """Re-sample the tables whose row count or schema changed, and save the stats file."""
+    stats = load_stats(path)
+    changed = False
+    for relation in tables:
+        try:
+            signature = _table_signature(con, relation)
+        except Exception as e:
+            print(f"[WARN] Skipping statistics of {relation}: {e}")
+            continue
+        if not force and stats.get(relation, {}).get("signature") == signature:
+            continue
+        print(f"[INFO] Building column statistics of {relation}")
+        stats[relation] = build_table_stats(con, relation)
+        changed = True
+    if changed:
+        with open(path, "w") as f:
+            json.dump(stats, f)
+    return stats
+
+
+def _literal_node(value) -> exp.Expression:
+    if isinstance(value, str):
+        return exp.Literal.string(value)
+    return exp.Literal.number(value)
+
+
+class ColumnStatistics:
+    """Predicate selectivity from the stored column statistics."""
+
+    def __init__(self, stats: Dict[str, dict]):
+        self.stats = stats
+        # column name -> [(relation, column stats)], to resolve unqualified columns
+        self._by_column: Dict[str, list] = {}
+        for relation, table in stats.items():
+            for name, col in table["columns"].items():
+                self._by_column.setdefault(name, []).append((relation, col))
+
+    def _column(self, column: exp.Column, tables: Optional[set]) -> Optional[dict]:
+        candidates = self._by_column.get(column.name.lower(), [])
+        if len(candidates) > 1 and tables:
+            # prefer the base tables the query reads
+            candidates = [c for c in candidates if c[0].replace('"', '').split(".")[-1].lower() in tables]
+        return candidates[0][1] if len(candidates) == 1 else None
+
+    @staticmethod
+    def _literal(node: exp.Expression):
+        if isinstance(node, exp.Literal):
+            return node.this if node.is_string else float(node.this)
+        if isinstance(node, exp.Cast) and isinstance(node.this, exp.Literal):
+            return node.this.this
+        if isinstance(node, exp.Neg) and isinstance(node.this, exp.Literal) and not node.this.is_string:
+            return -float(node.this.this)
+        if isinstance(node, exp.Boolean):
+            return node.this
+        return None
+
+    def _eq(self, col: dict, value) -> float:
+        for mcv, freq in col["mcv"]:
+            if mcv == value or (col["kind"] in ("numeric", "date")
+                                and _to_number(mcv, col["kind"]) == _to_number(value, col["kind"])):
+                return freq
+        rest = 1.0 - col["null_frac"] - sum(freq for _, freq in col["mcv"])
+        others = max(col["ndv"] - len(col["mcv"]), 1)
+        return max(rest, 0.0) / others
+
+    def _below(self, col: dict, value, inclusive: bool) -> Optional[float]:
+        """Fraction of rows with column < value (<= if inclusive)."""
+        kind = col["kind"]
+        if kind not in ("numeric", "date") or not col["histogram"]:
+            return None
+        x = _to_number(value, kind)
+        if x is None:
+            return None
+        bounds = [_to_number(b, kind) for b in col["histogram"]]
+        non_null = 1.0 - col["null_frac"]
+        if x < bounds[0] or (x == bounds[0] and not inclusive):
+            return 0.0
+        if x == bounds[-1] and not inclusive:
+            return max(non_null - self._eq(col, value), 0.0)
+        if x >= bounds[-1]:
+            return non_null
+        buckets = len(bounds) - 1
+        for i in range(buckets):
+            lo, hi = bounds[i], bounds[i + 1]
+            if lo <= x < hi:
+                within = (x - lo) / (hi - lo) if hi > lo else 0.0
+                frac = (i + within) / buckets
+                break
+        if inclusive:
+            frac += self._eq(col, value) / max(non_null, 1e-9)
+        return min(frac, 1.0) * non_null
+
+    def _like(self, col: dict, pattern: str) -> Optional[float]:
+        values = col.get("values")
+        if not values:
+            return None
+        regex = re.compile("^" + "".join(
+            ".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern
+        ) + "$", re.DOTALL)
+        matches = sum(1 for v in values if regex.match(v))
+        return matches / len(values) * (1.0 - col["null_frac"])
+
+    def _comparison(self, node: exp.Expression, tables) -> Optional[float]:
+        left, right = node.left, node.right
+        flipped = False
+        if not isinstance(left, exp.Column) and isinstance(right, exp.Column):
+            left, right, flipped = right, left, True
+        if not isinstance(left, exp.Column):
+            return None
+        col = self._column(left, tables)
+        value = self._literal(right)
+        if col is None or value is None:
+            return None
+        if isinstance(node, exp.EQ):
+            return self._eq(col, value)
+        if isinstance(node, exp.NEQ):
+            return max(1.0 - col["null_frac"] - self._eq(col, value), 0.0)
+        op = type(node)
+        if flipped:
+            op = {exp.LT: exp.GT, exp.LTE: exp.GTE, exp.GT: exp.LT, exp.GTE: exp.LTE}[op]
+        non_null = 1.0 - col["null_frac"]
+        if op in (exp.LT, exp.LTE):
+            return self._below(col, value, inclusive=op is exp.LTE)
+        below = self._below(col, value, inclusive=op is exp.GT)
+        return None if below is None else max(non_null - below, 0.0)
+
+    def _range_bound(self, node: exp.Expression):
+        """(column, is_lower_bound, value, inclusive) of `col <op> literal`, else None."""
+        if not isinstance(node, (exp.LT, exp.LTE, exp.GT, exp.GTE)):
+            return None
+        left, right, op = node.left, node.right, type(node)
+        if not isinstance(left, exp.Column) and isinstance(right, exp.Column):
+            left, right = right, left
+            op = {exp.LT: exp.GT, exp.LTE: exp.GTE, exp.GT: exp.LT, exp.GTE: exp.LTE}[op]
+        value = self._literal(right)
+        if not isinstance(left, exp.Column) or value is None:
+            return None
+        return left, op in (exp.GT, exp.GTE), value, op in (exp.LTE, exp.GTE)
+
+    def _conjunction(self, conjuncts: list, tables) -> Optional[float]:
+        """
+        Conjuncts are assumed independent, except that lower and upper bounds on
+        the same column are combined into one range (`a >= x AND a < y`).
+        """
+        ranges = {}
+        others = []
+        for conjunct in conjuncts:
+            bound = self._range_bound(conjunct)
+            if bound is None:
+                others.append(conjunct)
+                continue
+            column, is_lower, value, inclusive = bound
+            ranges.setdefault(column.name.lower(), (column, []))[1].append((is_lower, value, inclusive))
+        sel = 1.0
+        for column, bounds in ranges.values():
+            lows = [b for b in bounds if b[0]]
+            highs = [b for b in bounds if not b[0]]
+            if len(lows) != 1 or len(highs) != 1:
+                # not a simple range: estimate each bound on its own
+                others.extend(
+                    (exp.GTE if inclusive else exp.GT)(this=column, expression=_literal_node(value)) if is_lower
+                    else (exp.LTE if inclusive else exp.LT)(this=column, expression=_literal_node(value))
+                    for is_lower, value, inclusive in bounds
+                )
+                continue
+            col = self._column(column, tables)
+            if col is None:
+                return None
+            below_high = self._below(col, highs[0][1], inclusive=highs[0][2])
+            below_low = self._below(col, lows[0][1], inclusive=not lows[0][2])
+            if below_high is None or below_low is None:
+                return None
+            sel *= max(below_high - below_low, 0.0)
+        for conjunct in others:
+            conjunct_sel = self.selectivity(conjunct, tables)
+            if conjunct_sel is None:
+                return None
+            sel *= conjunct_sel
+        return sel
+
+    def selectivity(self, predicate: exp.Expression, tables: Optional[set] = None) -> Optional[float]:
+        """Estimated fraction of rows satisfying `predicate`, or None if it cannot be estimated."""
+        node = predicate
+        if isinstance(node, exp.Paren):
+            return self.selectivity(node.this, tables)
+        if isinstance(node, exp.And):
+            return self._conjunction(list(node.flatten()), tables)
+        if isinstance(node, exp.Or):
+            left, right = self.selectivity(node.left, tables), self.selectivity(node.right, tables)
+            return None if left is None or right is None else min(left + right - left * right, 1.0)
+        if isinstance(node, exp.Not):
+            inner = self.selectivity(node.this, tables)
+            return None if inner is None else 1.0 - inner
+        if isinstance(node, (exp.EQ, exp.NEQ, exp.LT, exp.LTE, exp.GT, exp.GTE)):
+            return self._comparison(node, tables)
+        if isinstance(node, exp.Between) and isinstance(node.this, exp.Column):
+            col = self._column(node.this, tables)
+            low, high = self._literal(node.args["low"]), self._literal(node.args["high"])
+            if col is None or low is None or high is None:
+                return None
+            below_high = self._below(col, high, inclusive=True)
+            below_low = self._below(col, low, inclusive=False)
+            if below_high is None or below_low is None:
+                return None
+            return max(below_high - below_low, 0.0)
+        if isinstance(node, exp.In) and isinstance(node.this, exp.Column) and node.expressions:
+            col = self._column(node.this, tables)
+            values = [self._literal(v) for v in node.expressions]
+            if col is None or any(v is None for v in values):
+                return None
+            return min(sum(self._eq(col, v) for v in values), 1.0)
+        if isinstance(node, exp.Like) and isinstance(node.this, exp.Column):
+            col = self._column(node.this, tables)
+            pattern = self._literal(node.expression)
+            if col is None or not isinstance(pattern, str):
+                return None
+            return self._like(col, pattern)
+        if isinstance(node, exp.Is) and isinstance(node.this, exp.Column) and isinstance(node.expression, exp.Null):
+            col = self._column(node.this, tables)
+            return None if col is None else col["null_frac"]
+        return None
+
+    def selectivity_sql(self, base_ast: exp.Expression, predicate_sql: str) -> Optional[float]:
+        """Selectivity of `predicate_sql` evaluated on the rows of `base_ast`."""
+        predicate = sqlglot.parse_one(f"SELECT * FROM _t WHERE {predicate_sql}", read=REWRITER_DIALECT)
+        predicate = sqlglot.optimizer.simplify.simplify(predicate.find(exp.Where).this)
+        tables = {t.name.lower() for t in base_ast.find_all(exp.Table)}
+        return self.selectivity(predicate, tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build/refresh column statistics of the base tables.")
+    parser.add_argument("--db", default="dev.duckdb")
+    parser.add_argument("--ddl", default=DDL_FILE, help="DDL file whose CREATE TABLEs are the base tables")
+    parser.add_argument("--stats-file", default=STATS_FILE)
+    parser.add_argument("--force", action="store_true", help="Re-sample every table")
+    args = parser.parse_args()
+    con = duckdb.connect(args.db, read_only=True)
+    stats = refresh_stats(con, base_tables_from_ddl(args.ddl), args.stats_file, force=args.force)
+    con.close()
+    print(f"[INFO] Column statistics of {len(stats)} tables in {args.stats_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 
 import csv
+import json
 import sys
 
+from bench_stats import compare
+
 def read_benchmark_csv(filepath):
     """
     Reads a CSV file with columns:
-        TableName,TotalCreationTimeNs(10runs)
+        TableName,TotalCreationTimeMs(<n>runs)
     Returns a dict {table_name: time}.
     """
     data = {}
@@ -21,21 +24,72 @@ def read_benchmark_csv(filepath):
             if not time_str:
                 continue
             try:
-                time_val = int(time_str)
+                time_val = float(time_str)
             except ValueError:
                 time_val = None
             data[table_name] = time_val
     return data
 
+def _ms(value):
+    return f"{value:.3f}" if value is not None else ""
+
+
+def compare_benchmarks(unoptimized_json, optimized_json, output_csv):
+    """
+    Speedup per node and for the whole DAG from two *_benchmark.json files of
+    `duckdb_sql_execution.py --benchmark`, with its bootstrap confidence
+    interval. Speedups whose interval contains 1 are flagged as not significant.
+    """
+    with open(unoptimized_json, "r") as f:
+        unopt = json.load(f)
+    with open(optimized_json, "r") as f:
+        opt = json.load(f)
+    confidence = min(unopt.get("confidence", 0.95), opt.get("confidence", 0.95))
+    if unopt.get("cache_state") != opt.get("cache_state"):
+        print(f"[WARN] Comparing a {unopt.get('cache_state')} cache run against a {opt.get('cache_state')} one")
+
+    rows = [(name, unopt["nodes"].get(name), opt["nodes"].get(name))
+            for name in sorted(set(unopt["nodes"]) | set(opt["nodes"]))]
+    rows.append(("DAG", unopt["dag"], opt["dag"]))
+    not_significant = []
+    with open(output_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["TableName", "UnoptimizedMeanMs", "OptimizedMeanMs", "Speedup",
+                         "SpeedupCILow", "SpeedupCIHigh", "Significant"])
+        for name, base, cand in rows:
+            result = compare(base["samples_ms"] if base else [], cand["samples_ms"] if cand else [], confidence)
+            if result is None:
+                writer.writerow([name, _ms(base and base.get("mean")) or "MISSING",
+                                 _ms(cand and cand.get("mean")) or "MISSING", "", "", "", ""])
+                continue
+            if not result["significant"]:
+                not_significant.append(name)
+            writer.writerow([name, _ms(base["mean"]), _ms(cand["mean"]), f"{result['speedup']:.3f}",
+                             _ms(result["ci_low"]), _ms(result["ci_high"]), result["significant"]])
+            if name == "DAG":
+                interval = (f", {confidence:.0%} CI [{result['ci_low']:.3f}, {result['ci_high']:.3f}]"
+                            if result["ci_low"] is not None else "")
+                print(f"[INFO] DAG speedup {result['speedup']:.3f}{interval}")
+
+    for name in not_significant:
+        print(f"[WARN] Speedup of {name} is not statistically significant at {confidence:.0%}")
+    print(f"[INFO] Merged results written to {output_csv}")
+
+
 def main():
     if len(sys.argv) < 4:
         print(f"Usage: {sys.argv[0]} <unoptimized_csv> <optimized_csv> <output_csv>")
+        print(f"       {sys.argv[0]} <not_optimized_benchmark.json> <optimized_benchmark.json> <output_csv>")
         sys.exit(1)
 
     unoptimized_csv = sys.argv[1]
     optimized_csv = sys.argv[2]
     output_csv = sys.argv[3]
 
+    if unoptimized_csv.endswith(".json") and optimized_csv.endswith(".json"):
+        compare_benchmarks(unoptimized_csv, optimized_csv, output_csv)
+        return
+
     # Read the two input files
     unopt_data = read_benchmark_csv(unoptimized_csv)
     opt_data = read_benchmark_csv(optimized_csv)
@@ -62,9 +116,9 @@ def main():
             opt_time = opt_data.get(table_name)
 
             # Sum total times if available
-            if isinstance(unopt_time, int) and unopt_time != -1:
+            if isinstance(unopt_time, float) and unopt_time != -1:
                 total_unopt_time += unopt_time
-            if isinstance(opt_time, int) and opt_time != -1:
+            if isinstance(opt_time, float) and opt_time != -1:
                 total_opt_time += opt_time
 
             # If either is missing, store a placeholder
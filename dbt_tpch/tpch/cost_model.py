@@ -0,0 +1,101 @@
+"""
+DAG-level cost model for the rewriter.
+
+Each rule decides on its own whether a rewrite is worth it, with a comparison
+over the part of the DAG it touches (`selectivity.py`). How rewrites interact,
+e.g. a shared scan under a pushed-down predicate, is invisible to them. This
+model estimates the cost of building the whole DAG instead, so that different
+combinations of rewrites can be compared on one scale (`plan_enumerator.py`).
+In the units of `selectivity.py` (rows through an operator of the plan, rows of
+REFERENCE_ROW_WIDTH bytes written or scanned), a node costs
+  * compute: the estimated rows through all operators of its query, with every
+    upstream node that is not stored expanded, minus the work of the stored
+    nodes it reads,
+  * read: a scan of each stored node it reads, per reference,
+  * write: storing its output, if it is stored.
+Stored are dbt table models and intermediate nodes with several consumers;
+views, ephemeral models and intermediate nodes with one consumer (which the
+materialization pass inlines) are computed as part of their consumers and
+cost nothing themselves, unless nothing reads them.
+"""
+
+from __future__ import annotations
+
+from typing import Dict
+
+import networkx as nx
+from sqlglot import exp
+
+import selectivity
+from materialization import _references, expanded_query
+from selectivity import REFERENCE_ROW_WIDTH
+from utils import get_new_node, materialization
+
+
+class DagCostModel:
+    def __init__(self, stats):
+        # statistics_service.StatisticsService of the run
+        self.stats = stats
+        # node -> why its cost is unknown, for the last evaluated DAG
+        self.failed: Dict[str, str] = {}
+
+    def stored(self, graph: nx.DiGraph, node_id: str) -> bool:
+        """Whether the node's output is written and scanned by its consumers."""
+        if get_new_node(node_id) is not None:
+            return graph.out_degree(node_id) != 1
+        return materialization(node_id) == "table"
+
+    def _frontier(self, graph, asts, node_id, memo) -> Dict[str, int]:
+        """{stored node: references} of the stored nodes `node_id` reads, through the others."""
+        if node_id not in memo:
+            frontier = {}
+            for parent in graph.predecessors(node_id):
+                if parent not in asts:
+                    continue
+                references = len(_references(asts[node_id], parent))
+                if not references:
+                    continue
+                if self.stored(graph, parent):
+                    reads = {parent: 1}
+                else:
+                    reads = self._frontier(graph, asts, parent, memo)
+                for stored, count in reads.items():
+                    frontier[stored] = frontier.get(stored, 0) + references * count
+            memo[node_id] = frontier
+        return memo[node_id]
+
+    def _volume(self, query: exp.Expression) -> float:
+        """Estimated output rows, in rows of REFERENCE_ROW_WIDTH bytes."""
+        return self.stats.estimated_rows(query) * self.stats.estimated_row_width(query) / REFERENCE_ROW_WIDTH
+
+    def node_cost(self, graph, asts, node_id, queries, frontiers) -> float:
+        stored = self.stored(graph, node_id)
+        if not stored and graph.out_degree(node_id) > 0:
+            return 0.0
+        query = expanded_query(graph, asts, node_id, queries)
+        work = self.stats.estimated_plan_rows(query)
+        # constants read at call time: calibration.py may have replaced the defaults
+        read = 0.0
+        for parent, references in self._frontier(graph, asts, node_id, frontiers).items():
+            parent_query = expanded_query(graph, asts, parent, queries)
+            work -= references * self.stats.estimated_plan_rows(parent_query)
+            read += references * self._volume(parent_query) * selectivity.MATERIALIZE_SCAN_COST
+        write = self._volume(query) * selectivity.MATERIALIZE_WRITE_COST if stored else 0.0
+        return max(work, 0) + read + write
+
+    def dag_cost(self, graph: nx.DiGraph, asts: Dict[str, exp.Expression]) -> float:
+        """
+        Estimated cost of building every node of the DAG. Nodes whose cost
+        cannot be estimated count as free and are listed in `failed`.
+        """
+        self.failed = {}
+        queries, frontiers = {}, {}
+        total = 0.0
+        for node_id in nx.topological_sort(graph):
+            if node_id not in asts:
+                continue
+            try:
+                total += self.node_cost(graph, asts, node_id, queries, frontiers)
+            except Exception as e:
+                self.failed[node_id] = str(e)
+        return total
@@ -0,0 +1,321 @@
+"""
+Parallel DAG executor.
+
+Runs the nodes of an executable DAG (see `utils.write_dag_file`) on a pool of
+DuckDB cursors, starting each node as soon as all of its parents finished.
+
+DuckDB temporary tables are private to the connection that created them, so a
+temp table created on one cursor is invisible to the others. To keep the
+intermediate nodes created by the rewriter (e.g. `*_pushdown`, `shared_cte_*`)
+visible to their consumers, the executor retargets `temp.main.*` relations into
+a shared in-memory database attached for the duration of the run.
+
+Intermediate nodes are reference counted over the DAG and dropped as soon as
+their last consumer finished, and a background monitor samples
+`duckdb_memory()` to report the memory high-water mark of the run.
+"""
+
+from __future__ import annotations
+
+import heapq
+import queue
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import duckdb
+import networkx as nx
+
+from utils import load_dag_file
+
+SHARED_TEMP_DB = "mqo_temp"
+MEMORY_SAMPLE_INTERVAL_S: float = 0.01
+
+_TEMP_RELATION_RE = re.compile(r'"?\btemp"?\."?main"?\.', re.IGNORECASE)
+_CREATE_TEMP_RE = re.compile(r"\bCREATE\s+(?:TEMPORARY|TEMP)\s+TABLE\b", re.IGNORECASE)
+
+
+@dataclass
+class NodeTiming:
+    node_id: str
+    relation: str
+    start_ns: int = 0
+    end_ns: int = 0
+    worker: int = -1
+    error: Optional[str] = None
+    # restored from the result cache instead of computed
+    cached: bool = False
+
+    @property
+    def wall_ns(self) -> int:
+        if self.error is not None:
+            return -1
+        return self.end_ns - self.start_ns
+
+
+@dataclass
+class DagRunResult:
+    timings: Dict[str, NodeTiming] = field(default_factory=dict)
+    start_order: List[str] = field(default_factory=list)
+    wall_ns: int = 0
+    dropped: List[str] = field(default_factory=list)
+    peak_memory_bytes: int = 0
+    peak_temp_storage_bytes: int = 0
+
+
+def load_dag(path: str) -> nx.DiGraph:
+    """
+    Build a DiGraph from a DAG file. Node attributes hold the DAG file entry plus
+    its position in the emitted topological order (`topo_index`).
+    """
+    graph = nx.DiGraph()
+    entries = load_dag_file(path)
+    for idx, entry in enumerate(entries):
+        graph.add_node(entry["node_id"], topo_index=idx, **entry)
+    for entry in entries:
+        for parent in entry["parents"]:
+            # parents that were not emitted (e.g. failed to deparse) are ignored
+            if parent in graph:
+                graph.add_edge(parent, entry["node_id"])
+    assert nx.is_directed_acyclic_graph(graph), "Graph is not a DAG!"
+    return graph
+
+
+def to_shared_temp(sql: str) -> str:
+    """Rewrite temp tables/references so they live in the shared in-memory database."""
+    sql = _CREATE_TEMP_RE.sub("CREATE TABLE", sql)
+    return _TEMP_RELATION_RE.sub(f"{SHARED_TEMP_DB}.main.", sql)
+
+
+def drop_statement(relation: str, materialized: str, shared_temp: bool = True) -> str:
+    kind = "VIEW" if materialized == "VIEW" else "TABLE"
+    if shared_temp:
+        relation = to_shared_temp(relation)
+    return f"DROP {kind} IF EXISTS {relation}"
+
+
+def drop_relation(con, relation: str) -> None:
+    """Drop `relation` whether it is a table or a view (a model may be built as the other one)."""
+    for kind in ("TABLE", "VIEW"):
+        try:
+            con.execute(f"DROP {kind} IF EXISTS {relation}")
+        except duckdb.CatalogException:
+            # DROP TABLE on a view (and vice versa) fails even with IF EXISTS
+            continue
+
+
+class IntermediateRefCounter:
+    """
+    Reference counts the intermediate nodes of a DAG (those created by the
+    rewriter, see `utils._NEW_NODE_REGISTRY`) over their consumers. `release`
+    is called once per finished node (successful, failed or skipped) and
+    returns the intermediates that no remaining node reads anymore.
+    """
+
+    def __init__(self, graph: nx.DiGraph):
+        self.graph = graph
+        self.remaining = {
+            n: graph.out_degree(n)
+            for n, data in graph.nodes(data=True)
+            if data.get("intermediate")
+        }
+
+    def release(self, node_id: str) -> List[str]:
+        dead = []
+        # an intermediate nobody consumes is dead as soon as it exists
+        if self.remaining.get(node_id) == 0:
+            dead.append(node_id)
+        for parent in self.graph.predecessors(node_id):
+            if parent in self.remaining:
+                self.remaining[parent] -= 1
+                if self.remaining[parent] == 0:
+                    dead.append(parent)
+        return dead
+
+
+class MemoryMonitor:
+    """
+    Samples `duckdb_memory()` on its own cursor in a background thread and keeps
+    the high-water mark of buffer-managed memory and temporary storage.
+    """
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, interval_s: float = MEMORY_SAMPLE_INTERVAL_S):
+        self.cur = con.cursor()
+        self.interval_s = interval_s
+        self.peak_memory_bytes = 0
+        self.peak_temp_storage_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def sample(self):
+        mem, tmp = self.cur.execute(
+            "SELECT sum(memory_usage_bytes), sum(temporary_storage_bytes) FROM duckdb_memory()"
+        ).fetchone()
+        self.peak_memory_bytes = max(self.peak_memory_bytes, int(mem or 0))
+        self.peak_temp_storage_bytes = max(self.peak_temp_storage_bytes, int(tmp or 0))
+        return int(mem or 0)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception:
+                pass
+            self._stop.wait(self.interval_s)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        self.cur.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class ParallelDagExecutor:
+    """
+    Executes a DAG on `max_workers` DuckDB cursors of one database instance.
+
+    Ready nodes are started in ascending `priority` (defaults to the emitted
+    topological order). DuckDB's `threads` setting is per database instance,
+    not per connection, so `threads_per_node` is applied as a total budget of
+    `max_workers * threads_per_node` threads shared by the concurrent nodes.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        graph: nx.DiGraph,
+        max_workers: int = 4,
+        threads_per_node: int = 1,
+        priority: Optional[Dict[str, float]] = None,
+        early_drop: bool = True,
+        cache=None,
+    ):
+        self.db_path = db_path
+        self.graph = graph
+        self.max_workers = max(1, max_workers)
+        self.threads_per_node = max(1, threads_per_node)
+        self.priority = priority or {
+            n: data.get("topo_index", 0) for n, data in graph.nodes(data=True)
+        }
+        self.early_drop = early_drop
+        # result_cache.ResultCache with the keys of this DAG, or None
+        self.cache = cache
+
+    def _run_node(self, cursors: "queue.Queue", node_id: str, start_ref_ns: int) -> NodeTiming:
+        data = self.graph.nodes[node_id]
+        timing = NodeTiming(node_id=node_id, relation=data["relation"])
+        restore = None
+        if self.cache is not None:
+            restore = self.cache.restore_statement(node_id, data["relation"], data["materialized"])
+        if restore is not None:
+            sql = to_shared_temp(restore)
+            timing.cached = True
+        else:
+            with open(data["sql_file"], "r") as f:
+                sql = to_shared_temp(f.read())
+        worker, cur = cursors.get()
+        timing.worker = worker
+        try:
+            drop_relation(cur, to_shared_temp(data["relation"]))
+            timing.start_ns = time.perf_counter_ns() - start_ref_ns
+            cur.execute(sql)
+            timing.end_ns = time.perf_counter_ns() - start_ref_ns
+            if self.cache is not None and restore is None:
+                self.cache.store(cur, node_id, to_shared_temp(data["relation"]), data["materialized"])
+        except Exception as e:
+            timing.end_ns = time.perf_counter_ns() - start_ref_ns
+            timing.error = str(e)
+        finally:
+            cursors.put((worker, cur))
+        return timing
+
+    def run(self) -> DagRunResult:
+        result = DagRunResult()
+        con = duckdb.connect(self.db_path)
+        con.execute(f"SET threads = {self.max_workers * self.threads_per_node};")
+        con.execute(f"ATTACH ':memory:' AS {SHARED_TEMP_DB};")
+        cursors: "queue.Queue" = queue.Queue()
+        for worker in range(self.max_workers):
+            cur = con.cursor()
+            # unqualified references (e.g. shared_cte_*) resolve like temp tables do
+            cur.execute(f"SET search_path = 'main,{SHARED_TEMP_DB}.main';")
+            cursors.put((worker, cur))
+        refs = IntermediateRefCounter(self.graph)
+
+        remaining = {n: self.graph.in_degree(n) for n in self.graph.nodes}
+        ready = [(self.priority[n], n) for n, deg in remaining.items() if deg == 0]
+        heapq.heapify(ready)
+        failed = set()
+        running = {}
+
+        start_ref_ns = time.perf_counter_ns()
+        with MemoryMonitor(con) as monitor, ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while ready or running:
+                while ready and len(running) < self.max_workers:
+                    _, node_id = heapq.heappop(ready)
+                    if any(p in failed for p in self.graph.predecessors(node_id)):
+                        print(f"[WARN] Skipping {node_id}: an upstream node failed")
+                        failed.add(node_id)
+                        result.timings[node_id] = NodeTiming(
+                            node_id=node_id,
+                            relation=self.graph.nodes[node_id]["relation"],
+                            error="upstream failure",
+                        )
+                        self._release_children(node_id, remaining, ready)
+                        self._drop_dead(con, refs.release(node_id), result)
+                        continue
+                    result.start_order.append(node_id)
+                    running[pool.submit(self._run_node, cursors, node_id, start_ref_ns)] = node_id
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    node_id = running.pop(fut)
+                    timing = fut.result()
+                    result.timings[node_id] = timing
+                    if timing.error is not None:
+                        print(f"[ERROR] Node {node_id} failed: {timing.error}")
+                        failed.add(node_id)
+                    else:
+                        print(f"[INFO] {'Restored' if timing.cached else 'Finished'} {node_id} "
+                              f"on worker {timing.worker} in {timing.wall_ns / 1e6:.3f} ms")
+                    self._release_children(node_id, remaining, ready)
+                    self._drop_dead(con, refs.release(node_id), result)
+        result.wall_ns = time.perf_counter_ns() - start_ref_ns
+        result.peak_memory_bytes = monitor.peak_memory_bytes
+        result.peak_temp_storage_bytes = monitor.peak_temp_storage_bytes
+
+        con.execute(f"DETACH {SHARED_TEMP_DB};")
+        con.close()
+        return result
+
+    def _drop_dead(self, con, dead, result):
+        if not self.early_drop:
+            return
+        for node_id in dead:
+            data = self.graph.nodes[node_id]
+            try:
+                con.execute(drop_statement(data["relation"], data["materialized"]))
+                result.dropped.append(node_id)
+                print(f"[INFO] Dropped intermediate {node_id}: last consumer finished")
+            except Exception as e:
+                print(f"[WARN] Could not drop intermediate {node_id}: {e}")
+
+    def _release_children(self, node_id, remaining, ready):
+        for child in self.graph.successors(node_id):
+            remaining[child] -= 1
+            if remaining[child] == 0:
+                heapq.heappush(ready, (self.priority[child], child))
@@ -0,0 +1,85 @@
+"""
+Dead-node elimination for the rewritten DAG.
+
+`gather_subgraph` selects a set of models plus everything upstream of them, and
+every node of it used to be built. After rewriting, some of those nodes are
+not read by anything that is needed any more: a view parent whose query was
+pushed into its children's `*_pushdown` node, an intermediate node whose
+consumers were rewritten again, an ephemeral model (dbt already compiled it
+into its consumers as a CTE). This pass marks the required output set, the
+target models (by default the final models of the dbt DAG, i.e. those no other
+model depends on) and everything they transitively read, and drops all other
+nodes from the graph and the ASTs so they are never emitted. The optimizer
+lists the models skipped this way in PRUNED_MODELS_FILE; `check_correctness.py`
+does not expect optimized results for them.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Set
+
+import networkx as nx
+from sqlglot import exp
+
+from utils import materialization, remove_new_node
+
+# relations of the models the optimized DAG does not build
+PRUNED_MODELS_FILE = "pruned_models_optimized.txt"
+
+
+def final_models(graph: nx.DiGraph) -> Set[str]:
+    """Models no other model of `graph` depends on."""
+    return {n for n in graph.nodes if graph.out_degree(n) == 0}
+
+
+def resolve_targets(graph: nx.DiGraph, names: Iterable[str]) -> Set[str]:
+    """Node ids for target names, given as node ids or model names."""
+    by_name = {}
+    for node in graph.nodes:
+        by_name.setdefault(node.split(".")[-1].lower(), set()).add(node)
+    targets = set()
+    for name in names:
+        if name in graph:
+            targets.add(name)
+        elif name.lower() in by_name:
+            targets |= by_name[name.lower()]
+        else:
+            print(f"[WARN] Unknown target model: {name}")
+    return targets
+
+
+def required_nodes(graph: nx.DiGraph, targets: Set[str]) -> Set[str]:
+    """
+    The targets and every node they transitively read. Ephemeral models are
+    walked through but not required: their consumers' SQL contains them.
+    """
+    required = set()
+    seen = set()
+    stack = [t for t in targets if t in graph]
+    while stack:
+        node = stack.pop()
+        if node in seen:
+            continue
+        seen.add(node)
+        if node in targets or materialization(node) != "ephemeral":
+            required.add(node)
+        stack.extend(graph.predecessors(node))
+    return required
+
+
+def eliminate_dead_nodes(graph: nx.DiGraph, asts: Dict[str, exp.Expression],
+                         targets: Set[str]) -> List[str]:
+    """Remove the nodes no target needs from `graph` and `asts`. Returns them."""
+    required = required_nodes(graph, targets)
+    dead = [n for n in nx.topological_sort(graph) if n not in required]
+    for node in dead:
+        # keep the build order of what an ephemeral model sat between
+        for parent in graph.predecessors(node):
+            for child in graph.successors(node):
+                graph.add_edge(parent, child)
+        graph.remove_node(node)
+        asts.pop(node, None)
+        remove_new_node(node)
+        print(f"[INFO] Dead node {node}: not needed by any target, skipped")
+    print(f"[INFO] Dead-node elimination: {len(required)} required, {len(dead)} skipped nodes")
+    return dead
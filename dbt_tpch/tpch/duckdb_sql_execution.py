@@ -2,11 +2,28 @@
 import os
 import glob
 import duckdb
+import json
+import tempfile
 import time
 import csv
 import platform
 import sys
+import argparse
+import shutil
 from utils import *
+from bench_stats import DEFAULT_CONFIDENCE, summarize
+from dag_executor import (
+    IntermediateRefCounter,
+    MemoryMonitor,
+    ParallelDagExecutor,
+    drop_relation,
+    drop_statement,
+    load_dag,
+)
+from result_cache import DEFAULT_CACHE_BYTES, DEFAULT_CACHE_DIR, ResultCache
+from profile_store import PROFILE_STORE_PATH, ProfileStore, operators, profile_query, query_metrics
+from subresult_catalog import SubresultCatalog, live_schema
+from scheduler import SCHEDULERS, estimate_costs, load_history
 from utils import _NEW_NODE_REGISTRY
 
 # init database
@@ -64,81 +81,245 @@ def summarize_cpuinfo_linux():
     return "[INFO] CPU Summary: " + summary
 
 
-def run_explain_analyze_and_parse_time(db_path, sql, conn):
+def run_and_profile(db_path, sql, conn, profile_path, threads=1):
     """
-    Create a fresh connection, run EXPLAIN ANALYZE on the given SQL, parse the
-    reported total time from DuckDB output, and return it in nanoseconds.
-    Return -1 if we fail to parse the time.
+    Run the given SQL on `threads` DuckDB threads with JSON profiling (see
+    profile_store.py) and return the profile, None if the query failed. Opens
+    a fresh connection if `conn` is None, to avoid caching from the previous run.
     """
-    # open new connection to avoid caching from previous run
     if conn is None:
         con = duckdb.connect(db_path)
     else:
         con = conn
-    con.execute("SET threads = 1;")
-    # We wrap the original SQL with EXPLAIN ANALYZE
-    explain_query = f"EXPLAIN ANALYZE {sql}"
+    con.execute(f"SET threads = {threads};")
     try:
-        rows = con.execute(explain_query).fetchall()
-        total_time_ms = -1
-        for row in rows:
-            for plan_line in row:
-                # print(plan_line)
-                plan_line_lower = plan_line.lower()
-                if "total time:" in plan_line_lower:
-                    # print("Parsed perf: ", plan_line_lower)
-                    right = plan_line_lower.split("total time:", 1)[1].strip()
-                    # right now is "0.0014s             ││..."
-                    # need to extract the number and unit
-                    # e.g. "0.0014s"
-                    # split by whitespace
-                    right = right.split()[0]
-                    print(f"[INFO] Parsed perf: {right}")
-                    val = ""
-                    unit = ""
-                    for c in right:
-                        if c.isdigit() or c == ".":
-                            val += c
-                        else:
-                            unit += c
-                    val = val.strip()
-                    unit = unit.strip()
-                    try:
-                        float_val = float(val)
-                        if unit.startswith("s"):
-                            total_time_ms = int(float_val * 1e3)
-                        elif unit.startswith("ms"):
-                            total_time_ms = int(float_val)
-                        else:
-                            print(f"[WARN] Unknown unit: {unit}")
-                            total_time_ms = -1
-                    except:
-                        pass
-
-                    return total_time_ms
+        return profile_query(con, sql, profile_path)
     except Exception as e:
-        print(f"[ERROR] EXPLAIN ANALYZE failed: {e}")
-        return -1
+        print(f"[ERROR] Profiled run failed: {e}")
+        return None
     finally:
         if conn is None:
             con.close()
 
 
+def dominant_operators(profile, top=3):
+    """The `top` operator types by time in a profile, with their share of the operator time."""
+    seconds = {}
+    for op in operators(profile):
+        seconds[op["type"]] = seconds.get(op["type"], 0.0) + op["seconds"]
+    total = sum(seconds.values()) or 1.0
+    ranked = sorted(seconds.items(), key=lambda item: -item[1])[:top]
+    return [{"type": kind, "ms": sec * 1e3, "share": sec / total} for kind, sec in ranked]
+
+
+def write_run_report(report_path, run_id, mode, nodes):
+    """Per node: the metrics and operators of each profiled run (see profile_store.py)."""
+    with open(report_path, "w") as f:
+        json.dump({"run": run_id, "mode": mode, "nodes": nodes}, f, indent=2)
+    print(f"[INFO] Wrote run report to {report_path}")
+
+
+def run_benchmark(db_path, sql_files, out_tables, warmup, iterations, cache_state, profile_path, threads=1):
+    """
+    Build the whole DAG `warmup` + `iterations` times and time every node from
+    its JSON profile; warmup passes are not recorded. A cold pass runs on a
+    fresh connection, i.e. a new DuckDB instance with an empty buffer pool (the
+    OS page cache is not dropped); warm passes share one connection.
+    Returns ({node: [ms per measured pass]}, [DAG ms per measured pass]), the
+    DAG time being the sum of its node latencies. Passes in which a node
+    failed are left out of the DAG samples.
+    """
+    queries = []
+    for sql_file in sql_files:
+        with open(sql_file, "r") as f:
+            queries.append(f.read())
+    samples = {}
+    dag_samples = []
+    shared_con = duckdb.connect(db_path) if cache_state == "warm" else None
+    for iteration in range(warmup + iterations):
+        measured = iteration >= warmup
+        con = shared_con if shared_con is not None else duckdb.connect(db_path)
+        dag_ms = 0.0
+        complete = True
+        for sql, out_table in zip(queries, out_tables):
+            tb_name = out_table.replace('"', '').split('.')[-1]
+            drop_relation(con, out_table)
+            profile = run_and_profile(db_path, sql, con, profile_path, threads)
+            if profile is None:
+                print(f"[ERROR] {tb_name} failed in benchmark pass {iteration + 1}.")
+                complete = False
+                continue
+            ms = profile.get("latency", 0.0) * 1e3
+            dag_ms += ms
+            if measured:
+                samples.setdefault(tb_name, []).append(ms)
+        if shared_con is None:
+            con.close()
+        kind = "measured" if measured else "warmup"
+        print(f"[INFO] Benchmark pass {iteration + 1}/{warmup + iterations} ({kind}, {cache_state}): "
+              f"DAG {dag_ms:.3f} ms" + ("" if complete else " (incomplete)"))
+        if measured and complete:
+            dag_samples.append(dag_ms)
+    if shared_con is not None:
+        shared_con.close()
+    return samples, dag_samples
+
+
+def write_benchmark_report(mode, settings, samples, dag_samples, confidence):
+    """
+    `{mode}_benchmark.json`: the samples and their summary (bench_stats.py)
+    per node and for the DAG; `{mode}_benchmark.csv`: the summaries.
+    """
+    nodes = {node: dict(summarize(times, confidence), samples_ms=times) for node, times in samples.items()}
+    dag = dict(summarize(dag_samples, confidence), samples_ms=dag_samples)
+    with open(f"{mode}_benchmark.json", "w") as f:
+        json.dump(dict(settings, mode=mode, confidence=confidence, nodes=nodes, dag=dag), f, indent=2)
+
+    columns = ["n", "mean", "median", "p95", "p99", "std", "ci_low", "ci_high"]
+    with open(f"{mode}_benchmark.csv", "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["TableName", "N", "MeanMs", "MedianMs", "P95Ms", "P99Ms", "StdMs", "CILowMs", "CIHighMs"])
+        for name, summary in list(nodes.items()) + [("DAG", dag)]:
+            writer.writerow([name] + [summary.get(c) if c == "n" or summary.get(c) is None
+                                      else f"{summary[c]:.3f}" for c in columns])
+    if dag["n"]:
+        ci = f", {confidence:.0%} CI [{dag['ci_low']:.3f}, {dag['ci_high']:.3f}]" if dag["ci_low"] is not None else ""
+        print(f"[INFO] DAG over {dag['n']} passes: mean {dag['mean']:.3f} ms, median {dag['median']:.3f} ms, "
+              f"p95 {dag['p95']:.3f} ms, std {dag['std']:.3f} ms{ci}")
+    print(f"[INFO] Wrote {mode}_benchmark.json and {mode}_benchmark.csv")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["optimized", "not_optimized"])
+    parser.add_argument("--no-save-results", action="store_true",
+                        help="Skip dumping the final materialized tables")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Run independent DAG nodes concurrently instead of one after another")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Number of nodes executed concurrently in --parallel mode")
+    parser.add_argument("--threads-per-node", type=int, default=1,
+                        help="DuckDB threads budgeted per concurrent node in --parallel mode")
+    parser.add_argument("--scheduler", choices=sorted(SCHEDULERS), default="critical-path",
+                        help="Which ready node to start first in --parallel mode")
+    parser.add_argument("--history",
+                        help="Previous *_bench_mark_results.csv used for node cost estimates "
+                             "(defaults to the last results of this mode, if any)")
+    parser.add_argument("--no-early-drop", action="store_true",
+                        help="Keep intermediate temp tables alive until the end of the run")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Restore nodes whose SQL and inputs did not change since a previous run "
+                             "from cached Parquet results (see result_cache.py)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory of the result cache")
+    parser.add_argument("--cache-size-mb", type=int, default=DEFAULT_CACHE_BYTES // 2**20,
+                        help="Size of the result cache; least recently used results are evicted beyond it")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record the operator-level profile of each node's last run, serial mode only "
+                             "(see profile_store.py and calibration.py)")
+    parser.add_argument("--profile-store", default=PROFILE_STORE_PATH,
+                        help="File the operator profiles are appended to")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="DuckDB threads per node in serial and --benchmark mode")
+    parser.add_argument("--database",
+                        help="Copy this prebuilt database (e.g. from benchmark_sweep.py) instead of "
+                             "initializing one from ddl.sql")
+    parser.add_argument("--runs", type=int, default=2,
+                        help="Timed runs per node in the default mode; their times are summed")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Time whole-DAG passes repeatedly and report per-node and DAG statistics "
+                             "with confidence intervals (see bench_stats.py)")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="Unrecorded DAG passes before the measured ones in --benchmark mode")
+    parser.add_argument("--iterations", type=int, default=10,
+                        help="Measured DAG passes in --benchmark mode")
+    parser.add_argument("--cache-state", choices=["cold", "warm"], default="cold",
+                        help="cold: a fresh DuckDB connection per pass, warm: one connection for all passes")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE,
+                        help="Confidence level of the bootstrap intervals in --benchmark mode")
+    return parser.parse_args()
+
+
+def write_parallel_results(csv_path, result, schedule):
+    """
+    Per-node start/end/wall time of a parallel DAG run, in start order, next to
+    the scheduler's expected cost, followed by the actual and predicted makespan.
+    """
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["TableName", "Worker", "StartMs", "EndMs", "WallTimeMs", "ExpectedMs"])
+        skipped = [n for n in result.timings if n not in result.start_order]
+        for node_id in result.start_order + skipped:
+            timing = result.timings[node_id]
+            tb_name = timing.relation.replace('"', '').split('.')[-1]
+            wall_ms = f"{timing.wall_ns / 1e6:.3f}" if timing.wall_ns >= 0 else -1
+            writer.writerow([tb_name, timing.worker, f"{timing.start_ns / 1e6:.3f}",
+                             f"{timing.end_ns / 1e6:.3f}", wall_ms,
+                             f"{schedule.costs_ms[node_id]:.3f}"])
+        writer.writerow([])
+        writer.writerow(["DAG", "", "", "", f"{result.wall_ns / 1e6:.3f}", ""])
+        writer.writerow(["PredictedDAG", "", "", "", "", f"{schedule.predicted_makespan_ms:.3f}"])
+
+
+def write_memory_report(csv_path, run_kind, early_drop, peak_memory_bytes,
+                        peak_temp_storage_bytes, dropped):
+    """High-water mark of DuckDB memory (duckdb_memory()) over one DAG run."""
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Run", "EarlyDrop", "PeakMemoryBytes", "PeakTempStorageBytes",
+                         "DroppedIntermediates"])
+        writer.writerow([run_kind, early_drop, peak_memory_bytes, peak_temp_storage_bytes,
+                         len(dropped)])
+    print(f"[INFO] Peak DuckDB memory: {peak_memory_bytes / 2**20:.2f} MiB, "
+          f"peak temp storage: {peak_temp_storage_bytes / 2**20:.2f} MiB "
+          f"(early drop: {early_drop}, {len(dropped)} intermediates dropped)")
+
+
+def dump_materialized_results(db_path, materialized_tables_file, results_dir):
+    os.makedirs(results_dir, exist_ok=True)
+
+    final_con = duckdb.connect(db_path)
+    with open(materialized_tables_file, "r") as f:
+        lines = f.readlines()
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        # line example:  "dev"."main"."q06"
+        table_fqn = line
+        cleaned = table_fqn.replace('"', '')
+        final_name = cleaned.split('.')[-1]
+        out_filename = os.path.join(results_dir, f"{final_name}.result")
+        select_stmt = f"SELECT * FROM {table_fqn}"
+
+        try:
+            print(f"[INFO] Querying {table_fqn} -> writing to {out_filename}")
+            results = final_con.execute(select_stmt).fetchall()
+            with open(out_filename, "w") as out_file:
+                if results:
+                    for row in results:
+                        out_file.write(str(row) + "\n")
+                else:
+                    out_file.write("[No rows returned]\n")
+
+        except Exception as e:
+            print(f"[ERROR selecting from {table_fqn}]: {e}")
+            with open(out_filename, "w") as out_file:
+                out_file.write(f"[ERROR selecting from {table_fqn}]: {e}")
+
+    final_con.close()
+
+
 def main():
 
+    # expect a single positional argument: either "optimized" or "not_optimized"
+    args = parse_args()
     # set the number of executions
-    exec_ct = 2
-    
-    # expect a single argument: either "optimized" or "not_optimized"
-    if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <optimized|not_optimized>")
-        sys.exit(1)
-    mode = sys.argv[1]
-    if mode not in ["optimized", "not_optimized"]:
-        print(f"[ERROR] Invalid argument: {mode}")
-        print("Please pass either 'optimized' or 'not_optimized'.")
-        sys.exit(1)
-    skip_results = "--no-save-results" in sys.argv
+    exec_ct = args.runs
+    mode = args.mode
+    skip_results = args.no_save_results
     sql_dir = f"{mode}_sql"
     results_dir = f"{mode}_results"
     db_path = "dev.duckdb"
@@ -155,13 +336,29 @@ def main():
     else:
         print("[INFO] Should manually check CPU info")
     print("")
+    dag_file = "dag_optimized.json" if mode == "optimized" else "dag.json"
     if os.path.exists("dev.duckdb"):
         print("Clearing previous database file for new performance evaluation")
         os.remove("dev.duckdb")
 
 
+    if args.database:
+        print(f"Copying prebuilt database {args.database}")
+        shutil.copyfile(args.database, db_path)
     con = duckdb.connect(db_path)
-    execute_ddl_data_init(con, ddl_script)
+    if not args.database:
+        execute_ddl_data_init(con, ddl_script)
+    cache = None
+    if args.result_cache:
+        if os.path.isfile(dag_file):
+            # the catalog records what each cached result is, for later optimizer runs
+            catalog = SubresultCatalog(args.cache_dir)
+            cache = ResultCache(args.cache_dir, args.cache_size_mb * 2**20, catalog=catalog)
+            cache_graph = load_dag(dag_file)
+            cache.compute_keys(con, cache_graph)
+            catalog.define(cache_graph, live_schema(con), cache.versions)
+        else:
+            print(f"[WARN] {dag_file} not found; running without the result cache.")
     con.close()
 
     topo_sort_file = "topo_sort_order.txt"
@@ -171,16 +368,90 @@ def main():
     if(mode == "optimized"):
         materialized_tables_file = "materialized_tables_optimized.txt"
 
+    memory_report = f"{mode}_memory_report.csv"
+    early_drop = not args.no_early_drop
+
+    if args.benchmark:
+        if args.parallel or cache is not None:
+            print("[WARN] --parallel and --result-cache are ignored in --benchmark mode")
+        with open(topo_sort_file, "r") as f:
+            sql_files = [line.strip() for line in f if line.strip()]
+        with open(materialized_tables_file, "r") as f:
+            sql_out_tables = [line.strip() for line in f if line.strip()]
+        print(f"[INFO] Benchmarking {len(sql_files)} nodes: {args.warmup} warmup and "
+              f"{args.iterations} measured passes, {args.cache_state} cache, {args.threads} thread(s)")
+        profile_fd, profile_path = tempfile.mkstemp(prefix="duckdb_profile_", suffix=".json")
+        os.close(profile_fd)
+        samples, dag_samples = run_benchmark(db_path, sql_files, sql_out_tables, args.warmup,
+                                             args.iterations, args.cache_state, profile_path, args.threads)
+        os.remove(profile_path)
+        settings = {"warmup": args.warmup, "iterations": args.iterations, "cache_state": args.cache_state,
+                    "threads": args.threads}
+        write_benchmark_report(mode, settings, samples, dag_samples, args.confidence)
+        if not skip_results:
+            dump_materialized_results(db_path, materialized_tables_file, results_dir)
+        return
+
+    if args.parallel:
+        graph = load_dag(dag_file)
+        print(f"[INFO] Running {len(graph)} nodes from {dag_file} with {args.workers} workers, "
+              f"{args.threads_per_node} thread(s) per node")
+        parallel_csv = f"{mode}_parallel_bench_mark_results.csv"
+        serial_csv = "optimized_bench_mark_results.csv" if mode == "optimized" \
+            else "unoptimized_bench_mark_results.csv"
+        if args.history:
+            history = load_history(args.history)
+        elif os.path.isfile(parallel_csv):
+            history = load_history(parallel_csv)
+        else:
+            history = load_history(serial_csv, runs_per_value=exec_ct)
+        costs = estimate_costs(graph, db_path, history)
+        schedule = SCHEDULERS[args.scheduler](graph, costs, args.workers)
+        print(f"[INFO] {args.scheduler} schedule, predicted start order: {schedule.predicted_order}")
+
+        executor = ParallelDagExecutor(db_path, graph, args.workers, args.threads_per_node,
+                                       priority=schedule.priority, early_drop=early_drop, cache=cache)
+        result = executor.run()
+        if cache is not None:
+            cache.save()
+        print(f"[INFO] Actual start order: {result.start_order}")
+        print(f"[INFO] DAG wall time: {result.wall_ns / 1e6:.3f} ms "
+              f"(predicted makespan: {schedule.predicted_makespan_ms:.3f} ms)")
+        write_parallel_results(parallel_csv, result, schedule)
+        write_memory_report(memory_report, "parallel", early_drop, result.peak_memory_bytes,
+                            result.peak_temp_storage_bytes, result.dropped)
+        if not skip_results:
+            dump_materialized_results(db_path, materialized_tables_file, results_dir)
+        return
+
     with open(topo_sort_file, "r") as f:
         sql_files = [line.strip() for line in f if line.strip()]
     with open(materialized_tables_file, "r") as f:
         sql_out_tables = [line.strip() for line in f if line.strip()]
 
     creation_times = []
+    store = ProfileStore(args.profile_store) if args.profile else None
+    run_id = time.strftime("%Y%m%dT%H%M%S")
+    # per node: metrics and operators of every timed run
+    report_nodes = []
+    profile_fd, profile_path = tempfile.mkstemp(prefix="duckdb_profile_", suffix=".json")
+    os.close(profile_fd)
     # if existing temporary tables, we should not create new connections
     # manually toggle for now
     reuse = True
     shared_con = duckdb.connect(db_path)
+
+    # drop intermediate temp tables once their last consumer ran (needs the DAG file)
+    refs = None
+    node_by_sql = {}
+    if (early_drop or cache is not None) and os.path.isfile(dag_file):
+        dag_graph = load_dag(dag_file)
+        node_by_sql = {data["sql_file"]: n for n, data in dag_graph.nodes(data=True)}
+        if early_drop:
+            refs = IntermediateRefCounter(dag_graph)
+    dropped = []
+    monitor = MemoryMonitor(shared_con).start()
+    dag_start_ns = time.perf_counter_ns()
     
     for idx, sql_file in enumerate(sql_files):
         out_table = sql_out_tables[idx]
@@ -189,60 +460,95 @@ def main():
             sql_statements = f.read()
 
         total_time_ms = 0
-        for _ in range(exec_ct):
+        failed = False
+        runs = []
+        # make out table name more readable
+        tb_name = out_table.replace('"', '').split('.')[-1]
+        node_id = node_by_sql.get(sql_file)
+        restore = None
+        if cache is not None and node_id is not None:
+            data = dag_graph.nodes[node_id]
+            restore = cache.restore_statement(node_id, data["relation"], data["materialized"])
+        if restore is not None:
+            # unchanged since a previous run: restore once instead of computing
+            drop_relation(shared_con, out_table)
+            start_ns = time.perf_counter_ns()
+            shared_con.execute(restore)
+            total_time_ms = (time.perf_counter_ns() - start_ns) / 1e6
+            print(f"[INFO] Restored {out_table} from the result cache in {total_time_ms:.3f} ms")
+            report_nodes.append({"node": tb_name, "node_id": node_id, "sql_file": sql_file,
+                                 "restored_ms": total_time_ms})
+        for run in range(exec_ct if restore is None else 0):
             # new connection to avoid reuse caching 
+            # the output may be a view, or a table dbt built as a view (and vice versa)
             if not reuse:
                 tmp_con = duckdb.connect(db_path)
-                
-                drop_stmt = f"DROP TABLE IF EXISTS {out_table}"
                 try:
-                    tmp_con.execute(drop_stmt)
+                    drop_relation(tmp_con, out_table)
                 except Exception as e:
                     print(f"[WARN] Error dropping table {out_table}: {e}")
                 finally:
                     tmp_con.close()
             else:
-                drop_stmt = f"DROP TABLE IF EXISTS {out_table}"
                 try:
-                    shared_con.execute(drop_stmt)
+                    drop_relation(shared_con, out_table)
                 except Exception as e:
                     print(f"[WARN] Error dropping table {out_table}: {e}")
 
-            # measure execution time with EXPLAIN ANALYZE
+            # measure execution time from DuckDB's JSON profile
             # note that the query presumably creates table {out_table}
             if reuse:
                 print(f"[INFO] Running {sql_file} with shared connection........")
-                query_time_ns = run_explain_analyze_and_parse_time(db_path, sql_statements, shared_con)
-            else:
-                query_time_ns = run_explain_analyze_and_parse_time(db_path, sql_statements, None)
+            profile = run_and_profile(db_path, sql_statements, shared_con if reuse else None, profile_path,
+                                      args.threads)
+            if profile is None:
+                print(f"[ERROR] Failed to run {sql_file}.")
+                failed = True
+                total_time_ms = -1
+                break
+            total_time_ms += profile.get("latency", 0.0) * 1e3
+            runs.append(dict(query_metrics(profile), operators=operators(profile)))
+            if store is not None and run == exec_ct - 1:
+                store.record(run_id, mode, tb_name, profile, threads=args.threads)
+        if runs:
+            top = dominant_operators(profile)
+            print(f"[INFO] {tb_name}: {runs[-1]['latency_ms']:.3f} ms, operator time by type: "
+                  + ", ".join(f"{op['type']} {op['share']:.0%}" for op in top))
+            report_nodes.append({
+                "node": tb_name,
+                "node_id": node_id,
+                "sql_file": sql_file,
+                "dominant_operators": top,
+                "runs": runs,
+            })
+
+        if cache is not None and node_id is not None and restore is None and not failed:
+            cache.store(shared_con, node_id, out_table, dag_graph.nodes[node_id]["materialized"])
+
+        # record the total creation time across exec_ct runs
+        creation_times.append((tb_name, total_time_ms))
 
-            if query_time_ns < 0:
-                print(f"[ERROR] Failed to parse duckdb query profiling time for {sql_file}.")
-                fallback_con = duckdb.connect(db_path)
-                drop_stmt = f"DROP TABLE IF EXISTS {out_table}"
-                try:
-                    fallback_con.execute(drop_stmt)
-                except:
-                    pass
-                start_ns = time.time_ns()
+        if refs is not None and sql_file in node_by_sql:
+            for dead in refs.release(node_by_sql[sql_file]):
+                data = dag_graph.nodes[dead]
                 try:
-                    fallback_con.execute(sql_statements)
-                except Exception as ex:
-                    print(f"[ERROR executing {sql_file} in fallback mode]: {ex}")
-                    # if still failed, simply set time as -1
-                    total_time_ms = -1
-                    break
-                end_ns = time.time_ns()
-                fallback_con.close()
-
-                query_time_ns = end_ns - start_ns
-
-            total_time_ms += query_time_ns
-
-        # make out table name more readable
-        tb_name = out_table.replace('"', '').split('.')[-1]
-        # record the total creation time across 10 runs
-        creation_times.append((tb_name, total_time_ms))
+                    shared_con.execute(
+                        drop_statement(data["relation"], data["materialized"], shared_temp=False))
+                    dropped.append(dead)
+                    print(f"[INFO] Dropped intermediate {dead}: last consumer finished")
+                except Exception as e:
+                    print(f"[WARN] Could not drop intermediate {dead}: {e}")
+    dag_wall_ms = (time.perf_counter_ns() - dag_start_ns) / 1e6
+    print(f"[INFO] DAG wall time ({exec_ct} runs per node): {dag_wall_ms:.3f} ms")
+    monitor.stop()
+    if cache is not None:
+        cache.save()
+    os.remove(profile_path)
+    write_run_report(f"{mode}_run_report.json", run_id, mode, report_nodes)
+    if store is not None:
+        print(f"[INFO] Recorded operator profiles of run {run_id} in {args.profile_store}")
+    write_memory_report(memory_report, "serial", refs is not None, monitor.peak_memory_bytes,
+                        monitor.peak_temp_storage_bytes, dropped)
 
     if mode == "optimized":
         creation_csv = "optimized_bench_mark_results.csv"
@@ -251,45 +557,11 @@ def main():
 
     with open(creation_csv, "w", newline="") as csv_file:
         writer = csv.writer(csv_file)
-        writer.writerow(["TableName", "TotalCreationTimeMs(10runs)"])
-        for table_name, total_ns in creation_times:
-            writer.writerow([table_name, total_ns])
+        writer.writerow(["TableName", f"TotalCreationTimeMs({exec_ct}runs)"])
+        for table_name, total_ms in creation_times:
+            writer.writerow([table_name, f"{total_ms:.3f}" if total_ms >= 0 else -1])
     if not skip_results:
-        os.makedirs(results_dir, exist_ok=True)
-
-        final_con = duckdb.connect(db_path)
-        with open(materialized_tables_file, "r") as f:
-            lines = f.readlines()
-
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-
-            # line example:  "dev"."main"."q06"
-            table_fqn = line
-            cleaned = table_fqn.replace('"', '')
-            final_name = cleaned.split('.')[-1]
-            out_filename = os.path.join(results_dir, f"{final_name}.result")
-            select_stmt = f"SELECT * FROM {table_fqn}"
-
-            try:
-                print(f"[INFO] Querying {table_fqn} -> writing to {out_filename}")
-                results = final_con.execute(select_stmt).fetchall()
-                with open(out_filename, "w") as out_file:
-                    if results:
-                        for row in results:
-                            out_file.write(str(row) + "\n")
-                    else:
-                        out_file.write("[No rows returned]\n")
-
-            except Exception as e:
-                print(f"[ERROR selecting from {table_fqn}]: {e}")
-                with open(out_filename, "w") as out_file:
-                    out_file.write(f"[ERROR selecting from {table_fqn}]: {e}")
-
-        final_con.close()
-
+        dump_materialized_results(db_path, materialized_tables_file, results_dir)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,158 @@
+"""
+Semantic fingerprints of SQL subtrees.
+
+Structural equality of sqlglot expressions is sensitive to spelling: table
+aliases, whether columns are qualified, `a = b` vs `b = a`, operand order of
+AND/OR, `DATE '...'` vs `CAST(... AS DATE)`, and so on. Two models that compute
+the same join or aggregate therefore rarely compare equal.
+
+`canonicalize` rewrites a copy of a subtree into a normal form:
+  1. tables and columns are fully qualified (`sqlglot.optimizer.qualify`), using
+     the DuckDB catalog as schema so unqualified columns of joins resolve
+  2. table/subquery aliases are renamed positionally per scope (`_s0_t0`, ...)
+  3. predicates are CNF-normalized and simplified (`sqlglot.optimizer`)
+  4. operands of commutative operators (AND, OR, =, <>) are sorted and numeric
+     literals compared by a predicate are normalized (`x > 1.0` == `x > 1`);
+     elsewhere they keep their spelling, which DuckDB types by (`x * 2` is
+     not `x * 2.0`)
+`fingerprint` is the SHA-256 of the canonical SQL. Equal fingerprints mean the
+subtrees compute the same relation (up to the normalizations above); different
+fingerprints do not prove the opposite.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Optional
+
+import duckdb
+import sqlglot.optimizer.normalize
+import sqlglot.optimizer.simplify
+from sqlglot import exp
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.optimizer.scope import traverse_scope
+from sqlglot.schema import MappingSchema
+
+from utils import REWRITER_DIALECT
+
+CATALOG_DB_PATH = "dev.duckdb"
+DEFAULT_CATALOG = "dev"
+DEFAULT_SCHEMA = "main"
+
+_SCHEMA_CACHE: Dict[str, dict] = {}
+_MAPPING_SCHEMA_CACHE: Dict[str, MappingSchema] = {}
+
+
+def catalog_schema(db_path: str = CATALOG_DB_PATH) -> dict:
+    """
+    `{catalog: {schema: {table: {column: type}}}}` of the tables/views in the
+    DuckDB file, loaded once per process. Empty if the database does not exist.
+    """
+    if db_path in _SCHEMA_CACHE:
+        return _SCHEMA_CACHE[db_path]
+    schema: dict = {}
+    if os.path.isfile(db_path):
+        try:
+            con = duckdb.connect(db_path, read_only=True)
+            rows = con.execute(
+                "SELECT table_catalog, table_schema, table_name, column_name, data_type "
+                "FROM information_schema.columns ORDER BY ordinal_position"
+            ).fetchall()
+            con.close()
+            for catalog, db, table, column, dtype in rows:
+                schema.setdefault(catalog, {}).setdefault(db, {}).setdefault(table, {})[column] = dtype
+        except Exception as e:
+            print(f"[WARN] Could not read catalog of {db_path}: {e}")
+    _SCHEMA_CACHE[db_path] = schema
+    return schema
+
+
+def _mapping_schema(db_path: str = CATALOG_DB_PATH) -> Optional[MappingSchema]:
+    # building a MappingSchema is not free; share one per catalog
+    if db_path not in _MAPPING_SCHEMA_CACHE:
+        schema = catalog_schema(db_path)
+        _MAPPING_SCHEMA_CACHE[db_path] = MappingSchema(schema, dialect=REWRITER_DIALECT) if schema else None
+    return _MAPPING_SCHEMA_CACHE[db_path]
+
+
+def _rename_aliases(expr: exp.Expression) -> exp.Expression:
+    """Rename source aliases positionally per scope and retarget the columns using them."""
+    for scope_idx, scope in enumerate(traverse_scope(expr)):
+        mapping = {}
+        for source_idx, (alias, (node, _)) in enumerate(scope.selected_sources.items()):
+            # derived tables are listed by their query; the alias sits on the Subquery
+            if isinstance(node, exp.Query) and isinstance(node.parent, exp.Subquery):
+                node = node.parent
+            if not isinstance(node, (exp.Table, exp.Subquery)) or not node.alias:
+                continue
+            new_alias = f"_s{scope_idx}_t{source_idx}"
+            mapping[alias] = new_alias
+            node.set("alias", exp.TableAlias(this=exp.to_identifier(new_alias)))
+        for column in scope.columns:
+            if column.table in mapping:
+                column.set("table", exp.to_identifier(mapping[column.table]))
+    return expr
+
+
+def _sort_commutative(expr: exp.Expression) -> exp.Expression:
+    for node in list(expr.walk(bfs=False)):
+        # only where it is compared: elsewhere `2` and `2.0` type the result differently
+        if isinstance(node, exp.Literal) and not node.is_string and isinstance(node.parent, exp.Predicate):
+            try:
+                node.set("this", format(Decimal(node.this).normalize(), "f"))
+            except InvalidOperation:
+                pass
+    # bottom-up, so parents are sorted by the canonical form of their operands
+    for node in reversed(list(expr.walk(bfs=True))):
+        if isinstance(node, (exp.EQ, exp.NEQ)):
+            left, right = sorted([node.left, node.right], key=lambda e: e.sql(dialect=REWRITER_DIALECT))
+            node.set("this", left)
+            node.set("expression", right)
+        elif isinstance(node, exp.Connector) and not isinstance(node.parent, type(node)):
+            operands = sorted(node.flatten(), key=lambda e: e.sql(dialect=REWRITER_DIALECT))
+            connector = exp.and_ if isinstance(node, exp.And) else exp.or_
+            sorted_node = connector(*operands, copy=False)
+            if node is expr:
+                expr = sorted_node
+            else:
+                node.replace(sorted_node)
+    return expr
+
+
+def canonicalize(expr: exp.Expression, schema: Optional[dict] = None) -> exp.Expression:
+    """Canonical form of a copy of `expr` (a query or a predicate)."""
+    expr = expr.copy()
+    if isinstance(expr, (exp.CTE, exp.Subquery)):
+        expr = expr.this
+    schema = _mapping_schema() if schema is None else (schema or None)
+    if isinstance(expr, exp.Query):
+        try:
+            expr = qualify(
+                expr,
+                dialect=REWRITER_DIALECT,
+                schema=schema,
+                catalog=DEFAULT_CATALOG,
+                db=DEFAULT_SCHEMA,
+                validate_qualify_columns=False,
+                quote_identifiers=False,
+                identify=False,
+            )
+        except Exception:
+            # unknown tables/columns: fall back to the unqualified tree
+            pass
+        expr = _rename_aliases(expr)
+        for node in expr.find_all(exp.Identifier):
+            node.set("quoted", False)
+        for join in expr.find_all(exp.Join):
+            if (join.kind or "").upper() == "INNER":
+                join.set("kind", None)
+    expr = sqlglot.optimizer.normalize.normalize(expr, dnf=False)
+    expr = sqlglot.optimizer.simplify.simplify(expr)
+    return _sort_commutative(expr)
+
+
+def fingerprint(expr: exp.Expression, schema: Optional[dict] = None) -> str:
+    canonical = canonicalize(expr, schema)
+    return hashlib.sha256(canonical.sql(dialect=REWRITER_DIALECT).encode()).hexdigest()
@@ -5,6 +5,7 @@ import sqlglot
 from sqlglot import exp
 
 from utils import *
+from ast_cache import parse_file_cached, cache_stats
 import argparse
 
 # tables materialized as output from sqls 
@@ -13,6 +14,12 @@ materialized_table_list = []
 # topo sort order of sql files
 topo_sort_order = []
 
+# executable DAG (sql file, output relation, parents) for the parallel executor
+dag_nodes = []
+
+# relation name -> materialized type
+relation_materialization = {}
+
 def build_full_graph(manifest):
     """Build a full DAG of all models from the manifest."""
     G = nx.DiGraph()
@@ -88,6 +95,7 @@ def rewrite_ast_to_create_table(ast_obj, table_name, materialized_required_info)
     
     if materialized_type == "TABLE":
         materialized_table_list.append(table_name)
+    relation_materialization[table_name] = materialized_type
 
     # We'll build a new CREATE TABLE expression:
     create_expr = exp.Create(
@@ -157,10 +165,8 @@ def main(folder_name=None):
         output_folder = "not_optimized_sql"
         os.makedirs(output_folder, exist_ok=True)
         if cpath and os.path.isfile(cpath):
-            with open(cpath) as f:
-                sql_str = f.read()
             try:
-                ast = sqlglot.parse_one(sql_str)
+                ast = parse_file_cached(cpath)
                 # print(f"\n---\nParsed AST for [{node_id}]:\n{ast.to_s()}")
                 node_data = manifest["nodes"][node_id]
                 dbt_relation_name = node_data.get("relation_name")
@@ -176,10 +182,19 @@ def main(folder_name=None):
                 print(f"[INFO] Wrote optimized SQL to: {out_path}\n")
                 relative_path = os.path.relpath(out_path, start=os.getcwd())
                 topo_sort_order.append(relative_path)
+                dag_nodes.append({
+                    "node_id": node_id,
+                    "sql_file": relative_path,
+                    "relation": dbt_relation_name,
+                    "materialized": relation_materialization[dbt_relation_name],
+                    "intermediate": False,
+                    "parents": [p for p in subG.predecessors(node_id) if p in manifest["nodes"]],
+                })
                 
             except Exception as e:
                 print(f"[WARN] Could not parse [{node_id}]: {e}")
     
+    print(f"[INFO] AST cache: {cache_stats()}")
     print("Log all materialized tables")
     with open("materialized_tables.txt", "w") as f:
         for item in materialized_table_list:
@@ -190,6 +205,9 @@ def main(folder_name=None):
         for sql_path in topo_sort_order:
             f.write(sql_path + "\n")
 
+    print("Log executable DAG")
+    write_dag_file("dag.json", dag_nodes)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
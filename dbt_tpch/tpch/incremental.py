@@ -0,0 +1,183 @@
+"""
+Incremental re-optimization.
+
+After every optimizer run a snapshot of the inputs and outputs is saved:
+  * a signature per model (dbt checksum, materialization, compiled SQL) and its
+    manifest dependencies
+  * the rewritten graph, the intermediate nodes created by rules and the
+    emitted SQL file / relation of every node
+  * the rewrite groups: for every applied rule, the nodes it touched
+
+On the next run the new manifest is diffed against the snapshot. Only the
+neighbourhood of the changed models (the changed nodes, their parents and their
+children) is reset to its compiled SQL and re-matched by the rules. The reset is
+closed over the rewrite groups, since a rule application that touched an
+affected node has to be redone as a whole. All other nodes keep their
+previously emitted `optimized_sql/*.sql`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+import networkx as nx
+import sqlglot
+from sqlglot import exp
+
+from ast_cache import parse_file_cached
+from utils import (
+    REWRITER_DIALECT,
+    NewNodeRecord,
+    get_compiled_path,
+    register_new_node,
+)
+
+SNAPSHOT_PATH = "optimizer_snapshot.json"
+SNAPSHOT_VERSION = 1
+
+
+@dataclass
+class IncrementalPlan:
+    changed: Set[str] = field(default_factory=set)
+    affected: Set[str] = field(default_factory=set)
+    graph: nx.DiGraph = None
+    # ASTs of the reused nodes, recovered from their emitted SQL
+    asts: Dict[str, exp.Expression] = field(default_factory=dict)
+    # previous DAG entries of the nodes whose emitted SQL is reused as-is
+    reused: Dict[str, dict] = field(default_factory=dict)
+    # rewrite groups of the previous run that are still valid
+    kept_groups: List[List[str]] = field(default_factory=list)
+
+
+def node_signature(manifest, node_id) -> str:
+    node = manifest["nodes"][node_id]
+    h = hashlib.sha256()
+    h.update(node.get("checksum", {}).get("checksum", "").encode())
+    h.update(b"\0")
+    h.update(str(node.get("config", {}).get("materialized")).encode())
+    h.update(b"\0")
+    # macros or upstream relation names can change the compiled SQL alone
+    cpath = get_compiled_path(manifest, node_id)
+    if cpath and os.path.isfile(cpath):
+        with open(cpath, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def save_snapshot(path, manifest, subG, opt_graph, rule_names, new_node_ids,
+                  rewrite_groups, emitted):
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "rules": rule_names,
+        "signatures": {
+            n: node_signature(manifest, n) for n in subG.nodes if n in manifest["nodes"]
+        },
+        "parents": {n: sorted(subG.predecessors(n)) for n in subG.nodes},
+        "graph_edges": [list(e) for e in opt_graph.edges],
+        "graph_nodes": list(opt_graph.nodes),
+        "new_nodes": sorted(new_node_ids),
+        "rewrite_groups": rewrite_groups,
+        "emitted": emitted,
+    }
+    with open(path, "w") as f:
+        json.dump(snapshot, f, indent=2)
+
+
+def load_snapshot(path) -> Optional[dict]:
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        snapshot = json.load(f)
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def _emitted_select(sql_file) -> exp.Expression:
+    """AST of the SELECT inside a previously emitted `CREATE ... AS` statement."""
+    ast = parse_file_cached(sql_file, read=REWRITER_DIALECT)
+    return ast.expression if isinstance(ast, exp.Create) else ast
+
+
+def plan_incremental(snapshot, manifest, subG, rule_names) -> Optional[IncrementalPlan]:
+    """
+    Diff the manifest against the snapshot and build the graph/ASTs the rewriter
+    should start from. Returns None when a full re-optimization is required
+    (different rules, or emitted files of reused nodes are gone).
+    """
+    if snapshot is None or snapshot["rules"] != rule_names:
+        return None
+
+    old_sigs = snapshot["signatures"]
+    old_parents = snapshot["parents"]
+    new_node_ids = set(snapshot["new_nodes"])
+    plan = IncrementalPlan()
+
+    for n in subG.nodes:
+        if n not in manifest["nodes"]:
+            continue
+        if old_sigs.get(n) != node_signature(manifest, n) or \
+                old_parents.get(n) != sorted(subG.predecessors(n)):
+            plan.changed.add(n)
+    removed = set(old_sigs) - set(subG.nodes)
+
+    # neighbourhood of the change: the nodes themselves, their parents and children
+    affected = set(plan.changed)
+    for n in plan.changed:
+        affected.update(subG.predecessors(n))
+        affected.update(subG.successors(n))
+    for n in removed:
+        affected.update(p for p in old_parents.get(n, []) if p in subG)
+        affected.update(c for c, ps in old_parents.items() if n in ps and c in subG)
+
+    # every rule application that touched an affected node is redone as a whole
+    groups = [set(g) for g in snapshot["rewrite_groups"]]
+    invalid = set()
+    grew = True
+    while grew:
+        grew = False
+        for idx, group in enumerate(groups):
+            if idx in invalid or not (group & (affected | removed)):
+                continue
+            invalid.add(idx)
+            affected.update(n for n in group if n in subG)
+            grew = True
+    plan.kept_groups = [sorted(g) for idx, g in enumerate(groups) if idx not in invalid]
+    dropped_new = {n for idx in invalid for n in groups[idx] if n in new_node_ids}
+    plan.affected = {n for n in affected if n in subG}
+
+    # start from the previous rewritten graph, minus everything that is redone
+    graph = nx.DiGraph()
+    graph.add_nodes_from(n for n in snapshot["graph_nodes"]
+                         if n not in removed and n not in dropped_new)
+    graph.add_nodes_from(subG.nodes)
+    for u, v in snapshot["graph_edges"]:
+        if u in graph and v in graph and v not in plan.affected:
+            graph.add_edge(u, v)
+    for n in plan.affected:
+        for p in subG.predecessors(n):
+            graph.add_edge(p, n)
+    assert nx.is_directed_acyclic_graph(graph), "Graph is not a DAG!"
+    plan.graph = graph
+
+    # reused nodes keep their emitted SQL; recover their ASTs for rule matching
+    emitted = snapshot["emitted"]
+    previous_nodes = set(snapshot["graph_nodes"])
+    for n in graph.nodes:
+        if n in plan.affected or n not in manifest["nodes"] and n not in new_node_ids:
+            continue
+        entry = emitted.get(n)
+        if entry is None and n not in previous_nodes:
+            # skipped as a dead node; the rewriter parses it again if needed
+            continue
+        if entry is None or not os.path.isfile(entry["sql_file"]):
+            return None
+        plan.asts[n] = _emitted_select(entry["sql_file"])
+        plan.reused[n] = entry
+        if n in new_node_ids:
+            register_new_node(NewNodeRecord(node_id=n))
+    return plan
@@ -0,0 +1,170 @@
+"""
+Whole-DAG index of rewrite-relevant subtrees.
+
+Rules like common CTE elimination need to know which *other* nodes contain a
+given subtree. Scanning every node's AST on each `match` call makes one rewriter
+pass O(N^2), so the rewriter builds this index once per run and keeps it up to
+date as rules modify ASTs. Each node's AST is indexed by:
+  * "cte":      its CTEs
+  * "subquery": its derived tables (subqueries in FROM/JOIN)
+  * "join":     the FROM/JOIN tree of each of its SELECTs
+  * "conjunct": the conjuncts of its WHERE clause (CNF-normalized and simplified)
+  * "table":    the tables it references, by name
+  * "relation": the tables it references by schema-qualified name, by
+                (catalog, schema, name); the catalog defaults to the DuckDB one
+
+CTEs, subqueries and joins are keyed by their semantic fingerprint (see
+`fingerprint.py`), so differently spelled but equivalent subtrees of different
+models share a key. Conjuncts are keyed by sqlglot's structural hash, which is
+also what sqlglot uses for expression equality.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict, Set
+
+import sqlglot.optimizer.normalize
+import sqlglot.optimizer.simplify
+from sqlglot import exp
+
+from fingerprint import DEFAULT_CATALOG, fingerprint
+
+INDEX_KINDS = ("cte", "subquery", "join", "conjunct", "table", "relation")
+# kinds keyed by semantic fingerprint rather than structural hash
+FINGERPRINT_KINDS = ("cte", "subquery", "join")
+
+
+def where_conjuncts(ast: exp.Expression) -> list:
+    """Top-level conjuncts of the first WHERE clause of `ast`, normalized to CNF."""
+    where = ast.find(exp.Where)
+    if where is None:
+        return []
+    norm = sqlglot.optimizer.normalize.normalize(where.copy(), dnf=False)
+    norm = sqlglot.optimizer.simplify.simplify(norm)
+    conjuncts = []
+    for expr in norm.iter_expressions():
+        conjuncts.extend(expr.flatten(unnest=False))
+    return conjuncts
+
+
+def _cte_names(ast: exp.Expression) -> set:
+    return {cte.alias for cte in ast.find_all(exp.CTE)}
+
+
+def _self_contained(expr: exp.Expression, cte_names: set) -> bool:
+    """True if `expr` can be evaluated on its own, i.e. reads no CTE of the enclosing query."""
+    return not any(table.name in cte_names and not table.db for table in expr.find_all(exp.Table))
+
+
+def _entries(ast: exp.Expression, kind: str) -> list:
+    if kind == "cte":
+        with_expression = ast.find(exp.With)
+        if with_expression is None:
+            return []
+        cte_names = _cte_names(ast)
+        return [cte for cte in with_expression.expressions if _self_contained(cte.this, cte_names)]
+    if kind == "subquery":
+        # derived tables, which can be replaced by a table reference as-is
+        cte_names = _cte_names(ast)
+        return [
+            subquery for subquery in ast.find_all(exp.Subquery)
+            if isinstance(subquery.parent, (exp.From, exp.Join))
+            and subquery.alias
+            and _self_contained(subquery.this, cte_names)
+        ]
+    if kind == "join":
+        cte_names = _cte_names(ast)
+        joins = []
+        for select in ast.find_all(exp.Select):
+            # the FROM arg is keyed "from" or "from_" depending on the sqlglot version
+            from_ = next((v for v in select.args.values() if isinstance(v, exp.From)), None)
+            if not select.args.get("joins") or from_ is None:
+                continue
+            join_tree = exp.Select(expressions=[exp.Star()]).from_(from_.copy(), copy=False)
+            join_tree.set("joins", [join.copy() for join in select.args["joins"]])
+            if _self_contained(join_tree, cte_names):
+                joins.append(join_tree)
+        return joins
+    if kind == "conjunct":
+        return where_conjuncts(ast)
+    if kind == "table":
+        return list(ast.find_all(exp.Table))
+    if kind == "relation":
+        # a CTE or an unqualified name may resolve to another relation
+        return [table for table in ast.find_all(exp.Table) if table.db]
+    raise ValueError(f"Unknown index kind: {kind}")
+
+
+def relation_key(table: exp.Table) -> tuple:
+    """(catalog, schema, name) of a schema-qualified table, lower-cased."""
+    return ((table.catalog or DEFAULT_CATALOG).lower(), table.db.lower(), table.name.lower())
+
+
+def _key(expr: exp.Expression, kind: str):
+    if kind == "table":
+        # references to the same table match regardless of alias/quoting
+        return expr.name.lower()
+    if kind == "relation":
+        return relation_key(expr)
+    if kind in FINGERPRINT_KINDS:
+        try:
+            return fingerprint(expr)
+        except Exception as e:
+            print(f"[WARN] Could not fingerprint {kind}: {e}")
+    return hash(expr)
+
+
+class DagIndex:
+    def __init__(self):
+        # kind -> key -> node_id -> indexed expression of that node
+        self._by_key: Dict[str, Dict[object, Dict[str, exp.Expression]]] = {
+            kind: defaultdict(dict) for kind in INDEX_KINDS
+        }
+        # node_id -> kind -> keys of that node
+        self._by_node: Dict[str, Dict[str, Set[object]]] = {}
+
+    @classmethod
+    def build(cls, asts: Dict[str, exp.Expression]) -> "DagIndex":
+        index = cls()
+        for node_id, ast in asts.items():
+            index.update(node_id, ast)
+        return index
+
+    def update(self, node_id: str, ast: exp.Expression) -> None:
+        """(Re-)index a node after its AST was created or modified."""
+        self.remove(node_id)
+        keys = {}
+        for kind in INDEX_KINDS:
+            keys[kind] = set()
+            for expr in _entries(ast, kind):
+                key = _key(expr, kind)
+                keys[kind].add(key)
+                # first occurrence within a node is kept, like a set
+                self._by_key[kind][key].setdefault(node_id, expr)
+        self._by_node[node_id] = keys
+
+    def remove(self, node_id: str) -> None:
+        keys = self._by_node.pop(node_id, None)
+        if keys is None:
+            return
+        for kind, kind_keys in keys.items():
+            for key in kind_keys:
+                nodes = self._by_key[kind][key]
+                nodes.pop(node_id, None)
+                if not nodes:
+                    del self._by_key[kind][key]
+
+    def keys_of(self, node_id: str, kind: str) -> Set[object]:
+        return self._by_node.get(node_id, {}).get(kind, set())
+
+    def nodes_with(self, kind: str, key) -> Dict[str, exp.Expression]:
+        """node_id -> matching expression, for every node containing `key`."""
+        return self._by_key[kind].get(key, {})
+
+    def shared(self, kind: str) -> Dict[object, Dict[str, exp.Expression]]:
+        """Keys of `kind` found in more than one node."""
+        return {key: nodes for key, nodes in self._by_key[kind].items() if len(nodes) > 1}
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._by_node
@@ -0,0 +1,156 @@
+"""
+Materialization selection for the nodes of the rewritten DAG.
+
+Rules create intermediate nodes (`*_pushdown`, `shared_cte_*`, ...) that are
+emitted as temporary tables. That pays a write and a scan per consumer even
+when the node has a single consumer, or when recomputing it is cheaper than
+storing it. After rewriting, each intermediate node is therefore either
+  * kept as a temporary table, or
+  * inlined into its consumers: as a derived table, or as a CTE if a consumer
+    reads it more than once. For DuckDB this is what a view is, since views
+    are expanded into the queries reading them, without the catalog object.
+A node with one consumer is always inlined. For more consumers, computing it
+once and scanning it k times is compared against recomputing it k times
+(`selectivity.cse_decision`), on estimates of its query with all upstream
+models and intermediate nodes expanded, since they do not exist yet while
+optimizing.
+
+dbt models other than the targets (the final models, or `--targets`) get the
+same choice between a table and a view, whatever dbt declared: the relation
+is kept either way, as other readers than the DAG may query it, and a view is
+expanded into its consumers like an inlined node. Targets, models no node
+reads and models that are neither tables nor views (e.g. ephemeral or
+incremental) keep their declared materialization.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, Set, Tuple
+
+import networkx as nx
+from sqlglot import exp
+
+from selectivity import DEFAULT_CSE_THRESHOLD
+from utils import get_new_node, materialization, remove_new_node
+
+TEMPORARY_TABLE = "TEMPORARY TABLE"
+INLINE = "INLINE"
+TABLE = "TABLE"
+VIEW = "VIEW"
+# dbt materializations the choice may replace
+_CHOOSABLE = ("table", "view")
+
+
+def _name(node_id: str) -> str:
+    return node_id.split(".")[-1].lower()
+
+
+def _references(ast: exp.Expression, node_id: str) -> list:
+    """Table references to `node_id` in `ast` (not CTEs of the same name)."""
+    ctes = {cte.alias.lower() for cte in ast.find_all(exp.CTE)}
+    name = _name(node_id)
+    return [
+        table for table in ast.find_all(exp.Table)
+        if table.name.lower() == name and not (name in ctes and not table.db)
+    ]
+
+
+def expanded_query(graph: nx.DiGraph, asts: Dict[str, exp.Expression], node_id: str,
+                   memo: Dict[str, exp.Expression]) -> exp.Expression:
+    """The query of `node_id` with every upstream node it reads replaced by its (expanded) query."""
+    if node_id not in memo:
+        query = asts[node_id].copy()
+        for parent in graph.predecessors(node_id):
+            if parent not in asts:
+                continue
+            for table in _references(query, parent):
+                table.replace(exp.Subquery(
+                    this=expanded_query(graph, asts, parent, memo).copy(),
+                    alias=exp.TableAlias(this=exp.to_identifier(table.alias_or_name)),
+                ))
+        memo[node_id] = query
+    return memo[node_id]
+
+
+def inline_node(graph: nx.DiGraph, asts: Dict[str, exp.Expression], node_id: str) -> Set[str]:
+    """Inline an intermediate node into its consumers and remove it. Returns the consumers."""
+    body = asts[node_id]
+    consumers = list(graph.successors(node_id))
+    for consumer in consumers:
+        ast = asts[consumer]
+        references = _references(ast, node_id)
+        if len(references) == 1:
+            table = references[0]
+            table.replace(exp.Subquery(
+                this=body.copy(),
+                alias=exp.TableAlias(this=exp.to_identifier(table.alias_or_name)),
+            ))
+        elif references:
+            # read more than once: define it once as a CTE of the consumer
+            cte_name = node_id.split(".")[-1]
+            for table in references:
+                table.replace(exp.Table(
+                    this=exp.to_identifier(cte_name),
+                    alias=exp.TableAlias(this=exp.to_identifier(table.alias_or_name)),
+                ))
+            _prepend_cte(ast, cte_name, body)
+        for parent in graph.predecessors(node_id):
+            graph.add_edge(parent, consumer)
+    graph.remove_node(node_id)
+    del asts[node_id]
+    remove_new_node(node_id)
+    return set(consumers)
+
+
+def _prepend_cte(ast: exp.Expression, name: str, body: exp.Expression) -> None:
+    """Define `name` as the first CTE of `ast`, so its other CTEs may read it."""
+    cte = exp.CTE(this=body.copy(), alias=exp.TableAlias(this=exp.to_identifier(name)))
+    with_ = ast.args.get("with_")
+    if with_ is None:
+        ast.set("with_", exp.With(expressions=[cte]))
+    else:
+        with_.set("expressions", [cte] + list(with_.expressions))
+
+
+def select_materializations(
+    graph: nx.DiGraph,
+    asts: Dict[str, exp.Expression],
+    stats,
+    threshold: float = DEFAULT_CSE_THRESHOLD,
+    targets: Set[str] = frozenset(),
+) -> Tuple[Dict[str, str], List[List[str]]]:
+    """
+    Choose temporary table or inlining for every intermediate node and inline
+    the latter, and table or view for every dbt model but the `targets`.
+    Returns (node -> choice, [inlined node, *its consumers] per inlined node).
+    """
+    choices = {}
+    groups = []
+    for node_id in list(nx.topological_sort(graph)):
+        if node_id not in asts:
+            continue
+        intermediate = get_new_node(node_id) is not None
+        if not intermediate and (node_id in targets or materialization(node_id) not in _CHOOSABLE):
+            continue
+        stored, inlined = (TEMPORARY_TABLE, INLINE) if intermediate else (TABLE, VIEW)
+        fan_out = graph.out_degree(node_id)
+        if fan_out == 0:
+            # not read by anything (see dead-node elimination); a model keeps its own
+            if intermediate:
+                choices[node_id] = TEMPORARY_TABLE
+            continue
+        if fan_out == 1:
+            choice, reason = inlined, "single consumer"
+        else:
+            try:
+                body = expanded_query(graph, asts, node_id, {})
+                materialize, ratio = stats.should_materialize_cse(body, fan_out, threshold)
+                choice = stored if materialize else inlined
+                reason = f"{fan_out} consumers, benefit={ratio:.2f} (threshold: {threshold:.2f})"
+            except Exception as e:
+                choice, reason = stored, f"no cost estimate: {e}"
+        print(f"[INFO] Materialization of {node_id}: {choice} ({reason})")
+        choices[node_id] = choice
+        if choice == INLINE:
+            groups.append([node_id] + sorted(inline_node(graph, asts, node_id)))
+    return choices, groups
@@ -8,16 +8,37 @@ from sqlglot import exp
 from rewriter import Rewriter
 from rules.predicate_pushdown import PredicatePushdownRule
 from rules.cse import CommonSubExpElimRule
+from rules.disjunctive_pushdown import DisjunctivePushdownRule
+from rules.shared_aggregation import SharedAggregationRule
+from rules.shared_table import SharedTableRule
+from rules.project_pushdown import ProjectionPushdownRule
+from rules.subresult_reuse import SubresultReuseRule
+from result_cache import DEFAULT_CACHE_DIR
+from statistics_service import ESTIMATORS, StatisticsService
+from selectivity import (DEFAULT_CSE_THRESHOLD, DEFAULT_REUSE_THRESHOLD, DEFAULT_SHARED_SCAN_THRESHOLD,
+                         DEFAULT_THRESHOLD)
+from plan_enumerator import DEFAULT_SEARCH_DEPTH
+from calibration import CALIBRATION_FILE, apply_calibration, load_calibration
+from dead_nodes import PRUNED_MODELS_FILE, eliminate_dead_nodes, final_models, resolve_targets
+from materialization import TABLE, select_materializations
+from incremental import SNAPSHOT_PATH, load_snapshot, plan_incremental, save_snapshot
 
 from utils import *
 import argparse
 
-# tables materialized as output from sqls 
+# relations created by the sql files, in their order; models the materialization
+# pass turned into views are results too, so views are listed as well
 materialized_table_list = []
 
 # topo sort order of sql files
 topo_sort_order = []
 
+# executable DAG (sql file, output relation, parents) for the parallel executor
+dag_nodes = []
+
+# node_id -> (created relation name, materialized type)
+node_materialization = {}
+
 
 # updated to not include source tables as nodes in graph
 def build_full_graph(manifest):
@@ -95,8 +116,8 @@ def rewrite_ast_to_create_table(ast_obj, table_name, materialized_required_info,
         if parts[0].strip('"') == "dev":
             table_name = f'temp.main.{parts[-1]}'
     
-    if materialized_type == "TABLE" or materialized_type == "TEMPORARY TABLE":
-        materialized_table_list.append(table_name)
+    materialized_table_list.append(table_name)
+    node_materialization[node_id] = (table_name, materialized_type)
     create_expr = exp.Create(
         this=exp.Identifier(this=table_name),
         kind=materialized_type,
@@ -110,7 +131,16 @@ def rewrite_ast_to_create_table(ast_obj, table_name, materialized_required_info,
      
     return create_sql
 
-def main(folder_name=None):
+def main(folder_name=None, incremental=False, max_iterations=MAX_REWRITE_ITERATIONS, estimator="explain",
+         inline_intermediates=True, targets=None, prune_unused=True, cache_dir=DEFAULT_CACHE_DIR,
+         cost_based=False, search_depth=DEFAULT_SEARCH_DEPTH, calibration_file=CALIBRATION_FILE):
+    # cost constants fitted to this machine, if calibration.py was run
+    calibration = load_calibration(calibration_file) if calibration_file else None
+    if calibration is not None:
+        apply_calibration(calibration)
+    else:
+        print("[INFO] No cost calibration; using the default cost constants.")
+
     # Path to the manifest
     manifest_path = os.path.join("target", "manifest.json")
     if not os.path.isfile(manifest_path):
@@ -125,9 +155,6 @@ def main(folder_name=None):
 
     # Filter to only models in folder_name
     # (plus their upstream dependencies if any)
-    folder_name = "models/tpch_queries/"
-    # folder_name = "models/simple_multi_pd/"
-
     if folder_name:
         print(f"[INFO] Using only folder: {folder_name}")
         subG = gather_subgraph(full_graph, manifest, folder_name)
@@ -151,14 +178,68 @@ def main(folder_name=None):
     # get_compiled_path(manifest, list(nx.topological_sort(subG))[0])
     # apply rewriter, potentially should use materialized_required_info
     print("[INFO] Applying rewriter...")
-    rewriter = Rewriter(manifest, subG)
+    # the rewriter modifies the graph in place; the snapshot needs the dbt edges
+    model_graph = subG.copy()
+    rewriter = Rewriter(manifest, subG, max_iterations=max_iterations,
+                        stats=StatisticsService(estimator=estimator),
+                        cost_based=cost_based, search_depth=search_depth)
+    # with the cost model the rules propose every rewrite they can do and the
+    # DAG cost decides, instead of each rule's own threshold
+    pushdown_threshold = 1.0 if cost_based else DEFAULT_THRESHOLD
+    reuse_rule = SubresultReuseRule(cache_dir=cache_dir,
+                                    threshold=0.0 if cost_based else DEFAULT_REUSE_THRESHOLD)
     rewriter.set_rules([
         # Add rewrite rules here
-        PredicatePushdownRule(),
-        CommonSubExpElimRule(),
+        reuse_rule,
+        PredicatePushdownRule(threshold=pushdown_threshold),
+        DisjunctivePushdownRule(threshold=pushdown_threshold),
+        CommonSubExpElimRule(threshold=0.0 if cost_based else DEFAULT_CSE_THRESHOLD),
+        SharedAggregationRule(threshold=0.0 if cost_based else DEFAULT_CSE_THRESHOLD),
+        SharedTableRule(threshold=0.0 if cost_based else DEFAULT_SHARED_SCAN_THRESHOLD),
+        ProjectionPushdownRule(),
     ])
-    rewriter.run()
+    rule_names = [rule.__class__.__name__ for rule in rewriter.rules]
+    plan = None
+    if incremental:
+        plan = plan_incremental(load_snapshot(SNAPSHOT_PATH), manifest, subG, rule_names)
+        if plan is None:
+            print("[INFO] No usable optimizer snapshot; falling back to a full run.")
+    if plan is not None:
+        print(f"[INFO] Incremental run: {len(plan.changed)} changed, "
+              f"{len(plan.affected)} affected, {len(plan.reused)} reused nodes")
+        rewriter.graph = plan.graph
+        rewriter.asts = plan.asts
+        rewriter.run(nodes_to_check=plan.affected)
+    else:
+        rewriter.run()
     print("[INFO] Rewriting DONE!")
+    rewrite_groups = [entry["touched"] for entry in rewriter.rewrite_log]
+    pruned = []
+    # the final models (or the selected targets), whose results are needed
+    required = resolve_targets(rewriter.graph, targets) if targets else final_models(model_graph)
+    if prune_unused:
+        # only build what they read
+        pruned = eliminate_dead_nodes(rewriter.graph, rewriter.asts, required)
+    choices = {}
+    if inline_intermediates:
+        # temporary table or inlined into the consumers for each intermediate node,
+        # table or view for each model the targets read
+        choices, inline_groups = select_materializations(
+            rewriter.graph, rewriter.asts, rewriter.stats, targets=required)
+        rewrite_groups += inline_groups
+        rewriter.stats.close()
+        for node_id, choice in choices.items():
+            if node_id in manifest["nodes"]:
+                if choice == TABLE:
+                    materialized_required_info.add(relation_name(node_id))
+                else:
+                    materialized_required_info.discard(relation_name(node_id))
+    # nodes whose previously emitted SQL is still valid
+    touched = {n for group in rewrite_groups for n in group}
+    reused = {} if plan is None else {
+        n: entry for n, entry in plan.reused.items()
+        if n not in touched and choices.get(n, entry["materialized"]) == entry["materialized"]
+    }
     opt_subG = rewriter.graph   # in later versions this graph might have changed 
     opt_subG_asts = rewriter.asts
     
@@ -172,6 +253,13 @@ def main(folder_name=None):
     # Parse each node's compiled SQL with SQLGlot
     for node_id in sorted_nodes:
         print(f"Processing node: {node_id}")
+        if node_id in reused:
+            entry = dict(reused[node_id], parents=list(opt_subG.predecessors(node_id)))
+            print(f"[INFO] Reusing {entry['sql_file']}: node not affected by the change\n")
+            materialized_table_list.append(entry["relation"])
+            topo_sort_order.append(entry["sql_file"])
+            dag_nodes.append(entry)
+            continue
         
         # cpath = get_compiled_path(manifest, node_id)
         # print(cpath)
@@ -217,6 +305,19 @@ def main(folder_name=None):
             print(f"[INFO] Wrote optimized SQL to: {out_path}\n")
             relative_path = os.path.relpath(out_path, start=os.getcwd())
             topo_sort_order.append(relative_path)
+            created_relation, materialized_type = node_materialization[node_id]
+            dag_nodes.append({
+                "node_id": node_id,
+                "sql_file": relative_path,
+                "relation": created_relation,
+                "materialized": materialized_type,
+                "intermediate": get_new_node(node_id) is not None,
+                "parents": list(opt_subG.predecessors(node_id)),
+                # of the query before rewriting, to match it with cached results later;
+                # intermediate nodes have no such query and are fingerprinted as emitted
+                # (their columns may have been pruned since the reuse rule saw them)
+                "fingerprint": None if get_new_node(node_id) is not None else reuse_rule.fingerprints.get(node_id),
+            })
         except Exception as e:
             print(f"[WARN] Could not write parsed SQL for [{node_id}]: {e}")
 
@@ -226,6 +327,21 @@ def main(folder_name=None):
     with open("topo_sort_order_optimized.txt", "w") as f:
         for sql_path in topo_sort_order:
             f.write(sql_path + "\n")
+    # models the optimized DAG does not build, for check_correctness.py
+    with open(PRUNED_MODELS_FILE, "w") as f:
+        for node_id in pruned:
+            if relation_name(node_id):
+                f.write(relation_name(node_id) + "\n")
+    write_dag_file("dag_optimized.json", dag_nodes)
+
+    if plan is not None:
+        rewrite_groups = plan.kept_groups + rewrite_groups
+    save_snapshot(
+        SNAPSHOT_PATH, manifest, model_graph, opt_subG, rule_names,
+        [record.node_id for record in new_nodes()],
+        rewrite_groups,
+        {entry["node_id"]: entry for entry in dag_nodes},
+    )
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -233,5 +349,62 @@ if __name__ == "__main__":
         "--folder",
         help="Optimize only the partial model in the specified folder. If omitted, optimize everything."
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-optimize models changed since the last run (see incremental.py)."
+    )
+    parser.add_argument(
+        "--max-iterations",
+        type=int,
+        default=MAX_REWRITE_ITERATIONS,
+        help="Cap on the rewriter's fixpoint iterations."
+    )
+    parser.add_argument(
+        "--selectivity",
+        choices=ESTIMATORS,
+        default="explain",
+        help="Predicate selectivity source: DuckDB EXPLAIN estimates, or sampled column histograms (see column_stats.py)."
+    )
+    parser.add_argument(
+        "--no-inline",
+        action="store_true",
+        help="Emit every intermediate node as a temporary table and every model as declared, "
+             "instead of choosing per node (see materialization.py)."
+    )
+    parser.add_argument(
+        "--targets",
+        nargs="+",
+        help="Models whose results are needed (names or node ids); defaults to the final models of the DAG."
+    )
+    parser.add_argument(
+        "--keep-unused",
+        action="store_true",
+        help="Build every model of the subgraph, even if no target reads it (see dead_nodes.py)."
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="Result cache of duckdb_sql_execution.py whose results may answer nodes (see subresult_catalog.py)."
+    )
+    parser.add_argument(
+        "--cost-based",
+        action="store_true",
+        help="Commit each rewrite only if it lowers the estimated cost of the whole DAG (see plan_enumerator.py)."
+    )
+    parser.add_argument(
+        "--search-depth",
+        type=int,
+        default=DEFAULT_SEARCH_DEPTH,
+        help="With --cost-based, further rewrites a costly rewrite may take to pay off."
+    )
+    parser.add_argument(
+        "--calibration",
+        default=CALIBRATION_FILE,
+        help="Cost constants fitted by calibration.py; the defaults are used if the file does not exist."
+    )
     args = parser.parse_args()
-    main(folder_name=args.folder)
+    main(folder_name=args.folder, incremental=args.incremental, max_iterations=args.max_iterations,
+         estimator=args.selectivity, inline_intermediates=not args.no_inline,
+         targets=args.targets, prune_unused=not args.keep_unused, cache_dir=args.cache_dir,
+         cost_based=args.cost_based, search_depth=args.search_depth, calibration_file=args.calibration)
@@ -0,0 +1,148 @@
+"""
+Cost-based choice of rewrites for the rewriter (`--cost-based`).
+
+By default the rewriter applies every rewrite a rule matches, and each rule
+judges its own rewrite with its threshold. In cost-based mode the rules'
+thresholds are lifted, so they propose every rewrite they can do, and the
+enumerator judges each proposal by the cost of the whole DAG
+(`cost_model.DagCostModel`):
+  * greedy: a rewrite that does not increase the DAG cost is committed,
+  * bounded search: a rewrite that does is kept tentatively while up to
+    `depth` further rewrites it enables are applied, i.e. the first match (in
+    rule priority and topological order) among the nodes it touched and their
+    parents. As soon as the DAG is no more costly than before the sequence is
+    committed; if it never is, all of it is rolled back. E.g. a predicate
+    pushdown that adds an intermediate node may only pay off once the shared
+    scan reading below it is narrowed.
+A rolled-back rewrite is not proposed again while the nodes around its base
+node are unchanged.
+"""
+
+from __future__ import annotations
+
+import networkx as nx
+
+from cost_model import DagCostModel
+from utils import remove_new_node
+
+# further rewrites a costly rewrite may take to pay off
+DEFAULT_SEARCH_DEPTH = 2
+
+
+class PlanEnumerator:
+    def __init__(self, rewriter, cost_model: DagCostModel, depth: int = DEFAULT_SEARCH_DEPTH):
+        self.rewriter = rewriter
+        self.cost_model = cost_model
+        self.depth = depth
+        # cost (and nodes without an estimate) of the committed DAG
+        self.cost = None
+        self.failed = set()
+        self.initial_cost = None
+        # (rule, base node, state of the nodes around it) of rolled-back rewrites
+        self.rejected = set()
+        self.committed = 0
+        self.rolled_back = 0
+
+    def _evaluate(self):
+        cost = self.cost_model.dag_cost(self.rewriter.graph, self.rewriter.asts)
+        return cost, set(self.cost_model.failed)
+
+    def _key(self, rule, node_id):
+        rewriter = self.rewriter
+        around = {node_id} | set(rewriter.graph.predecessors(node_id)) | set(rewriter.graph.successors(node_id))
+        return rule.__class__.__name__, node_id, frozenset((n, rewriter._node_state(n)) for n in around)
+
+    def proposed(self, rule, node_id) -> bool:
+        """False if the rule's rewrite at the node was rolled back in the current state."""
+        return self._key(rule, node_id) not in self.rejected
+
+    def _better(self, cost, failed) -> bool:
+        # a rewrite must not hide nodes from the model to look cheaper
+        return failed <= self.failed and cost <= self.cost
+
+    def _snapshot(self):
+        rewriter = self.rewriter
+        asts = {n: ast.copy() for n, ast in rewriter.asts.items()}
+        return rewriter.graph.copy(), asts, len(rewriter.rewrite_log)
+
+    def _restore(self, snapshot, touched):
+        graph, asts, log_length = snapshot
+        rewriter = self.rewriter
+        for node_id in set(rewriter.graph.nodes) - set(graph.nodes):
+            remove_new_node(node_id)
+        rewriter.graph.clear()
+        rewriter.graph.update(graph)
+        # untouched nodes keep their AST objects, which the index points into
+        for node_id in touched:
+            if node_id in asts:
+                rewriter.asts[node_id] = asts[node_id]
+            else:
+                rewriter.asts.pop(node_id, None)
+            if node_id in rewriter.graph and node_id in rewriter.asts:
+                rewriter.index.update(node_id, rewriter.asts[node_id])
+            else:
+                rewriter.index.remove(node_id)
+        del rewriter.rewrite_log[log_length:]
+
+    def _follow_up(self, touched, iteration):
+        """Apply the first rewrite matching around the touched nodes. Returns what it touched."""
+        rewriter = self.rewriter
+        queued = rewriter._requeue(touched)
+        order = [n for n in nx.topological_sort(rewriter.graph) if n in queued]
+        for rule in rewriter._ordered_rules():
+            rule.prepare(rewriter.graph, order, rewriter.asts)
+            for node_id in order:
+                if node_id not in rewriter.graph or node_id not in rewriter.asts \
+                        or not self.proposed(rule, node_id):
+                    continue
+                rule_matches, context = rule.match(rewriter.graph, node_id, rewriter.asts)
+                if rule_matches:
+                    follow = rewriter._apply(rule, node_id, context, iteration)
+                    if follow:
+                        print(f"[INFO] Cost model: trying {rule.__class__.__name__} at {node_id} as a follow-up")
+                        return follow
+        return set()
+
+    def apply(self, rule, node_id, context, iteration=0):
+        """
+        Apply a matched rewrite if it, or a sequence of at most `depth` more
+        rewrites it enables, does not increase the DAG cost; roll it back
+        otherwise. Returns the nodes touched by what was committed.
+        """
+        if self.cost is None:
+            self.cost, self.failed = self._evaluate()
+            self.initial_cost = self.cost
+        key = self._key(rule, node_id)
+        snapshot = self._snapshot()
+        touched = self.rewriter._apply(rule, node_id, context, iteration)
+        if not touched:
+            return touched
+        cost, failed = self._evaluate()
+        steps = 1
+        while not self._better(cost, failed) and steps <= self.depth:
+            follow = self._follow_up(touched, iteration)
+            if not follow:
+                break
+            touched |= follow
+            steps += 1
+            cost, failed = self._evaluate()
+        name = rule.__class__.__name__
+        if self._better(cost, failed):
+            print(f"[INFO] Cost model: committed {name} at {node_id} ({steps} rewrites), "
+                  f"DAG cost {self.cost:.0f} -> {cost:.0f}")
+            self.cost, self.failed = cost, failed
+            self.committed += steps
+            return touched
+        print(f"[INFO] Cost model: rolled back {name} at {node_id} ({steps} rewrites), "
+              f"DAG cost {self.cost:.0f} -> {cost:.0f}"
+              + (f", no estimate for {sorted(failed - self.failed)}" if failed - self.failed else ""))
+        self._restore(snapshot, touched)
+        self.rejected.add(key)
+        self.rolled_back += steps
+        return set()
+
+    def summary(self) -> str:
+        if self.cost is None:
+            return "nothing to decide"
+        return (f"DAG cost {self.initial_cost:.0f} -> {self.cost:.0f}, {self.committed} rewrites committed, "
+                f"{self.rolled_back} rolled back")
@@ -0,0 +1,93 @@
+"""
+Execution profiles of DAG nodes.
+
+`duckdb_sql_execution.py` runs every node with DuckDB's JSON profiling
+(`enable_profiling = 'json'`, written to a profile output file) and reads the
+latency, timings and cardinalities from the profile instead of the text
+rendering of EXPLAIN ANALYZE. With `--profile` it also appends one record per
+operator of each node's last timed run to `operator_profiles.jsonl`:
+  run, mode, node (its output table), DuckDB threads, operator name and type,
+  output rows, rows scanned, bytes of its output, seconds spent in it, and
+  the output rows and bytes of each of its inputs (for a hash join the probe
+  side first, the build side second).
+Records accumulate across runs; `calibration.py` fits the cost-model
+constants to them.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Iterator, List
+
+import duckdb
+
+PROFILE_STORE_PATH = "operator_profiles.jsonl"
+
+
+def profile_query(con: duckdb.DuckDBPyConnection, sql: str, profile_path: str) -> dict:
+    """Run `sql` with DuckDB's JSON profiling written to `profile_path` and return the profile."""
+    con.execute("PRAGMA enable_profiling = 'json'")
+    con.execute(f"SET profiling_output = '{profile_path}'")
+    try:
+        con.execute(sql)
+    finally:
+        con.execute("PRAGMA disable_profiling")
+    with open(profile_path, "r") as f:
+        return json.load(f)
+
+
+def query_metrics(profile: dict) -> dict:
+    """Query-level metrics of a JSON profile, times in ms."""
+    return {
+        "latency_ms": profile.get("latency", 0.0) * 1e3,
+        "cpu_ms": profile.get("cpu_time", 0.0) * 1e3,
+        "rows_scanned": profile.get("cumulative_rows_scanned", 0),
+        "bytes_read": profile.get("total_bytes_read", 0),
+        "bytes_written": profile.get("total_bytes_written", 0),
+        "peak_buffer_memory": profile.get("system_peak_buffer_memory", 0),
+    }
+
+
+def operators(profile: dict) -> List[dict]:
+    """The operators of a JSON profile, top-down (without an EXPLAIN ANALYZE root)."""
+    result = []
+    stack = list(reversed(profile.get("children", [])))
+    while stack:
+        node = stack.pop()
+        children = node.get("children", [])
+        stack.extend(reversed(children))
+        if node.get("operator_type") == "EXPLAIN_ANALYZE":
+            continue
+        result.append({
+            "operator": node.get("operator_name", "").strip(),
+            "type": node.get("operator_type", ""),
+            "rows": node.get("operator_cardinality", 0),
+            "rows_scanned": node.get("operator_rows_scanned", 0),
+            "bytes": node.get("result_set_size", 0),
+            "seconds": node.get("operator_timing", 0.0),
+            "input_rows": [c.get("operator_cardinality", 0) for c in children],
+            "input_bytes": [c.get("result_set_size", 0) for c in children],
+        })
+    return result
+
+
+class ProfileStore:
+    def __init__(self, path: str = PROFILE_STORE_PATH):
+        self.path = path
+
+    def record(self, run: str, mode: str, node: str, profile: dict, threads: int = 1) -> int:
+        """Append the operators of a node's profile. Returns how many were recorded."""
+        records = operators(profile)
+        with open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(dict(record, run=run, mode=mode, node=node, threads=threads)) + "\n")
+        return len(records)
+
+    def records(self) -> Iterator[dict]:
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
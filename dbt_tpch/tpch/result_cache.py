@@ -0,0 +1,234 @@
+"""
+Result cache for the nodes of an executable DAG.
+
+Every run of `duckdb_sql_execution.py` starts from a fresh `dev.duckdb` and
+recomputes all nodes, although between nightly runs most models do not change.
+With the cache enabled, the output of every table node is written to Parquet
+after it was built, and restored from there by a later run instead of being
+recomputed if nothing it depends on changed.
+
+The key of a node is a hash of its canonical SQL (re-rendered by sqlglot, so
+formatting does not matter) and the versions of its inputs:
+  * a base table is versioned by its row count and the sum of its row hashes,
+  * a node of the DAG by its own key, so a change anywhere upstream changes
+    the keys of everything downstream.
+Views are not cached (they hold no data) but get a key for their consumers.
+Nodes calling volatile functions (random(), now(), ...) are never cached.
+
+Entries live in `cache_dir` with an `index.json` recording their size, column
+types (Parquet has no HUGEINT, so restored columns are cast back) and last use;
+the least recently used entries are evicted once the cache exceeds `max_bytes`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Set
+
+import duckdb
+import networkx as nx
+import sqlglot
+from sqlglot import exp
+
+from fingerprint import DEFAULT_CATALOG
+from utils import REWRITER_DIALECT
+
+DEFAULT_CACHE_DIR = ".mqo_result_cache"
+DEFAULT_CACHE_BYTES: int = 2 * 2**30
+
+_VOLATILE_EXPRESSIONS = (exp.Rand, exp.Uuid, exp.CurrentDate, exp.CurrentTime,
+                         exp.CurrentTimestamp, exp.CurrentDatetime)
+_VOLATILE_FUNCTIONS = {"now", "random", "gen_random_uuid", "get_current_time", "setseed"}
+
+
+def _select_of(sql: str) -> exp.Expression:
+    """The query of a `CREATE ... AS <query>` statement (or the statement itself)."""
+    statement = sqlglot.parse_one(sql, read=REWRITER_DIALECT)
+    if isinstance(statement, exp.Create) and statement.expression is not None:
+        return statement.expression
+    return statement
+
+
+def is_volatile(query: exp.Expression) -> bool:
+    if query.find(*_VOLATILE_EXPRESSIONS):
+        return True
+    return any(f.name.lower() in _VOLATILE_FUNCTIONS for f in query.find_all(exp.Anonymous))
+
+
+def table_version(con: duckdb.DuckDBPyConnection, table: exp.Table) -> str:
+    """Content version of a base table: its row count and the sum of its row hashes."""
+    name = exp.table_(table.name, db=table.db or None, catalog=table.catalog or None,
+                      quoted=True).sql(dialect=REWRITER_DIALECT)
+    rows, checksum = con.execute(f"SELECT count(*), sum(hash(t))::VARCHAR FROM {name} AS t").fetchone()
+    return f"{rows}:{checksum}"
+
+
+def table_key(table: exp.Table) -> str:
+    return f"{table.catalog or DEFAULT_CATALOG}.{table.db}.{table.name}".lower()
+
+
+def parquet_inputs(query: exp.Expression) -> Set[str]:
+    """Paths of the Parquet files a query reads with read_parquet('...')."""
+    return {
+        arg.name for function in query.find_all(exp.ReadParquet)
+        for arg in function.find_all(exp.Literal) if arg.is_string
+    }
+
+
+def _relation_name(relation: str) -> str:
+    return relation.replace('"', "").split(".")[-1].lower()
+
+
+class ResultCache:
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_BYTES,
+                 catalog=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # subresult_catalog.SubresultCatalog told about every stored result, or None
+        self.catalog = catalog
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.index: Dict[str, dict] = {}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+        # node id -> key (None: not cacheable), for the current run
+        self.keys: Dict[str, Optional[str]] = {}
+        # base table -> version, for the current run
+        self.versions: Dict[str, str] = {}
+        # cached results the DAG reads directly (see rules/subresult_reuse.py); never evicted
+        self.pinned: Set[str] = set()
+        # nodes reading such results; caching them again would only copy them
+        self.readers: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.abspath(os.path.join(self.cache_dir, f"{key}.parquet"))
+
+    def _table_version(self, con, table: exp.Table) -> str:
+        key = table_key(table)
+        if key not in self.versions:
+            self.versions[key] = table_version(con, table)
+        return self.versions[key]
+
+    def compute_keys(self, con: duckdb.DuckDBPyConnection, graph: nx.DiGraph) -> Dict[str, Optional[str]]:
+        """
+        Key every node of a DAG (see `dag_executor.load_dag`), in topological
+        order; needs the base tables to be loaded into `con`'s database.
+        """
+        by_name = {_relation_name(data["relation"]): n for n, data in graph.nodes(data=True)}
+        for node_id in nx.topological_sort(graph):
+            data = graph.nodes[node_id]
+            try:
+                with open(data["sql_file"], "r") as f:
+                    query = _select_of(f.read())
+            except Exception as e:
+                print(f"[WARN] Not caching {node_id}: {e}")
+                self.keys[node_id] = None
+                continue
+            reads = {os.path.abspath(path) for path in parquet_inputs(query)}
+            if reads:
+                self.pinned |= reads
+                self.readers.add(node_id)
+            if is_volatile(query):
+                print(f"[INFO] Not caching {node_id}: volatile function")
+                self.keys[node_id] = None
+                continue
+            ctes = {cte.alias.lower() for cte in query.find_all(exp.CTE)}
+            inputs = set()
+            cacheable = True
+            for table in query.find_all(exp.Table):
+                name = table.name.lower()
+                if name in by_name and by_name[name] != node_id:
+                    upstream = self.keys.get(by_name[name])
+                    if upstream is None:
+                        cacheable = False
+                        break
+                    inputs.add(f"node:{upstream}")
+                elif name not in ctes and not isinstance(table.this, exp.Func):
+                    try:
+                        inputs.add(f"{table_key(table)}:{self._table_version(con, table)}")
+                    except Exception as e:
+                        print(f"[WARN] Not caching {node_id}: no version for {table.name}: {e}")
+                        cacheable = False
+                        break
+            if not cacheable:
+                self.keys[node_id] = None
+                continue
+            digest = hashlib.sha256()
+            digest.update(f"{data['relation']}|{data['materialized']}|".encode())
+            digest.update(query.sql(dialect=REWRITER_DIALECT).encode())
+            for version in sorted(inputs):
+                digest.update(f"|{version}".encode())
+            self.keys[node_id] = digest.hexdigest()
+        for key, entry in self.index.items():
+            if self._path(key) in self.pinned:
+                entry["last_used"] = time.time()
+        return self.keys
+
+    def restore_statement(self, node_id: str, relation: str, materialized: str) -> Optional[str]:
+        """CREATE statement rebuilding the node from its cached result, None on a miss."""
+        key = self.keys.get(node_id)
+        if key is None or materialized == "VIEW" or node_id in self.readers:
+            return None
+        with self._lock:
+            entry = self.index.get(key)
+            if entry is None or not os.path.isfile(self._path(key)):
+                self.misses += 1
+                return None
+            entry["last_used"] = time.time()
+            self.hits += 1
+        columns = ", ".join(f'CAST("{name}" AS {dtype}) AS "{name}"' for name, dtype in entry["columns"])
+        return f"CREATE {materialized} {relation} AS SELECT {columns} FROM read_parquet('{self._path(key)}')"
+
+    def store(self, con: duckdb.DuckDBPyConnection, node_id: str, relation: str, materialized: str) -> None:
+        """Write the output of a node that was just built to the cache."""
+        key = self.keys.get(node_id)
+        if key is None or materialized == "VIEW" or node_id in self.readers:
+            return
+        path = self._path(key)
+        try:
+            columns = [(row[0], row[1]) for row in con.execute(f"DESCRIBE {relation}").fetchall()]
+            rows = con.execute(f"SELECT count(*) FROM {relation}").fetchone()[0]
+            con.execute(f"COPY (SELECT * FROM {relation}) TO '{path}' (FORMAT PARQUET)")
+        except Exception as e:
+            print(f"[WARN] Could not cache {node_id}: {e}")
+            return
+        with self._lock:
+            self.index[key] = {
+                "node_id": node_id,
+                "columns": columns,
+                "rows": rows,
+                "bytes": os.path.getsize(path),
+                "last_used": time.time(),
+            }
+            self._evict()
+        if self.catalog is not None:
+            self.catalog.record(node_id, path, columns, rows)
+
+    def _evict(self) -> None:
+        total = sum(entry["bytes"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if self._path(key) in self.pinned:
+                continue
+            total -= self.index[key]["bytes"]
+            del self.index[key]
+            if os.path.isfile(self._path(key)):
+                os.remove(self._path(key))
+
+    def save(self) -> None:
+        with self._lock:
+            with open(self.index_path, "w") as f:
+                json.dump(self.index, f, indent=2)
+        if self.catalog is not None:
+            self.catalog.save()
+        print(f"[INFO] Result cache: {self.hits} hits, {self.misses} misses, "
+              f"{sum(e['bytes'] for e in self.index.values()) / 2**20:.2f} MiB in {len(self.index)} entries")
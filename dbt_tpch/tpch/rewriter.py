@@ -5,33 +5,121 @@ from sqlglot import exp
 import sqlglot.dialects
 from utils import *
 from rules.rewrite_rules import RewriteRule
+from ast_cache import parse_file_cached, cache_stats
+from match_index import DagIndex
+from statistics_service import StatisticsService
+from cost_model import DagCostModel
+from plan_enumerator import DEFAULT_SEARCH_DEPTH, PlanEnumerator
 
 class Rewriter: 
-    def __init__(self, manifest, subG : nx.DiGraph, rules=None):
+    def __init__(self, manifest, subG : nx.DiGraph, rules=None, max_iterations=MAX_REWRITE_ITERATIONS, stats=None,
+                 cost_based=False, search_depth=DEFAULT_SEARCH_DEPTH):
         self.manifest = manifest
         self.graph = subG
         self.asts = {}
         self.rules = rules or []
+        self.max_iterations = max_iterations
+        # one entry per applied rule: rule name, base node and every node whose
+        # AST or edges the application changed (including nodes it created)
+        self.rewrite_log = []
+        # whole-DAG index shared by the rules, built once per run
+        self.index = None
+        # DuckDB estimates shared by the cost-based rules (one connection, memoized)
+        self.stats = stats or StatisticsService()
+        # commits rewrites by whole-DAG cost instead of applying every match
+        self.enumerator = PlanEnumerator(self, DagCostModel(self.stats), search_depth) if cost_based else None
         
     def set_rules(self, rules : list[RewriteRule]):
         self.rules = rules
         
-    def run(self):
+    def _node_state(self, node_id):
+        ast = self.asts.get(node_id)
+        return (
+            hash(ast) if ast is not None else None,
+            frozenset(self.graph.predecessors(node_id)),
+            frozenset(self.graph.successors(node_id)),
+        )
+
+    def _apply(self, rule, node_id, context, iteration=0):
+        """
+        Apply a matched rule and record which nodes it touched: the nodes of the
+        rule's scope whose AST or edges changed, the nodes it created, and the
+        other ends of every edge it added or removed.
+        """
+        before = {n: self._node_state(n) for n in rule.scope(self.graph, node_id, context) if n in self.graph}
+        known = {record.node_id for record in new_nodes()}
+        rule.apply(self.graph, node_id, self.asts, context)
+        created = {r.node_id for r in new_nodes() if r.node_id not in known and r.node_id in self.graph}
+        touched = set(created)
+        for n in created:
+            touched.update(self.graph.predecessors(n))
+            touched.update(self.graph.successors(n))
+        for n, state in before.items():
+            if n not in self.graph:
+                touched.add(n)
+                touched |= state[1] | state[2]
+                continue
+            after = self._node_state(n)
+            if after != state:
+                touched.add(n)
+                touched |= (state[1] ^ after[1]) | (state[2] ^ after[2])
+        for n in touched:
+            if n in self.graph and n in self.asts:
+                self.index.update(n, self.asts[n])
+            else:
+                self.index.remove(n)
+        if touched:
+            self.rewrite_log.append({
+                "rule": rule.__class__.__name__,
+                "node": node_id,
+                "iteration": iteration,
+                "touched": sorted(touched),
+            })
+        return touched
+
+    def _ordered_rules(self):
+        # stable: rules with equal priority keep their append order
+        return sorted(self.rules, key=lambda rule: getattr(rule, "priority", 0))
+
+    def _requeue(self, touched):
+        """
+        Nodes to revisit after a rewrite: the touched nodes themselves and their
+        parents, since rules like predicate pushdown match at a node by looking
+        at its children.
+        """
+        requeue = set()
+        for node_id in touched:
+            if node_id in self.graph:
+                requeue.add(node_id)
+                requeue.update(self.graph.predecessors(node_id))
+        return requeue
+
+    def run(self, nodes_to_check=None):
+        """
+        Parse every model node that has no AST yet, then apply the rules until
+        a fixpoint is reached (or `max_iterations` rounds ran).
+        The first round checks every node (or only `nodes_to_check`, used by
+        incremental re-optimization; ASTs of the other nodes may be preloaded
+        into `self.asts` by the caller). Each later round only revisits the
+        nodes whose AST or edges changed in the previous round, plus their
+        parents, including nodes created by rules.
+        With `cost_based`, each match is committed or rolled back by the cost of
+        the whole DAG (see plan_enumerator.py).
+        """
         # Process nodes in topological order to ensure dependency order
         sorted_nodes = list(nx.topological_sort(self.graph))
         for node_id in sorted_nodes:
+            if node_id in self.asts:
+                continue
             if node_id not in self.manifest["nodes"]:
                 print(f"[WARN] Node {node_id} not found in manifest. Is source?")
                 continue
             cpath = get_compiled_path(self.manifest, node_id)
             if cpath and os.path.isfile(cpath):
-                with open(cpath, "r") as f:
-                    sql_str = f.read()
                 try:
                     print(f"[INFO] Parsing node {node_id}")
-                    ast = sqlglot.parse_one(sql_str)
-                    for ast_node in ast.walk():
-                        ast_node.pop_comments()
+                    # comment-stripped AST, reused across runs for unchanged models
+                    ast = parse_file_cached(cpath)
                     self.asts[node_id] = ast
                 except Exception as e:
                     # print(f"[ERROR] Could not parse node {node_id}: {e}")
@@ -39,20 +127,55 @@ class Rewriter:
             else:
                 # print(f"[WARN] File for node {node_id} not found or no compiled path.")
                 raise Exception(f"File for node {node_id} not found or no compiled path.")
-        # Apply rules (in order)
-        # currently new nodes created in flight are not checked for matches
-        # TODO: handle graph structure changes
-        # TODO: handle multiple/dynamic matches (loop until no more matches?)
-        for rule in self.rules:
-            for node_id in sorted_nodes:
-                print(f"[INFO] Checking rule {rule.__class__.__name__} on node {node_id}")
-                if node_id in self.asts:
-                    ast = self.asts[node_id]
+        print(f"[INFO] AST cache: {cache_stats()}")
+
+        self.index = DagIndex.build(self.asts)
+        rules = self._ordered_rules()
+        for rule in rules:
+            rule.index = self.index
+            rule.stats = self.stats
+        worklist = set(self.graph.nodes) if nodes_to_check is None \
+            else {n for n in nodes_to_check if n in self.graph}
+        iteration = 0
+        while worklist:
+            if iteration >= self.max_iterations:
+                print(f"[WARN] Rewriter stopped at the iteration cap ({self.max_iterations}); "
+                      f"{len(worklist)} nodes were still queued")
+                break
+            iteration += 1
+            print(f"[INFO] Rewrite iteration {iteration}: {len(worklist)} nodes queued")
+            # Apply rules in priority order, each over the queued nodes in topological order
+            order = [n for n in nx.topological_sort(self.graph) if n in worklist]
+            worklist = set()
+            for rule in rules:
+                rule.prepare(self.graph, order, self.asts)
+                for node_id in order:
+                    # the node may have been removed by an earlier rewrite
+                    if node_id not in self.graph or node_id not in self.asts:
+                        continue
+                    if self.enumerator is not None and not self.enumerator.proposed(rule, node_id):
+                        continue
+                    print(f"[INFO] Checking rule {rule.__class__.__name__} on node {node_id}")
                     rule_matches, context = rule.match(self.graph, node_id, self.asts)
                     if rule_matches:
                         print(f"[INFO] Rule {rule.__class__.__name__} matched! Rewrite based at node {node_id}")
-                        # self.asts[node_id] = rule.apply(self.graph, node_id, self.asts, context)
-                        rule.apply(self.graph, node_id, self.asts, context)
+                        if self.enumerator is not None:
+                            touched = self.enumerator.apply(rule, node_id, context, iteration)
+                        else:
+                            touched = self._apply(rule, node_id, context, iteration)
+                        worklist |= self._requeue(touched)
                         print(f"[INFO] New graph in toposort order: {list(nx.topological_sort(self.graph))}")
                         print(f"[INFO] New asts length: {len(self.asts)}")
-                        print(f"[INFO] Base node rewritten SQL:\n{self.asts[node_id].sql(dialect=REWRITER_DIALECT)}")
\ No newline at end of file
+                        if node_id in self.asts:
+                            print(f"[INFO] Base node rewritten SQL:\n{self.asts[node_id].sql(dialect=REWRITER_DIALECT)}")
+        # identical joins are reported only: extracting one needs the joined
+        # tables' column names to be disjoint, which is not checked here
+        for nodes in self.index.shared("join").values():
+            print(f"[INFO] Identical join computed by {len(nodes)} nodes: {sorted(nodes)}")
+        if self.enumerator is not None:
+            print(f"[INFO] Cost model: {self.enumerator.summary()}")
+        print(f"[INFO] Statistics: {self.stats.stats()}")
+        self.stats.close()
+        if not worklist:
+            print(f"[INFO] Rewriter reached a fixpoint after {iteration} iterations, "
+                  f"{len(self.rewrite_log)} rewrites applied")
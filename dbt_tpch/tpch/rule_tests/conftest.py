@@ -0,0 +1,188 @@
+"""
+Fixtures of the rewrite rule tests.
+
+A test describes a small dbt project as {model name: (compiled SQL,
+materialization)} over a seeded `dev.duckdb` with the TPC-H tables the rules
+look for, optimizes it with the rules under test and checks that every final
+model has the same result, compared as text like `check_correctness.py` does,
+when built from the optimized SQL as when built from the models' own SQL.
+"""
+
+import os
+import re
+import shutil
+import sys
+
+import duckdb
+import networkx as nx
+import pytest
+import sqlglot
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fingerprint  # noqa: E402
+from dead_nodes import final_models  # noqa: E402
+from parse_dbt_manifest_select_model_dir import build_full_graph, rewrite_ast_to_create_table  # noqa: E402
+from rewriter import Rewriter  # noqa: E402
+from utils import REWRITER_DIALECT, clear_new_node_registry, forge_relation_name, get_new_node, set_manifest  # noqa: E402
+
+DB_FILE = "dev.duckdb"
+
+SEED_SQL = """
+CREATE SCHEMA tpch;
+CREATE TABLE tpch.orders AS SELECT
+    i AS o_orderkey,
+    i % 50 AS o_custkey,
+    ['F', 'O', 'P'][i % 3 + 1] AS o_orderstatus,
+    CAST(100 + (i * 37) % 10000 / 100 AS DECIMAL(15, 2)) AS o_totalprice,
+    DATE '1995-01-01' + CAST(i % 730 AS INTEGER) AS o_orderdate,
+    ['1-URGENT', '2-HIGH', '3-MEDIUM', '4-NOT SPECIFIED'][i % 4 + 1] AS o_orderpriority
+FROM range(1, 601) t(i);
+CREATE TABLE tpch.lineitem AS SELECT
+    i // 4 + 1 AS l_orderkey,
+    i % 200 AS l_partkey,
+    i % 4 + 1 AS l_linenumber,
+    CAST(i % 50 + 1 AS DECIMAL(15, 2)) AS l_quantity,
+    CAST(900 + (i * 7919) % 100000 / 100 AS DECIMAL(15, 2)) AS l_extendedprice,
+    CAST(i % 11 / 100 AS DECIMAL(15, 2)) AS l_discount,
+    CAST(i % 9 / 100 AS DECIMAL(15, 2)) AS l_tax,
+    ['A', 'N', 'R'][i % 3 + 1] AS l_returnflag,
+    ['F', 'O'][i % 2 + 1] AS l_linestatus,
+    DATE '1995-01-01' + CAST(i % 900 AS INTEGER) AS l_shipdate
+FROM range(0, 2400) t(i);
+CREATE TABLE tpch.customer AS SELECT
+    i AS c_custkey,
+    'Customer#' || i AS c_name,
+    i % 25 AS c_nationkey,
+    CAST((i * 13) % 1000 AS DECIMAL(15, 2)) AS c_acctbal
+FROM range(0, 50) t(i);
+"""
+
+_REF_RE = re.compile(r'"dev"\."main"\."(\w+)"')
+
+
+def node_id(name):
+    return f"model.tpch.{name}"
+
+
+def manifest_of(models):
+    """Manifest of the models, each reading the others it names as "dev"."main"."<name>"."""
+    nodes = {}
+    for name, (sql, materialized) in models.items():
+        nodes[node_id(name)] = {
+            "resource_type": "model",
+            "name": name,
+            "relation_name": f'"dev"."main"."{name}"',
+            "config": {"materialized": materialized},
+            "depends_on": {"nodes": [node_id(ref) for ref in _REF_RE.findall(sql) if ref in models]},
+            "compiled_path": None,
+        }
+    return {"nodes": nodes}
+
+
+def _build(con, models, graph):
+    for node in nx.topological_sort(graph):
+        sql, materialized = models[node.split(".")[-1]]
+        kind = "TABLE" if materialized == "table" else "VIEW"
+        con.execute(f'CREATE {kind} "dev"."main"."{node.split(".")[-1]}" AS {sql}')
+
+
+def results(con, relations):
+    """relation -> (column names, sorted rows rendered as text)."""
+    out = {}
+    for relation in relations:
+        cursor = con.execute(f"SELECT * FROM {relation}")
+        columns = [d[0] for d in cursor.description]
+        out[relation] = (columns, sorted(tuple(str(v) for v in row) for row in cursor.fetchall()))
+    return out
+
+
+class Optimized:
+    """Result of optimizing a project: the rewriter and the emitted statements."""
+
+    def __init__(self, rewriter, statements, expected, actual):
+        self.rewriter = rewriter
+        self.statements = statements
+        self.expected = expected
+        self.actual = actual
+
+    @property
+    def applied(self):
+        return [entry["rule"] for entry in self.rewriter.rewrite_log]
+
+    @property
+    def created(self):
+        return [n for n in self.rewriter.graph.nodes if get_new_node(n) is not None]
+
+    def sql(self, name):
+        """Rewritten SQL of a model (by name) or of a created node (by node id)."""
+        node = node_id(name) if node_id(name) in self.rewriter.asts else name
+        return self.rewriter.asts[node].sql(dialect=REWRITER_DIALECT)
+
+    def assert_equivalent(self):
+        for relation, expected in self.expected.items():
+            assert self.actual[relation] == expected, f"{relation} differs after rewriting"
+
+
+@pytest.fixture
+def warehouse(tmp_path, monkeypatch):
+    """A seeded dev.duckdb in the working directory; the rules read it as their catalog."""
+    monkeypatch.chdir(tmp_path)
+    con = duckdb.connect(DB_FILE)
+    con.execute(SEED_SQL)
+    con.close()
+    shutil.copyfile(DB_FILE, "seed.duckdb")
+    # loaded once per process and keyed by the (relative) database path
+    fingerprint._SCHEMA_CACHE.clear()
+    fingerprint._MAPPING_SCHEMA_CACHE.clear()
+    clear_new_node_registry()
+    yield tmp_path
+    set_manifest(None)
+    clear_new_node_registry()
+
+
+@pytest.fixture
+def optimize(warehouse):
+    """
+    optimize(models, rules) builds the models into dev.duckdb (as `dbt run` does
+    before the optimizer runs), rewrites them with `rules`, runs the emitted
+    statements on a copy of the seeded database and returns an `Optimized`.
+    """
+    def run(models, rules):
+        manifest = manifest_of(models)
+        set_manifest(manifest)
+        graph = build_full_graph(manifest)
+        targets = final_models(graph)
+        relations = [manifest["nodes"][n]["relation_name"] for n in sorted(targets)]
+
+        con = duckdb.connect(DB_FILE)
+        _build(con, models, graph)
+        expected = results(con, relations)
+        con.close()
+
+        rewriter = Rewriter(manifest, graph, rules=rules)
+        rewriter.asts = {n: sqlglot.parse_one(models[n.split(".")[-1]][0], read=REWRITER_DIALECT)
+                         for n in graph.nodes}
+        rewriter.run()
+
+        tables = {manifest["nodes"][n]["relation_name"] for n in manifest["nodes"]
+                  if manifest["nodes"][n]["config"]["materialized"] == "table"}
+        statements = []
+        for node in nx.topological_sort(rewriter.graph):
+            relation = manifest["nodes"][node]["relation_name"] if node in manifest["nodes"] \
+                else forge_relation_name(node)
+            if node not in manifest["nodes"]:
+                tables.add(relation)
+            statements.append(rewrite_ast_to_create_table(rewriter.asts[node], relation, tables, node))
+
+        os.makedirs("optimized")
+        shutil.copyfile("seed.duckdb", os.path.join("optimized", DB_FILE))
+        con = duckdb.connect(os.path.join("optimized", DB_FILE))
+        for statement in statements:
+            con.execute(statement)
+        actual = results(con, relations)
+        con.close()
+        return Optimized(rewriter, statements, expected, actual)
+
+    return run
+
@@ -0,0 +1,45 @@
+from rules.cse import CommonSubExpElimRule
+
+LINEITEM = '"dev"."tpch"."lineitem"'
+
+
+def test_common_cte_is_extracted_once(optimize):
+    revenue = (f"with revenue as (select l_orderkey, sum(l_extendedprice * (1 - l_discount)) as rev "
+               f"from {LINEITEM} group by l_orderkey)")
+    models = {
+        "top_orders": (f"{revenue} select l_orderkey, rev from revenue where rev > 3000", "table"),
+        # the same CTE, spelled differently
+        "revenue_total": (f"with r as (select li.l_orderkey, sum(li.l_extendedprice * (1 - li.l_discount)) as rev "
+                          f"from {LINEITEM} as li group by li.l_orderkey) select sum(rev) as total from r", "table"),
+    }
+    optimized = optimize(models, [CommonSubExpElimRule(threshold=0.0)])
+    assert "CommonSubExpElimRule" in optimized.applied
+    assert "shared_cte_0" in optimized.created
+    optimized.assert_equivalent()
+
+
+def test_common_derived_table_is_extracted_once(optimize):
+    shipped = f"(select l_orderkey, l_quantity from {LINEITEM} where l_shipdate < DATE '1996-01-01')"
+    models = {
+        "shipped_quantity": (f"select sum(l_quantity) as q from {shipped} as s", "table"),
+        "shipped_orders": (f"select count(distinct l_orderkey) as n from {shipped} as t", "table"),
+    }
+    optimized = optimize(models, [CommonSubExpElimRule(threshold=0.0)])
+    assert "shared_subquery_0" in optimized.created
+    optimized.assert_equivalent()
+
+
+def test_literals_are_only_normalized_where_compared(optimize):
+    def doubled(factor, bound):
+        return (f"with d as (select l_orderkey, l_quantity * {factor} as q from {LINEITEM} "
+                f"where l_quantity > {bound}) select * from d")
+    models = {
+        "doubled": (doubled("2", "10"), "table"),
+        "doubled_again": (doubled("2", "10.0"), "table"),
+        # DECIMAL(18, 3) instead of DECIMAL(18, 2)
+        "doubled_wider": (doubled("2.0", "10"), "table"),
+    }
+    optimized = optimize(models, [CommonSubExpElimRule(threshold=0.0)])
+    assert "shared_cte_0" in optimized.sql("doubled") and "shared_cte_0" in optimized.sql("doubled_again")
+    assert "shared_cte_0" not in optimized.sql("doubled_wider")
+    optimized.assert_equivalent()
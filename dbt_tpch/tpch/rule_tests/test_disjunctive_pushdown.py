@@ -0,0 +1,35 @@
+from rules.disjunctive_pushdown import DisjunctivePushdownRule
+
+ORDERS = '"dev"."tpch"."orders"'
+
+
+def test_children_read_the_or_of_their_filters(optimize):
+    models = {
+        "orders_base": (f"select o_orderkey, o_orderpriority, o_totalprice from {ORDERS}", "table"),
+        "urgent": ('select o_orderkey, o_totalprice from "dev"."main"."orders_base" '
+                   "where o_orderpriority = '1-URGENT'", "table"),
+        "high_value": ('select o_orderpriority, sum(o_totalprice) as total from "dev"."main"."orders_base" b '
+                       "where b.o_totalprice > 180 group by o_orderpriority", "table"),
+    }
+    optimized = optimize(models, [DisjunctivePushdownRule(threshold=1.0)])
+    assert "DisjunctivePushdownRule" in optimized.applied
+    assert "orders_base_filtered" in optimized.sql("high_value")
+    optimized.assert_equivalent()
+
+
+def test_a_cte_shadowing_the_parent_is_left_alone(optimize):
+    models = {
+        "orders_base": (f"select o_orderkey, o_orderpriority, o_totalprice from {ORDERS}", "table"),
+        "urgent": ('select o_orderkey, o_totalprice from "dev"."main"."orders_base" '
+                   "where o_orderpriority = '1-URGENT'", "table"),
+        "high_value": ('select o_orderkey from "dev"."main"."orders_base" where o_totalprice > 180', "table"),
+        # its top-level `orders_base` is the CTE, not the parent
+        "doubled": ('with orders_base as (select o_orderkey, o_totalprice * 2 as o_totalprice '
+                    'from "dev"."main"."orders_base") '
+                    "select o_orderkey from orders_base where o_totalprice > 300", "table"),
+    }
+    optimized = optimize(models, [DisjunctivePushdownRule(threshold=1.0)])
+    assert "DisjunctivePushdownRule" in optimized.applied
+    assert "orders_base_filtered" in optimized.sql("high_value")
+    assert "orders_base_filtered" not in optimized.sql("doubled")
+    optimized.assert_equivalent()
@@ -0,0 +1,33 @@
+import sqlglot
+
+from conftest import manifest_of, node_id
+from dead_nodes import final_models
+from materialization import TABLE, VIEW, select_materializations
+from parse_dbt_manifest_select_model_dir import build_full_graph
+from statistics_service import StatisticsService
+from utils import REWRITER_DIALECT, set_manifest
+
+ORDERS = '"dev"."tpch"."orders"'
+
+
+def test_models_but_the_targets_choose_between_table_and_view(warehouse):
+    models = {
+        "orders_base": (f"select o_orderkey, o_custkey, o_totalprice from {ORDERS}", "table"),
+        "by_customer": ('select o_custkey, sum(o_totalprice) as total from "dev"."main"."orders_base" '
+                        "group by o_custkey", "view"),
+        "top_customers": ('select o_custkey from "dev"."main"."by_customer" where total > 2000', "table"),
+        "customer_count": ('select count(*) as n from "dev"."main"."by_customer"', "table"),
+    }
+    manifest = manifest_of(models)
+    set_manifest(manifest)
+    graph = build_full_graph(manifest)
+    asts = {n: sqlglot.parse_one(models[n.split(".")[-1]][0], read=REWRITER_DIALECT) for n in graph.nodes}
+    stats = StatisticsService()
+    choices, groups = select_materializations(graph, asts, stats, targets=final_models(graph))
+    stats.close()
+    # a table read once is a view, whatever dbt declared
+    assert choices[node_id("orders_base")] == VIEW
+    assert choices[node_id("by_customer")] in (TABLE, VIEW)
+    assert node_id("top_customers") not in choices and node_id("customer_count") not in choices
+    # models are never inlined: their relations stay
+    assert groups == [] and set(graph.nodes) == {node_id(name) for name in models}
@@ -0,0 +1,34 @@
+from rules.predicate_pushdown import PredicatePushdownRule
+
+ORDERS = '"dev"."tpch"."orders"'
+
+
+def test_common_predicate_is_pushed_into_a_shared_node(optimize):
+    models = {
+        "open_orders": (f"select o_orderkey, o_custkey, o_orderstatus, o_totalprice from {ORDERS}", "view"),
+        "big_open_orders": ('select o_orderkey, o_totalprice from "dev"."main"."open_orders" '
+                            "where o_orderstatus = 'O' and o_totalprice > 150", "table"),
+        "open_orders_by_customer": ('select o_custkey, count(*) as n from "dev"."main"."open_orders" '
+                                    "where o_orderstatus = 'O' and o_custkey < 40 group by o_custkey", "table"),
+    }
+    optimized = optimize(models, [PredicatePushdownRule(threshold=1.0)])
+    assert "PredicatePushdownRule" in optimized.applied
+    assert "o_orderstatus = 'O'" not in optimized.sql("open_orders_by_customer")
+    optimized.assert_equivalent()
+
+
+def test_predicate_moves_through_a_chain_of_views(optimize):
+    models = {
+        "orders_base": (f"select o_orderkey, o_custkey as customer, o_orderdate from {ORDERS}", "view"),
+        "orders_named": ('select o_orderkey, customer, o_orderdate as ordered_on '
+                         'from "dev"."main"."orders_base"', "view"),
+        "early": ('select o_orderkey from "dev"."main"."orders_named" '
+                  "where customer < 10 and ordered_on < DATE '1995-06-01'", "table"),
+        "late": ('select customer, count(*) as n from "dev"."main"."orders_named" '
+                 "where customer < 10 and ordered_on >= DATE '1995-06-01' group by customer", "table"),
+    }
+    optimized = optimize(models, [PredicatePushdownRule(threshold=1.0)])
+    pushdown = [n for n in optimized.created if n.endswith("_pushdown")]
+    # the shared node reads the base table, filtered by the predicate on its columns
+    assert pushdown and "o_custkey < 10" in optimized.sql(pushdown[0])
+    optimized.assert_equivalent()
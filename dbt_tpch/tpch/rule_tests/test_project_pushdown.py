@@ -0,0 +1,36 @@
+from rules.predicate_pushdown import PredicatePushdownRule
+from rules.project_pushdown import ProjectionPushdownRule
+from rules.shared_table import SharedTableRule
+
+ORDERS = '"dev"."tpch"."orders"'
+
+
+def test_created_node_keeps_only_the_columns_read(optimize):
+    models = {
+        "orders_base": (f"select * from {ORDERS}", "table"),
+        "urgent": ('select o_orderkey from "dev"."main"."orders_base" '
+                   "where o_orderpriority = '1-URGENT' and o_orderstatus = 'F'", "table"),
+        "urgent_total": ('select sum(o_totalprice) as total from "dev"."main"."orders_base" '
+                         "where o_orderpriority = '1-URGENT' and o_orderstatus = 'O'", "table"),
+    }
+    optimized = optimize(models, [PredicatePushdownRule(threshold=1.0), ProjectionPushdownRule()])
+    assert "ProjectionPushdownRule" in optimized.applied
+    pushdown = optimized.rewriter.asts["model.tpch.orders_base_pushdown"]
+    assert pushdown.named_selects == ["o_orderkey", "o_orderstatus", "o_totalprice"]
+    optimized.assert_equivalent()
+
+
+def test_created_node_reading_a_created_node_keeps_reading_it(optimize):
+    lineitem = '"dev"."tpch"."lineitem"'
+    models = {
+        "returned_small": (f"select l_orderkey from {lineitem} "
+                           "where l_returnflag = 'R' and l_quantity < 10", "table"),
+        "returned_large": (f"select l_orderkey, l_extendedprice from {lineitem} "
+                           "where l_returnflag = 'R' and l_quantity > 40", "table"),
+    }
+    optimized = optimize(models, [SharedTableRule(threshold=0.0), PredicatePushdownRule(threshold=1.0),
+                                  ProjectionPushdownRule()])
+    assert "ProjectionPushdownRule" in optimized.applied
+    pushdown = optimized.sql("shared_scan_lineitem_0_pushdown")
+    assert "FROM shared_scan_lineitem_0 AS" in pushdown and "dev.main" not in pushdown
+    optimized.assert_equivalent()
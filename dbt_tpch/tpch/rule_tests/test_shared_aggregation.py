@@ -0,0 +1,35 @@
+from rules.shared_aggregation import SharedAggregationRule
+
+LINEITEM = '"dev"."tpch"."lineitem"'
+
+
+def test_coarser_aggregations_roll_up_from_the_finest(optimize):
+    where = "where l_shipdate < DATE '1997-01-01'"
+    models = {
+        "by_flag_and_status": (
+            f"select l_returnflag, l_linestatus, sum(l_quantity) as qty, count(*) as n, "
+            f"min(l_extendedprice) as lo, avg(l_quantity) as avg_qty from {LINEITEM} {where} "
+            f"group by l_returnflag, l_linestatus", "table"),
+        "by_flag": (
+            f"select l_returnflag, max(l_extendedprice) as hi, count(l_tax) as taxed, "
+            f"avg(l_discount) as avg_disc from {LINEITEM} {where} group by l_returnflag", "table"),
+    }
+    optimized = optimize(models, [SharedAggregationRule(threshold=0.0)])
+    assert "SharedAggregationRule" in optimized.applied
+    assert "shared_agg_0" in optimized.sql("by_flag")
+    optimized.assert_equivalent()
+
+
+def test_average_of_a_decimal_expression_rolls_up_exactly(optimize):
+    revenue = "l_extendedprice * (1 - l_discount)"
+    models = {
+        "revenue_by_flag_and_status": (
+            f"select l_returnflag, l_linestatus, avg({revenue}) as avg_rev from {LINEITEM} "
+            f"group by l_returnflag, l_linestatus", "table"),
+        "revenue_by_flag": (
+            f"select l_returnflag, avg({revenue}) as avg_rev, avg(l_quantity * 0.5) as half_qty "
+            f"from {LINEITEM} group by l_returnflag", "table"),
+    }
+    optimized = optimize(models, [SharedAggregationRule(threshold=0.0)])
+    assert "shared_agg_0" in optimized.sql("revenue_by_flag")
+    optimized.assert_equivalent()
@@ -0,0 +1,15 @@
+from rules.shared_table import SharedTableRule
+
+LINEITEM = '"dev"."tpch"."lineitem"'
+
+
+def test_consumers_share_one_scan(optimize):
+    models = {
+        "returned": (f"select l_orderkey, l_quantity from {LINEITEM} where l_returnflag = 'R'", "table"),
+        "discounted": (f"select l.l_partkey, sum(l.l_extendedprice) as total from {LINEITEM} as l "
+                       f"where l.l_discount > 0.05 group by l.l_partkey", "table"),
+    }
+    optimized = optimize(models, [SharedTableRule(threshold=0.0)])
+    assert "SharedTableRule" in optimized.applied
+    assert "shared_scan_lineitem_0" in optimized.sql("discounted")
+    optimized.assert_equivalent()
@@ -0,0 +1,60 @@
+import os
+
+import duckdb
+import networkx as nx
+import sqlglot
+
+from conftest import DB_FILE, node_id
+from result_cache import table_key, table_version
+from rules.subresult_reuse import SubresultReuseRule
+from subresult_catalog import SubresultCatalog, base_tables, live_schema
+from utils import REWRITER_DIALECT
+
+ORDERS = '"dev"."tpch"."orders"'
+CACHE_DIR = "result_cache"
+
+
+def cache_results(queries):
+    """Store the results of {name: query} in a result cache, as an earlier executor run does."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    con = duckdb.connect(DB_FILE, read_only=True)
+    graph = nx.DiGraph()
+    versions = {}
+    for name, sql in queries.items():
+        with open(f"{name}.sql", "w") as f:
+            f.write(f'CREATE TABLE "dev"."main"."{name}" AS {sql}')
+        graph.add_node(node_id(name), sql_file=f"{name}.sql")
+        for table in base_tables(sqlglot.parse_one(sql, read=REWRITER_DIALECT)):
+            versions[table_key(table)] = table_version(con, table)
+    catalog = SubresultCatalog(CACHE_DIR)
+    catalog.define(graph, live_schema(con), versions)
+    for name, sql in queries.items():
+        path = os.path.abspath(os.path.join(CACHE_DIR, f"{name}.parquet"))
+        con.execute(f"COPY ({sql}) TO '{path}' (FORMAT PARQUET)")
+        columns = [(row[0], row[1]) for row in con.execute(f"DESCRIBE {sql}").fetchall()]
+        rows = con.execute(f"SELECT count(*) FROM ({sql})").fetchone()[0]
+        catalog.record(node_id(name), path, columns, rows)
+    catalog.save()
+    con.close()
+
+
+def test_nodes_and_scans_are_answered_from_cached_results(optimize):
+    cached = {
+        "open_orders": f"select o_orderkey, o_custkey, o_totalprice from {ORDERS} where o_orderstatus = 'O'",
+        "cheap_orders": f"select o_orderkey, o_totalprice, o_orderdate from {ORDERS} where o_totalprice < 160",
+    }
+    models = {
+        # the first cached query, spelled differently
+        "open": (f"select o.o_orderkey, o.o_custkey, o.o_totalprice from {ORDERS} as o "
+                 f"where 'O' = o.o_orderstatus", "table"),
+        # a subset of the second one's rows and columns
+        "cheap_recent": (f"select o_orderkey, o_totalprice from {ORDERS} "
+                         f"where o_totalprice < 130 and o_orderdate >= DATE '1996-01-01'", "table"),
+    }
+    # the cached queries read only base tables, which the models do not change
+    cache_results(cached)
+    optimized = optimize(models, [SubresultReuseRule(cache_dir=CACHE_DIR, threshold=0.0)])
+    assert optimized.applied.count("SubresultReuseRule") == 2
+    assert "open_orders.parquet" in optimized.sql("open")
+    assert "cheap_orders.parquet" in optimized.sql("cheap_recent")
+    optimized.assert_equivalent()
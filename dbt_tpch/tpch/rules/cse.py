@@ -1,83 +1,145 @@
 from rules.rewrite_rules import RewriteRule
 from sqlglot import exp
+from selectivity import DEFAULT_CSE_THRESHOLD
+from statistics_service import STATS_DB_PATH, StatisticsService
+from utils import NewNodeRecord, new_node_name, register_new_node
+from match_index import DagIndex
 
-# TODO: implement common subexpression elimination rule
 class CommonSubExpElimRule(RewriteRule):
+    def __init__(self, threshold=DEFAULT_CSE_THRESHOLD, db_path=STATS_DB_PATH):
+        self.threshold = threshold
+        self.db_path = db_path
+        # (kind, fingerprint, number of consumers) -> (materialize?, benefit ratio)
+        self.decisions = {}
+
     def match(self, graph, node_id, context = None):
         """
-        Identify common CTEs and extract them as another materialized table
+        Identify CTEs and derived-table subqueries that are semantically identical
+        (same fingerprint, see fingerprint.py) across nodes, and extract them as
+        another materialized table
         """
         if context is None:
             context = {}
 
-        # Traverse across all nodes in the graph and find common CTEs
-        # TODO: We only need to apply this rule once unless other rules create new CTEs
-        common_cte = {}
-        for node in graph.nodes():
-            ast = context.get(node)
-            with_expression = ast.find(exp.With)
-            if with_expression is not None:
-                for cte in with_expression:
-                    if cte not in common_cte:
-                        common_cte[cte] = []
-                    common_cte[cte].append(node)
-
-        worth_common_cte = {}
-        for cte, nodes in common_cte.items():
-            if len(nodes) > 1:
-                worth_common_cte[cte] = nodes
-
-        if len(worth_common_cte) > 0:
-            return True, {"common_cte": worth_common_cte}
+        # Look up the CTEs/subqueries of this node in the whole-DAG index
+        ast = context.get(node_id)
+        if ast is None:
+            return False, None
+        # outside of the rewriter, fall back to indexing the given ASTs
+        index = self.index or DagIndex.build(context)
+        rule_context = {}
+        for kind in ("cte", "subquery"):
+            groups = []
+            for key in index.keys_of(node_id, kind):
+                nodes = index.nodes_with(kind, key)
+                if len(nodes) < 2:
+                    continue
+                # already found not worth extracting for this many consumers
+                decision = self.decisions.get((kind, key, len(nodes)))
+                if decision is not None and not decision[0]:
+                    continue
+                groups.append((key, dict(nodes)))
+            if groups:
+                rule_context[f"common_{kind}"] = groups
+
+        if len(rule_context) > 0:
+            return True, rule_context
 
         return False, None
-    
+
+    def _worth_materializing(self, kind, key, body, occurrences):
+        """Cost-based decision (see selectivity.should_materialize_cse), cached per fingerprint."""
+        decision_key = (kind, key, len(occurrences))
+        if decision_key not in self.decisions:
+            try:
+                stats = self.stats or StatisticsService(self.db_path)
+                self.decisions[decision_key] = stats.should_materialize_cse(
+                    body, len(occurrences), self.threshold)
+            except Exception as e:
+                # e.g. the subexpression reads models not built yet: keep extracting
+                print(f"[WARN] No cost estimate for common {kind}, extracting it: {e}")
+                self.decisions[decision_key] = (True, float("nan"))
+        materialize, ratio = self.decisions[decision_key]
+        print(f"[CommonSubExpElimRule] {'Extract' if materialize else 'Skip'} common {kind} "
+              f"used by {len(occurrences)} nodes {sorted(occurrences)}: "
+              f"benefit={ratio:.2f} (threshold: {self.threshold:.2f})")
+        return materialize
+
+    def _add_shared_node(self, graph, asts, name, body, nodes):
+        graph.add_node(name)
+        for node in nodes:
+            graph.add_edge(name, node)
+
+        # the shared node now reads the parents it references directly
+        body_tables = {table.name for table in body.find_all(exp.Table)}
+        for node in nodes:
+            for parent in list(graph.predecessors(node)):
+                if parent.split(".")[-1] in body_tables:
+                    graph.add_edge(parent, name)
+
+        asts[name] = body.copy()
+        # record as intermediate node so it is materialized as a temp table
+        register_new_node(NewNodeRecord(node_id=name))
+
+    def scope(self, graph, node_id, context=None):
+        nodes = super().scope(graph, node_id, context)
+        for kind in ("cte", "subquery"):
+            for _, occurrences in (context or {}).get(f"common_{kind}", []):
+                nodes.update(occurrences)
+        return nodes
+
     def apply(self, graph, node_id, asts, context=None):
         """
-        Create a new node for the common CTE and replace all occurrences of the CTE in the graph
+        Create a new node for each common CTE/subquery and replace all its
+        occurrences in the graph with a reference to the new node
         """
 
         if context is None or not isinstance(context, dict):
             print(f"[ERROR] Invalid context: {context}")
             return graph, asts
 
-        # Create a new node
-        cte_id = 0
-        for cte, nodes in context["common_cte"].items():
-            # Modify the graph
-            # Make sure the node name is unique
-            dummy_node_name = f"shared_cte_{cte_id}"
-
-            graph.add_node(dummy_node_name)
-            for node in nodes:
-                graph.add_edge(dummy_node_name, node)
-
-            # Create a new AST for the shared CTE
-            asts[dummy_node_name] = cte.find(exp.Select).copy()
+        for key, occurrences in context.get("common_cte", []):
+            # an earlier extraction may have removed the CTE already
+            occurrences = {n: cte for n, cte in occurrences.items() if cte.root() is asts.get(n)}
+            if len(occurrences) < 2:
+                continue
+            base_cte = occurrences.get(node_id) or next(iter(occurrences.values()))
+            if not self._worth_materializing("cte", key, base_cte.this, occurrences):
+                continue
+            dummy_node_name = new_node_name(graph, "shared_cte")
+            self._add_shared_node(graph, asts, dummy_node_name, base_cte.this, list(occurrences))
 
             # Remove the CTE from the original node
             # And replace the CTE reference with the new node
-            for node in nodes:
-                # Remove 
+            for node, cte in occurrences.items():
                 ast = asts[node]
-                with_expression = ast.find(exp.With)
-                for node_cte in with_expression:
-                    if cte == node_cte:
-                        node_cte.pop()
-
+                with_expression = cte.parent
+                # the alias may differ per node; replace the one used in this node
+                cte_alias = cte.alias
+                cte.pop()
                 if len(with_expression.args["expressions"]) == 0:
                     with_expression.pop()
 
                 identifiers = ast.find_all(exp.Identifier)
                 for id in identifiers:
-                    if id.this == cte.alias:
-                        print(f"[INFO] Replacing {cte} with {dummy_node_name} in {node}")
+                    if id.this == cte_alias:
+                        print(f"[INFO] Replacing CTE {cte_alias} with {dummy_node_name} in {node}")
                         id.replace(exp.Identifier(this=dummy_node_name))
-                
-                # table_ref = ast.find_all(exp.Table)
-                # for table in table_ref:
-                #     if table.this.this == cte.alias:
-                #         print(f"[INFO] Replacing {cte} with {dummy_node_name} in {node}")
-                #         table.this.replace(exp.Identifier(this=dummy_node_name))
-
-            cte_id += 1
+
+        for key, occurrences in context.get("common_subquery", []):
+            occurrences = {n: sq for n, sq in occurrences.items() if sq.root() is asts.get(n)}
+            if len(occurrences) < 2:
+                continue
+            base_subquery = occurrences.get(node_id) or next(iter(occurrences.values()))
+            if not self._worth_materializing("subquery", key, base_subquery.this, occurrences):
+                continue
+            dummy_node_name = new_node_name(graph, "shared_subquery")
+            self._add_shared_node(graph, asts, dummy_node_name, base_subquery.this, list(occurrences))
+
+            # Replace the derived table by the new node, keeping its alias
+            for node, subquery in occurrences.items():
+                print(f"[INFO] Replacing subquery {subquery.alias} with {dummy_node_name} in {node}")
+                subquery.replace(exp.Table(
+                    this=exp.Identifier(this=dummy_node_name),
+                    alias=subquery.args.get("alias"),
+                ))
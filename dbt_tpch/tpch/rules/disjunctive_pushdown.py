@@ -0,0 +1,152 @@
+from rules.rewrite_rules import RewriteRule
+from sqlglot import exp
+import sqlglot.optimizer.simplify
+from selectivity import DEFAULT_THRESHOLD
+from statistics_service import STATS_DB_PATH, StatisticsService
+from transitive_pushdown import conjuncts_of, model_of, push_upstream, referenced_models, single_source, sources_of
+from utils import REWRITER_DIALECT, NewNodeRecord, register_new_node
+
+
+class DisjunctivePushdownRule(RewriteRule):
+    # runs after PredicatePushdownRule, which handles predicates shared by all children
+    priority = 1
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, db_path=STATS_DB_PATH):
+        self.threshold = threshold
+        self.db_path = db_path
+        # nodes created by this rule; their children are not filtered again
+        self.created = set()
+
+    def _parent_reference(self, graph, node_id, child, child_ast):
+        """The only table reference of the child's top-level SELECT to the parent, if any."""
+        if not isinstance(child_ast, exp.Select):
+            return None
+        for join in child_ast.args.get("joins") or []:
+            # a filter on the null-supplying side of an outer join is not a row filter
+            if join.side or (join.kind or "").upper() not in ("", "INNER", "CROSS"):
+                return None
+        # not a CTE of the child, nor another relation of the same name
+        references = [t for t in sources_of(child_ast).values() if model_of(graph, child, t, child_ast) == node_id]
+        return references[0] if len(references) == 1 else None
+
+    def _child_filter(self, child_ast, table):
+        """AND of the child's WHERE conjuncts reading only the parent, over unqualified columns."""
+        where = child_ast.args.get("where")
+        if where is None:
+            return None
+        sources = sources_of(child_ast)
+        conjuncts = []
+        for conjunct in conjuncts_of(where.this):
+            if single_source(conjunct, child_ast, sources) != table.alias_or_name:
+                continue
+            conjunct = conjunct.copy()
+            for column in conjunct.find_all(exp.Column):
+                column.set("table", None)
+            conjuncts.append(conjunct)
+        if not conjuncts:
+            return None
+        return exp.and_(*conjuncts, copy=False)
+
+    def _disjunction(self, context):
+        predicate = exp.or_(*[f.copy() for f in context["filters"].values()], copy=False)
+        return sqlglot.optimizer.simplify.simplify(predicate)
+
+    def prepare(self, graph, node_ids, asts):
+        """Warm the statistics memo with the estimates of all candidates (see PredicatePushdownRule.prepare)."""
+        if self.stats is None:
+            return
+        queries = []
+        for node_id in node_ids:
+            if node_id not in graph or node_id not in asts:
+                continue
+            matched, context = self.match(graph, node_id, asts)
+            if matched:
+                predicate_sql = self._disjunction(context).sql(dialect=REWRITER_DIALECT)
+                queries.extend(self.stats.pushdown_queries(asts[node_id], predicate_sql))
+        self.stats.warm(queries)
+
+    def match(self, graph, node_id, context=None):
+        """
+        Check if at least two children filter this node with (possibly different)
+        predicates on its columns, e.g. `region = 'ASIA'` and `region = 'EUROPE'`.
+        Returns (True, {"filters": {child: predicate}}) for those children.
+        """
+        if context is None:
+            context = {}
+        if node_id in self.created or node_id not in context:
+            return False, None
+        filters = {}
+        for child in graph.successors(node_id):
+            child_ast = context.get(child)
+            if child_ast is None:
+                continue
+            table = self._parent_reference(graph, node_id, child, child_ast)
+            if table is None:
+                continue
+            child_filter = self._child_filter(child_ast, table)
+            if child_filter is not None:
+                filters[child] = child_filter
+        if len(filters) < 2:
+            return False, None
+        return True, {"filters": filters}
+
+    def apply(self, graph, node_id, asts, context=None):
+        """
+        Create one node filtering the parent with the OR of the children's
+        predicates and let the children read it; each child keeps its own WHERE
+        clause as the residual predicate.
+        """
+        if context is None or not isinstance(context, dict):
+            print(f"[ERROR] Invalid context: {context}")
+            return
+
+        children = sorted(context["filters"])
+        disjunction = self._disjunction(context)
+        disjunction_sql = disjunction.sql(dialect=REWRITER_DIALECT)
+        stats = self.stats or StatisticsService(self.db_path)
+        try:
+            push, sel = stats.should_pushdown_on_ast(asts[node_id], disjunction_sql, len(children), self.threshold)
+        except Exception as e:
+            print(f"[WARN] No selectivity estimate for {node_id}, skipping shared filter: {e}")
+            return
+        if not push:
+            print(f"[DisjunctivePushdownRule] Skip shared filter on {node_id}: selectivity={sel:.2%} > "
+                  f"{self.threshold:.0%}")
+            return
+        print(f"[INFO] Shared filter '{disjunction_sql}' for children of node {node_id}: {children}")
+
+        node_name = node_id.split(".")[-1]
+        new_node_id = ".".join(node_id.split(".")[:-1] + [f"{node_name}_filtered"])
+        suffix = 1
+        while new_node_id in graph:
+            suffix += 1
+            new_node_id = ".".join(node_id.split(".")[:-1] + [f"{node_name}_filtered_{suffix}"])
+        new_node_name = new_node_id.split(".")[-1]
+
+        graph.add_node(new_node_id)
+        graph.add_edge(node_id, new_node_id)
+        parent_table = self._parent_reference(graph, node_id, children[0], asts[children[0]]).copy()
+        parent_table.set("alias", None)
+        asts[new_node_id] = exp.select("*").from_(parent_table, copy=False)
+        hops = push_upstream(graph, new_node_id, asts[new_node_id], conjuncts_of(disjunction), asts)
+        if hops:
+            for parent in referenced_models(graph, new_node_id, asts[new_node_id]):
+                graph.add_edge(parent, new_node_id)
+            if node_id not in referenced_models(graph, new_node_id, asts[new_node_id]):
+                graph.remove_edge(node_id, new_node_id)
+        print(f"[INFO] New node SQL: {asts[new_node_id].sql(dialect=REWRITER_DIALECT)}")
+        register_new_node(NewNodeRecord(node_id=new_node_id))
+        self.created.add(new_node_id)
+
+        # the children read the filtered node under their old alias
+        for child in children:
+            table = self._parent_reference(graph, node_id, child, asts[child])
+            table.replace(exp.Table(
+                this=exp.to_identifier(new_node_name, quoted=True),
+                db=exp.to_identifier("main"),
+                catalog=exp.to_identifier("temp"),
+                alias=exp.TableAlias(this=exp.to_identifier(table.alias_or_name)),
+            ))
+            graph.add_edge(new_node_id, child)
+            graph.remove_edge(node_id, child)
+        print(f"[INFO] Disjunctive pushdown applied at node {node_id} to children: {children}")
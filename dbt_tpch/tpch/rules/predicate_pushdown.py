@@ -7,9 +7,14 @@ import sqlglot
 from sqlglot import exp, optimizer
 from utils import *
 from selectivity import *
+from statistics_service import StatisticsService
+from transitive_pushdown import conjuncts_of, push_upstream, referenced_models
 
 # TODO: refine predicate pushdown rule to handle more cases like partial matches
 class PredicatePushdownRule(RewriteRule):
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+
     def _flatten_where_clause(self, child_where_norm : exp.Where):
         """
         Flatten a where clause's predicate expression of exp1 and exp2 and ... 
@@ -17,9 +22,39 @@ class PredicatePushdownRule(RewriteRule):
         """
         result = set()
         for expr in child_where_norm.iter_expressions():
-            result.update(set(expr.flatten(unnest=False)))
+            # a single predicate is one conjunct, not the operands `flatten` yields
+            result.update(set(expr.flatten(unnest=False)) if isinstance(expr, exp.And) else {expr})
         return result
     
+    def _common_predicate(self, context):
+        """(expression, SQL) of the predicate a match wants to push down."""
+        if ENABLE_PARTIAL_MATCH:
+            # this common_predicate is a set of predicate expressions
+            common_predicate_expr = filter_set_to_expr(context["common_predicate"])
+            common_predicate_sql = common_predicate_expr.sql(dialect=REWRITER_DIALECT)
+        else:
+            # this common_predicate is a complete where clause expression
+            common_predicate_sql = context["common_predicate"].this.sql(dialect=REWRITER_DIALECT)
+            common_predicate_expr = sqlglot.parse_one(common_predicate_sql, read=REWRITER_DIALECT).find(exp.Where).this
+        return common_predicate_expr, common_predicate_sql
+
+    def prepare(self, graph, node_ids, asts):
+        """
+        Collect the selectivity estimates every pushdown candidate among
+        `node_ids` will ask for, and warm the statistics memo with them.
+        """
+        if self.stats is None:
+            return
+        queries = []
+        for node_id in node_ids:
+            if node_id not in graph or node_id not in asts:
+                continue
+            matched, context = self.match(graph, node_id, asts)
+            if matched:
+                _, predicate_sql = self._common_predicate(context)
+                queries.extend(self.stats.pushdown_queries(asts[node_id], predicate_sql))
+        self.stats.warm(queries)
+
     def match(self, graph, node_id, context=None):
         """
         Check if downstream (child) nodes share an identical predicate in their WHERE clause.
@@ -116,31 +151,27 @@ class PredicatePushdownRule(RewriteRule):
             return 
 
         if ENABLE_PARTIAL_MATCH:
-            # this common_predicate is a set of predicate expressions
             common_predicate = context["common_predicate"]
-            common_predicate_expr = filter_set_to_expr(common_predicate)
-            print(f"[INFO] Common predicate expression: {common_predicate_expr}")
-            common_predicate_sql = common_predicate_expr.sql(dialect=REWRITER_DIALECT)
-        else:
-            # this common_predicate is a complete where clause expression
-            common_predicate_sql = context["common_predicate"].this.sql(dialect=REWRITER_DIALECT)
-            common_predicate_expr = sqlglot.parse_one(common_predicate_sql, read=REWRITER_DIALECT).find(exp.Where).this
-        
+        common_predicate_expr, common_predicate_sql = self._common_predicate(context)
+        print(f"[INFO] Common predicate expression: {common_predicate_expr}")
+
         # early-exit based on selectivity                               
-        db_path = "dev.duckdb"
-        con = duckdb.connect(db_path)
+        stats = self.stats or StatisticsService()
         num_children = len(context.get("children", []))
         
         base_ast  = asts[node_id]
-        push, sel = should_pushdown_on_ast(con, base_ast, common_predicate_sql, num_children)
+        try:
+            push, sel = stats.should_pushdown_on_ast(base_ast, common_predicate_sql, num_children, self.threshold)
+        except Exception as e:
+            # e.g. the parent reads an intermediate node that does not exist yet
+            print(f"[WARN] No selectivity estimate for {node_id}, skipping push-down: {e}")
+            return
         
         
         if not push:
             print(f"[PredicatePushdownRule] Skip push-down(add intermediate node) on {node_id}: selectivity={sel:.2%} > "
-                f"{DEFAULT_THRESHOLD:.0%}")
-            con.close()
+                f"{self.threshold:.0%}")
             return
-        con.close()
         
         children = context.get("children", [])
         print(f"[INFO] Pushdown common predicate '{common_predicate_sql}' " + 
@@ -162,11 +193,17 @@ class PredicatePushdownRule(RewriteRule):
         node_name = node_id.split(".")[-1]
         new_node_name = f"{node_name}_pushdown"
         new_node_id = ".".join(node_id.split(".")[:-1] + [new_node_name])
+        # the node may be pushed down into again in a later rewrite iteration
+        suffix = 1
+        while new_node_id in graph:
+            suffix += 1
+            new_node_id = ".".join(node_id.split(".")[:-1] + [f"{new_node_name}_{suffix}"])
         # add new node to graph by:
         # 1. edge from current node to new node
         # 2. and edge from new node to all children
         # 3. and remove previous edges from current node to children
         graph.add_node(new_node_id)
+        graph.add_edge(node_id, new_node_id)
         for child in children:
             graph.add_edge(new_node_id, child)
             graph.remove_edge(node_id, child)
@@ -176,7 +213,15 @@ class PredicatePushdownRule(RewriteRule):
             f"SELECT * FROM {child_from.this.sql(dialect=REWRITER_DIALECT)}", 
             read=REWRITER_DIALECT
         )
-        asts[new_node_id].set("where", exp.Where(this=common_predicate_expr))
+        # move the predicate on through the parent's definition if it is safe,
+        # reading the parent's inputs instead of the parent
+        hops = push_upstream(graph, new_node_id, asts[new_node_id], conjuncts_of(common_predicate_expr), asts)
+        if hops:
+            for parent in referenced_models(graph, new_node_id, asts[new_node_id]):
+                graph.add_edge(parent, new_node_id)
+            if node_id not in referenced_models(graph, new_node_id, asts[new_node_id]):
+                graph.remove_edge(node_id, new_node_id)
+            print(f"[INFO] Pushed predicate {hops} level(s) upstream of {node_id}")
         # print new node sql
         print(f"[INFO] New node SQL: {asts[new_node_id].sql(dialect=REWRITER_DIALECT)}")
         # record intermediate node id
@@ -227,7 +272,10 @@ class PredicatePushdownRule(RewriteRule):
             if child_ast:
                 child_from = child_ast.find(exp.From)
                 if child_from:
-                    child_from.set("this", exp.Identifier(this=new_node_relation_name))
+                    # a table reference (not a bare identifier), keeping the child's alias
+                    new_table = exp.to_table(new_node_relation_name, dialect=REWRITER_DIALECT)
+                    new_table.set("alias", child_from.this.args.get("alias"))
+                    child_from.set("this", new_table)
         
         # print what nodes are affected
         print(f"[INFO] Predicate pushdown applied at node {node_id} to children: {children}")
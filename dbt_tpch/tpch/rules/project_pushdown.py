@@ -1,39 +1,122 @@
 # projection_pushdown_rule.py
-import sqlglot
+import copy
+
 from sqlglot import exp
-from sqlglot.optimizer import normalize
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.optimizer.scope import traverse_scope
+from fingerprint import CATALOG_DB_PATH, DEFAULT_CATALOG, DEFAULT_SCHEMA, catalog_schema
 from rules.rewrite_rules import RewriteRule
-from utils import REWRITER_DIALECT
+from utils import REWRITER_DIALECT, get_new_node
 
+# schema of the nodes whose output columns are not known (e.g. an unexpanded star)
+_UNKNOWN = None
 
-class ProjectionPushdownRule(RewriteRule):
-    """
 
-    Current assumptions:
-      * Parent SELECT items are either STAR (*) or simple Column refs
-      * No complex expressions in parent's own SELECT list
+class ProjectionPushdownRule(RewriteRule):
     """
+    Drop the output columns of a materialized node that none of its children read.
 
-    def _required_columns_from_child(self, child_ast: exp.Expression) -> set[str]:
-        # assume alias cannot and should not be pushed down
-        alias_names = {
-            item.alias_or_name
-            for item in child_ast.expressions
-            if isinstance(item, exp.Alias)
-        }
+    Queries are qualified (`sqlglot.optimizer.qualify`) against a schema made of
+    the DuckDB catalog and the output columns of the upstream nodes, so stars are
+    expanded and unqualified columns resolved across joins; scope traversal then
+    finds the parent's columns a child reads in any of its CTEs, subqueries and
+    correlated subqueries.
 
-        required = set()
-
-        # print(repr(child_ast))
+    Only intermediate nodes created by the optimizer are pruned by default: the
+    columns of a dbt model are part of its output, which other consumers than the
+    DAG may read. `prune_models=True` prunes dbt models as well.
+    """
 
-        for col in child_ast.find_all(exp.Column):
-            col_sql = col.sql(dialect=REWRITER_DIALECT)
+    # after the rules that create intermediate nodes
+    priority = 3
+
+    def __init__(self, prune_models=False, db_path=CATALOG_DB_PATH):
+        self.prune_models = prune_models
+        self.db_path = db_path
+        # (node, AST hash) -> output column names (None if unknown)
+        self._outputs = {}
+
+    def _qualify(self, ast, schema):
+        return qualify(
+            ast.copy(),
+            dialect=REWRITER_DIALECT,
+            schema=schema,
+            catalog=DEFAULT_CATALOG,
+            db=DEFAULT_SCHEMA,
+            validate_qualify_columns=False,
+            quote_identifiers=False,
+            identify=False,
+        )
 
-            if col_sql in alias_names:
+    def _schema(self, graph, asts, nodes):
+        """DuckDB catalog extended by the output columns of `nodes` (as models and temp tables)."""
+        schema = copy.deepcopy(catalog_schema(self.db_path))
+        for node in nodes:
+            columns = self._output_columns(graph, asts, node)
+            if columns is _UNKNOWN:
                 continue
+            name = node.split(".")[-1]
+            for catalog, db in ((DEFAULT_CATALOG, DEFAULT_SCHEMA), ("temp", "main")):
+                schema.setdefault(catalog, {}).setdefault(db, {})[name] = {c: "UNKNOWN" for c in columns}
+        return schema
+
+    def _output_columns(self, graph, asts, node_id):
+        """Output column names of a node, derived from its upstream nodes."""
+        ast = asts.get(node_id)
+        if ast is None:
+            return _UNKNOWN
+        key = (node_id, hash(ast))
+        if key not in self._outputs:
+            self._outputs[key] = _UNKNOWN
+            try:
+                qualified = self._qualify(ast, self._schema(graph, asts, graph.predecessors(node_id)))
+                if isinstance(qualified, exp.Select) and not any(
+                    isinstance(p, exp.Star) or (isinstance(p, exp.Column) and isinstance(p.this, exp.Star))
+                    for p in qualified.expressions
+                ):
+                    self._outputs[key] = [p.alias_or_name for p in qualified.expressions]
+            except Exception as e:
+                print(f"[WARN] Could not qualify {node_id}: {e}")
+        return self._outputs[key]
+
+    def _required_columns_from_child(self, graph, asts, child, parent_name):
+        """
+        Lower-cased names of the parent's columns the child reads, None if that
+        cannot be determined (e.g. it selects * from the parent).
+        """
+        try:
+            qualified = self._qualify(asts[child], self._schema(graph, asts, graph.predecessors(child)))
+        except Exception as e:
+            print(f"[WARN] Could not qualify {child}: {e}")
+            return None
+        scopes = list(traverse_scope(qualified))
+        # the aliases the parent is read under, in any scope
+        aliases = set()
+        for scope in scopes:
+            for alias, (node, _) in scope.selected_sources.items():
+                if isinstance(node, exp.Table) and node.name.lower() == parent_name.lower():
+                    aliases.add(alias)
 
-            required.add(col_sql)
-
+        required = set()
+        for scope in scopes:
+            reads_parent = any(alias in aliases for alias in scope.selected_sources)
+            select = scope.expression
+            if reads_parent and isinstance(select, exp.Select):
+                for projection in select.expressions:
+                    if isinstance(projection, exp.Star) or (
+                        isinstance(projection, exp.Column) and isinstance(projection.this, exp.Star)
+                        and projection.table in aliases | {""}
+                    ):
+                        return None
+            projection_aliases = {p.alias for p in select.expressions} if isinstance(select, exp.Select) else set()
+            for column in scope.columns:
+                if column.table in aliases:
+                    required.add(column.name.lower())
+                elif not column.table and reads_parent and column.name not in projection_aliases:
+                    # unresolved: could be the parent's
+                    if len(scope.selected_sources) > 1:
+                        return None
+                    required.add(column.name.lower())
         return required
 
     def match(self, graph, node_id, context=None):
@@ -44,88 +127,74 @@ class ProjectionPushdownRule(RewriteRule):
         parent_ast = context.get(node_id)
         if parent_ast is None or not isinstance(parent_ast, exp.Select):
             return False, None
-
-        # TODO: we assume parent projection list must be either STAR or just Columns
-        parent_selects = parent_ast.expressions
-        if not parent_selects:  # weird edge‑case
+        if get_new_node(node_id) is None and not self.prune_models:
+            return False, None
+        # dropping columns of a DISTINCT changes its rows
+        if parent_ast.args.get("distinct"):
             return False, None
-
-        # select * 
-        parent_is_star = (
-            len(parent_selects) == 1 and isinstance(parent_selects[0], exp.Star)
-        )
-
-        if not parent_is_star:
-            # TODO: this is a naive case for now, parent has only columns
-            if not all(isinstance(x, exp.Column) for x in parent_selects):
-                return False, None
 
         # children -------------------------------------------------------
         children = list(graph.successors(node_id))
         if not children:
             return False, None
-        
-        # all childrem must only reference the parent
-        parent_table_name = node_id.split(".")[-1]
-        for child in children:
-            child_ast = context.get(child)
-            for table in child_ast.find_all(exp.Table):
-                if table.name != parent_table_name:
-                    print(
-                        f"[INFO] Child {child} references table {table.name}, "
-                        f"not parent {parent_table_name}"
-                    )
-                    return False, None
-
-        # get all column references from children
-        # should check whether it is from the parent
-        required_cols: set[str] = set()
-        for child in children:
-            child_ast = context.get(child)
-            if child_ast is None:
-                continue
 
-            # all cols referenced by child
-            # TODO: this is a naive way, may not work on call cases like alias
-            cols = self._required_columns_from_child(child_ast)
+        parent_cols = self._output_columns(graph, context, node_id)
+        if parent_cols is _UNKNOWN:
+            return False, None
+
+        required_cols = set()
+        for child in children:
+            if child not in context:
+                return False, None
+            cols = self._required_columns_from_child(graph, context, child, node_id.split(".")[-1])
+            if cols is None:
+                return False, None
             required_cols |= cols
 
-        parent_cols = (
-            set()
-            if parent_is_star
-            else {c.sql(dialect=REWRITER_DIALECT) for c in parent_selects}
-        )
+        # columns the parent's own clauses refer to by output name stay
+        for clause in ("group", "having", "order", "qualify"):
+            if parent_ast.args.get(clause):
+                required_cols |= {c.name.lower() for c in parent_ast.args[clause].find_all(exp.Column)}
 
+        keep = [c for c in parent_cols if c.lower() in required_cols]
         # log what parent cols and children cols are
-        print(f"[INFO] Parent cols: {sorted(parent_cols)}")
+        print(f"[INFO] Parent cols: {parent_cols}")
         print(f"[INFO] Children cols: {sorted(required_cols)}")
 
-        if required_cols and required_cols != parent_cols:
-            return True, {"required_cols": required_cols}
+        if keep and len(keep) < len(parent_cols):
+            return True, {"required_cols": keep}
 
         return False, None
 
-
-
     def apply(self, graph, node_id, asts, context=None):
         if not context or "required_cols" not in context:
             return
 
-        required_cols = context["required_cols"]
+        required_cols = {c.lower() for c in context["required_cols"]}
 
         parent_ast = asts.get(node_id)
         if parent_ast is None:
             return
 
-        # build new SELECT item list
-        new_items = [
-            sqlglot.parse_one(col_sql, read=REWRITER_DIALECT) for col_sql in required_cols
-        ]
+        # qualified, so that stars are expanded into the columns to choose from;
+        # qualifying also names every relation in the default catalog, which
+        # would send reads of intermediate nodes (temp tables) to dev.main
+        original = parent_ast.copy()
+        for table in original.find_all(exp.Table):
+            table.meta["relation"] = (table.args.get("catalog"), table.args.get("db"))
+        qualified = self._qualify(original, self._schema(graph, asts, graph.predecessors(node_id)))
+        for table in qualified.find_all(exp.Table):
+            if "relation" in table.meta:
+                catalog, db = table.meta.pop("relation")
+                table.set("catalog", catalog)
+                table.set("db", db)
+        new_items = [p for p in qualified.expressions if p.alias_or_name.lower() in required_cols]
 
         # actual ast modification
-        parent_ast.set("expressions", new_items) 
+        qualified.set("expressions", new_items)
+        asts[node_id] = qualified
 
         print(
             f"[INFO] Projection push down on node {node_id}: "
-            f"now selects {sorted(required_cols)}"
+            f"now selects {[p.alias_or_name for p in new_items]}"
         )
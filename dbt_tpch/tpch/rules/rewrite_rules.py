@@ -6,6 +6,14 @@ from sqlglot import exp
 from utils import *
 
 class RewriteRule:
+    # rules with a lower priority are checked first; equal priorities keep the
+    # order the rules were attached to the rewriter in
+    priority = 0
+    # `match_index.DagIndex` of the DAG being rewritten, set by the rewriter
+    index = None
+    # `statistics_service.StatisticsService` of the run, set by the rewriter
+    stats = None
+
     def match(self, graph : nx.DiGraph, node_id, context:dict[str, exp.Expression]=None):
         """
         Given graph, node and optional context, determines if the rule applies.
@@ -15,6 +23,21 @@ class RewriteRule:
         """
         pass
 
+    def prepare(self, graph : nx.DiGraph, node_ids, asts:dict[str, exp.Expression]):
+        """
+        Optional hook, called by the rewriter before each rewrite iteration with
+        the nodes about to be checked, e.g. to warm the statistics memo.
+        """
+        pass
+
+    def scope(self, graph : nx.DiGraph, node_id, context=None):
+        """
+        Nodes whose AST or edges `apply` may change for a match at `node_id`,
+        besides the nodes it creates: by default the node, its parents and its
+        children. Rules rewriting nodes elsewhere in the DAG extend it.
+        """
+        return {node_id} | set(graph.predecessors(node_id)) | set(graph.successors(node_id))
+
     def apply(self, graph : nx.DiGraph, node_id, asts:dict[str, exp.Expression], context=None):
         """
         Given graph, node, its AST and optional context, apply a transformation.
@@ -0,0 +1,249 @@
+from rules.rewrite_rules import RewriteRule
+from sqlglot import exp
+from fingerprint import DEFAULT_CATALOG, catalog_schema, fingerprint
+from match_index import DagIndex
+from selectivity import DEFAULT_CSE_THRESHOLD
+from statistics_service import STATS_DB_PATH, StatisticsService
+from transitive_pushdown import referenced_models
+from utils import REWRITER_DIALECT, NewNodeRecord, new_node_name, register_new_node
+
+# aggregates that can be computed on groups of partial aggregates
+DECOMPOSABLE_AGGREGATES = (exp.Sum, exp.Count, exp.Min, exp.Max, exp.Avg)
+# Select args an aggregation member may not have
+_BLOCKING_ARGS = ("with_", "joins", "distinct", "qualify", "laterals")
+
+
+class SharedAggregationRule(RewriteRule):
+    # after the pushdown rules settled the members' WHERE clauses
+    priority = 1
+
+    def __init__(self, threshold=DEFAULT_CSE_THRESHOLD, db_path=STATS_DB_PATH):
+        self.threshold = threshold
+        self.db_path = db_path
+        # (input fingerprint, members) -> (materialize?, benefit ratio)
+        self.decisions = {}
+        # nodes created by this rule; they are not members of another rollup
+        self.created = set()
+        # (table SQL, argument SQL) -> DECIMAL scale of an aggregate's argument
+        self._scales = {}
+
+    def _aggregation(self, ast):
+        """
+        (input table, input fingerprint, group key names) if `ast` is a single
+        GROUP BY over one table with decomposable aggregates only, else None.
+        """
+        if not isinstance(ast, exp.Select) or any(ast.args.get(arg) for arg in _BLOCKING_ARGS):
+            return None
+        from_ = next((v for v in ast.args.values() if isinstance(v, exp.From)), None)
+        if from_ is None or not isinstance(from_.this, exp.Table):
+            return None
+        group = ast.args.get("group")
+        if group is None or not group.expressions:
+            return None
+        if not all(isinstance(key, exp.Column) for key in group.expressions):
+            return None
+        keys = {key.name.lower() for key in group.expressions}
+        aggregates = list(ast.find_all(exp.AggFunc))
+        if not aggregates or ast.find(exp.Window, exp.Subquery):
+            return None
+        for aggregate in aggregates:
+            if not isinstance(aggregate, DECOMPOSABLE_AGGREGATES) or aggregate.find(exp.Distinct):
+                return None
+            if aggregate.find_ancestor(exp.AggFunc):
+                return None
+            # the rollup of an AVG depends on the type of its argument
+            if isinstance(aggregate, exp.Avg) and self._decimal_scale(from_.this, aggregate.this) is None:
+                return None
+        for projection in ast.expressions:
+            # output names of unaliased aggregates are spelled by DuckDB; keep them out
+            if projection.find(exp.AggFunc) and not isinstance(projection, exp.Alias):
+                return None
+            # columns outside of aggregates must be group keys
+            for column in projection.find_all(exp.Column):
+                if not column.find_ancestor(exp.AggFunc) and column.name.lower() not in keys:
+                    return None
+        table = from_.this
+        input_query = exp.select("*").from_(table.copy())
+        if ast.args.get("where"):
+            input_query = input_query.where(ast.args["where"].this.copy())
+        try:
+            input_key = fingerprint(input_query)
+        except Exception:
+            return None
+        return table, input_key, keys
+
+    def match(self, graph, node_id, context = None):
+        """
+        Identify sibling aggregations over the same input (same table and WHERE
+        clause) whose GROUP BY keys are all subsets of the finest one
+        """
+        if context is None:
+            context = {}
+        ast = context.get(node_id)
+        if ast is None or node_id in self.created:
+            return False, None
+        aggregation = self._aggregation(ast)
+        if aggregation is None:
+            return False, None
+        table, input_key, _ = aggregation
+        if table.name in self.created:
+            # already rolling up from a shared aggregate
+            return False, None
+        index = self.index or DagIndex.build(context)
+        members = {}
+        for node in index.nodes_with("table", table.name.lower()):
+            if node not in graph or node in self.created or node not in context:
+                continue
+            other = self._aggregation(context[node])
+            if other is not None and other[1] == input_key:
+                members[node] = other[2]
+        if len(members) < 2:
+            return False, None
+        finest = set().union(*members.values())
+        if not any(keys == finest for keys in members.values()):
+            return False, None
+        decision = self.decisions.get((input_key, frozenset(members)))
+        if decision is not None and not decision[0]:
+            return False, None
+        return True, {"input": input_key, "members": sorted(members), "keys": sorted(finest)}
+
+    def _decimal_scale(self, table, arg):
+        """
+        Scale of `arg` over `table` if it is a DECIMAL, 0 for another type, None
+        if its type is unknown. Columns are looked up in the catalog, other
+        expressions typed by DuckDB.
+        """
+        arg = arg.copy()
+        for column in arg.find_all(exp.Column):
+            column.set("table", None)
+        key = (table.sql(dialect=REWRITER_DIALECT), arg.sql(dialect=REWRITER_DIALECT))
+        if key not in self._scales:
+            dtype = None
+            if isinstance(arg, exp.Column):
+                columns = catalog_schema(self.db_path).get(table.catalog or DEFAULT_CATALOG, {}) \
+                    .get(table.db, {}).get(table.name, {})
+                dtype = {c.lower(): t for c, t in columns.items()}.get(arg.name.lower())
+            if dtype is None:
+                try:
+                    stats = self.stats or StatisticsService(self.db_path)
+                    query = exp.select(arg.copy()).from_(
+                        exp.Table(this=table.this.copy(), db=table.args.get("db"), catalog=table.args.get("catalog")))
+                    dtype = stats.output_types(query)[0][1]
+                except Exception as e:
+                    print(f"[WARN] Unknown type of {key[1]} over {key[0]}: {e}")
+            if dtype is None:
+                self._scales[key] = None
+            elif dtype.upper().startswith("DECIMAL(") and "," in dtype:
+                self._scales[key] = int(dtype.split(",")[1].rstrip(") "))
+            else:
+                self._scales[key] = 0
+        return self._scales[key]
+
+    def _partials(self, aggregate, table):
+        """(partial aggregates over the input, combine(rolled up partials) -> expression)."""
+        arg = aggregate.this.copy() if aggregate.this is not None else exp.Star()
+        for column in arg.find_all(exp.Column):
+            column.set("table", None)
+        if isinstance(aggregate, exp.Avg):
+            # AVG(x) = SUM(x) / COUNT(x); DuckDB averages a DECIMAL as its unscaled
+            # integer sum over count * 10^scale, which this reproduces bit for bit
+            partials = [exp.Sum(this=arg), exp.Count(this=arg.copy())]
+            factor = 10 ** self._decimal_scale(table, arg)
+            if factor == 1:
+                return partials, lambda s, c: exp.Div(
+                    this=exp.cast(exp.Sum(this=s), "DOUBLE"), expression=exp.Sum(this=c))
+            return partials, lambda s, c: exp.Div(
+                this=exp.cast(exp.Mul(this=exp.Sum(this=s), expression=exp.Literal.number(factor)), "DOUBLE"),
+                expression=exp.Paren(this=exp.Mul(this=exp.Sum(this=c), expression=exp.Literal.number(factor))))
+        if isinstance(aggregate, exp.Count):
+            # the sum of counts is a HUGEINT, and NULL over no rows
+            partials = [exp.Count(this=arg)]
+            return partials, lambda c: exp.cast(
+                exp.func("COALESCE", exp.Sum(this=c), exp.Literal.number(0)), "BIGINT")
+        partials = [aggregate.__class__(this=arg)]
+        # SUM of SUMs, MIN of MINs, MAX of MAXs
+        return partials, lambda p: aggregate.__class__(this=p)
+
+    def scope(self, graph, node_id, context=None):
+        return super().scope(graph, node_id, context) | set((context or {}).get("members", []))
+
+    def apply(self, graph, node_id, asts, context=None):
+        """
+        Materialize the finest-grained aggregate with the partial aggregates every
+        member needs once, and rewrite each member to roll up from it
+        """
+        if context is None or not isinstance(context, dict):
+            print(f"[ERROR] Invalid context: {context}")
+            return graph, asts
+
+        members = context["members"]
+        keys = context["keys"]
+        table, _, _ = self._aggregation(asts[members[0]])
+
+        # partial aggregate SQL -> column name in the shared node
+        partial_columns = {}
+        partial_exprs = []
+        rollups = {}
+        for member in members:
+            for aggregate in asts[member].find_all(exp.AggFunc):
+                partials, combine = self._partials(aggregate, table)
+                names = []
+                for partial in partials:
+                    sql = partial.sql(dialect=REWRITER_DIALECT)
+                    if sql not in partial_columns:
+                        partial_columns[sql] = f"agg_{len(partial_columns)}"
+                        partial_exprs.append(exp.alias_(partial, partial_columns[sql]))
+                    names.append(exp.column(partial_columns[sql]))
+                rollups[id(aggregate)] = combine(*names)
+
+        body = exp.select(*[exp.column(key) for key in keys], *partial_exprs).from_(
+            exp.Table(this=table.this.copy(), db=table.args.get("db"), catalog=table.args.get("catalog")))
+        where = asts[members[0]].args.get("where")
+        if where is not None:
+            condition = where.this.copy()
+            for column in condition.find_all(exp.Column):
+                column.set("table", None)
+            body = body.where(condition)
+        body = body.group_by(*[exp.column(key) for key in keys])
+
+        decision_key = (context["input"], frozenset(members))
+        if decision_key not in self.decisions:
+            try:
+                stats = self.stats or StatisticsService(self.db_path)
+                self.decisions[decision_key] = stats.should_materialize_cse(body, len(members), self.threshold)
+            except Exception as e:
+                print(f"[WARN] No cost estimate for shared aggregation, skipping it: {e}")
+                self.decisions[decision_key] = (False, float("nan"))
+        materialize, ratio = self.decisions[decision_key]
+        print(f"[SharedAggregationRule] {'Share' if materialize else 'Skip'} aggregation by {keys} "
+              f"for {len(members)} nodes {members}: benefit={ratio:.2f} (threshold: {self.threshold:.2f})")
+        if not materialize:
+            return graph, asts
+
+        dummy_node_name = new_node_name(graph, "shared_agg")
+        graph.add_node(dummy_node_name)
+        asts[dummy_node_name] = body
+        for parent in referenced_models(graph, members[0], body):
+            graph.add_edge(parent, dummy_node_name)
+        # record as intermediate node so it is materialized as a temp table
+        register_new_node(NewNodeRecord(node_id=dummy_node_name))
+        self.created.add(dummy_node_name)
+        print(f"[INFO] New node SQL: {body.sql(dialect=REWRITER_DIALECT)}")
+
+        # Roll each member up from the shared aggregate
+        for member in members:
+            ast = asts[member]
+            for aggregate in list(ast.find_all(exp.AggFunc)):
+                aggregate.replace(rollups[id(aggregate)])
+            for column in ast.find_all(exp.Column):
+                if column.name.lower() in keys or column.name.startswith("agg_"):
+                    column.set("table", None)
+            from_ = next(v for v in ast.args.values() if isinstance(v, exp.From))
+            from_.set("this", exp.Table(this=exp.Identifier(this=dummy_node_name)))
+            ast.set("where", None)
+            still_read = set(referenced_models(graph, member, ast))
+            for parent in list(graph.predecessors(member)):
+                if parent not in still_read:
+                    graph.remove_edge(parent, member)
+            graph.add_edge(dummy_node_name, member)
+            print(f"[INFO] Rolling up {member} from {dummy_node_name}")
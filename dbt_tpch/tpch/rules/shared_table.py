@@ -1,9 +1,214 @@
 from rules.rewrite_rules import RewriteRule
+from sqlglot import exp
+import sqlglot.optimizer.simplify
+from sqlglot.optimizer.qualify import qualify
+from fingerprint import DEFAULT_CATALOG, DEFAULT_SCHEMA, _mapping_schema, catalog_schema
+from match_index import DagIndex, relation_key
+from selectivity import DEFAULT_SHARED_SCAN_THRESHOLD
+from statistics_service import STATS_DB_PATH, StatisticsService
+from transitive_pushdown import conjuncts_of
+from utils import REWRITER_DIALECT, NewNodeRecord, new_node_name, register_new_node
+
 
-# TODO: implement shared table rule
 class SharedTableRule(RewriteRule):
+    # runs last, on the base table reads the other rules leave behind
+    priority = 2
+
+    def __init__(self, threshold=DEFAULT_SHARED_SCAN_THRESHOLD, db_path=STATS_DB_PATH):
+        self.threshold = threshold
+        self.db_path = db_path
+        # (table, consumers) -> (share?, benefit ratio)
+        self.decisions = {}
+        # nodes created by this rule; they are not consumers of another shared scan
+        self.created = set()
+
+    def _table_columns(self, table):
+        """Columns of a base table in the DuckDB catalog, None if `table` is not one."""
+        if not table.db or (table.catalog or "").lower() == "temp":
+            return None
+        schema = catalog_schema(self.db_path)
+        columns = schema.get(table.catalog or DEFAULT_CATALOG, {}).get(table.db, {}).get(table.name)
+        return list(columns) if columns else None
+
+    def _base_tables(self, graph, ast):
+        """key -> table references of the base tables (not models or CTEs) `ast` reads."""
+        models = {n.split(".")[-1].lower() for n in graph.nodes}
+        ctes = {cte.alias.lower() for cte in ast.find_all(exp.CTE)}
+        tables = {}
+        for table in ast.find_all(exp.Table):
+            name = table.name.lower()
+            if name in models or name in ctes or self._table_columns(table) is None:
+                continue
+            tables.setdefault(relation_key(table), []).append(table)
+        return tables
+
+    def _requirements(self, ast, key, table_columns):
+        """
+        (columns, filter) one consumer needs of the base table: the columns it may
+        read and the predicate on the table's rows it filters by (None: all rows).
+        None if the consumer cannot be analyzed.
+        """
+        try:
+            qualified = qualify(
+                ast.copy(),
+                dialect=REWRITER_DIALECT,
+                schema=_mapping_schema(self.db_path),
+                catalog=DEFAULT_CATALOG,
+                db=DEFAULT_SCHEMA,
+                validate_qualify_columns=False,
+                quote_identifiers=False,
+                identify=False,
+            )
+        except Exception as e:
+            print(f"[WARN] Could not qualify consumer of {key[-1]}: {e}")
+            return None
+        occurrences = [
+            t for t in qualified.find_all(exp.Table)
+            if t.db and t.name.lower() == key[-1] and relation_key(t) == key
+        ]
+        known = {c.lower(): c for c in table_columns}
+        columns = set()
+        filters = []
+        for table in occurrences:
+            alias = table.alias_or_name.lower()
+            select = table.parent.parent if isinstance(table.parent, (exp.From, exp.Join)) else None
+            if not isinstance(select, exp.Select):
+                return None
+            # an unexpanded star reads every column of the table
+            if any(isinstance(p, exp.Star) or (isinstance(p, exp.Column) and isinstance(p.this, exp.Star)
+                                               and p.table.lower() in ("", alias))
+                   for p in select.expressions):
+                columns.update(table_columns)
+            # columns of this alias, or unqualified, anywhere in the query (a superset is safe)
+            for column in qualified.find_all(exp.Column):
+                if column.table.lower() in ("", alias) and column.name.lower() in known:
+                    columns.add(known[column.name.lower()])
+            filters.append(self._occurrence_filter(select, alias))
+        if not occurrences:
+            return None
+        if any(f is None for f in filters):
+            return columns, None
+        return columns, exp.or_(*filters, copy=False)
+
+    def _occurrence_filter(self, select, alias):
+        """AND of the WHERE conjuncts of `select` on `alias` only, None if there are none."""
+        where = select.args.get("where")
+        if where is None:
+            return None
+        for join in select.args.get("joins") or []:
+            if join.side or (join.kind or "").upper() not in ("", "INNER", "CROSS"):
+                return None
+        conjuncts = []
+        for conjunct in conjuncts_of(where.this):
+            tables = {column.table.lower() for column in conjunct.find_all(exp.Column)}
+            if tables != {alias} or conjunct.find(exp.Subquery, exp.Select):
+                continue
+            conjunct = conjunct.copy()
+            for column in conjunct.find_all(exp.Column):
+                column.set("table", None)
+            conjuncts.append(conjunct)
+        return exp.and_(*conjuncts, copy=False) if conjuncts else None
+
     def match(self, graph, node_id, context = None):
-        pass
-    
+        """
+        Identify base tables (e.g. "dev"."tpch"."lineitem") that this node and
+        other nodes scan independently
+        """
+        if context is None:
+            context = {}
+        ast = context.get(node_id)
+        if ast is None or node_id in self.created:
+            return False, None
+        index = self.index or DagIndex.build(context)
+        shared = []
+        for key, tables in self._base_tables(graph, ast).items():
+            # every node naming the same base table reads it; `key` is not a model or a CTE
+            consumers = [
+                n for n in index.nodes_with("relation", key)
+                if n in graph and n not in self.created and n in context
+            ]
+            if len(consumers) < 2:
+                continue
+            decision = self.decisions.get((key, frozenset(consumers)))
+            if decision is not None and not decision[0]:
+                continue
+            shared.append((key, sorted(consumers)))
+        if shared:
+            return True, {"shared_tables": shared}
+        return False, None
+
+    def scope(self, graph, node_id, context=None):
+        nodes = super().scope(graph, node_id, context)
+        for _, consumers in (context or {}).get("shared_tables", []):
+            nodes.update(consumers)
+        return nodes
+
     def apply(self, graph, node_id, asts, context=None):
-        pass
\ No newline at end of file
+        """
+        Create one node scanning the base table for all its consumers, projecting
+        the union of the columns they read and filtering the OR of their filters,
+        and let the consumers read it; they keep their own predicates
+        """
+        if context is None or not isinstance(context, dict):
+            print(f"[ERROR] Invalid context: {context}")
+            return graph, asts
+
+        for key, consumers in context.get("shared_tables", []):
+            decision_key = (key, frozenset(consumers))
+            # an earlier application may have replaced the table already
+            tables = {n: self._base_tables(graph, asts[n]).get(key) for n in consumers}
+            tables = {n: t for n, t in tables.items() if t}
+            if len(tables) < 2:
+                continue
+            table = next(iter(tables.values()))[0]
+            table_columns = self._table_columns(table)
+            requirements = {n: self._requirements(asts[n], key, table_columns) for n in tables}
+            requirements = {n: r for n, r in requirements.items() if r is not None}
+            if len(requirements) < 2:
+                self.decisions[decision_key] = (False, float("nan"))
+                continue
+
+            shared_columns = [c for c in table_columns if any(c in cols for cols, _ in requirements.values())]
+            filters = [f for _, f in requirements.values()]
+            predicate = None
+            if all(f is not None for f in filters):
+                predicate = sqlglot.optimizer.simplify.simplify(exp.or_(*filters, copy=False))
+            predicate_sql = predicate.sql(dialect=REWRITER_DIALECT) if predicate is not None else None
+            base_table = exp.table_(table.name, db=table.db, catalog=table.catalog or None, quoted=True)
+
+            if decision_key not in self.decisions:
+                try:
+                    stats = self.stats or StatisticsService(self.db_path)
+                    self.decisions[decision_key] = stats.should_share_scan(
+                        base_table, [cols for cols, _ in requirements.values()], predicate_sql, self.threshold)
+                except Exception as e:
+                    print(f"[WARN] No cost estimate for shared scan of {key[-1]}, skipping it: {e}")
+                    self.decisions[decision_key] = (False, float("nan"))
+            share, ratio = self.decisions[decision_key]
+            print(f"[SharedTableRule] {'Share' if share else 'Skip'} scan of {key[-1]} "
+                  f"by {len(requirements)} nodes {sorted(requirements)}: "
+                  f"benefit={ratio:.2f} (threshold: {self.threshold:.2f})")
+            if not share:
+                continue
+
+            dummy_node_name = new_node_name(graph, f"shared_scan_{key[-1]}")
+            body = exp.select(*[exp.column(c, quoted=True) for c in shared_columns]).from_(base_table)
+            if predicate is not None:
+                body = body.where(predicate)
+            graph.add_node(dummy_node_name)
+            for node in requirements:
+                graph.add_edge(dummy_node_name, node)
+            asts[dummy_node_name] = body
+            # record as intermediate node so it is materialized as a temp table
+            register_new_node(NewNodeRecord(node_id=dummy_node_name))
+            self.created.add(dummy_node_name)
+            print(f"[INFO] New node SQL: {body.sql(dialect=REWRITER_DIALECT)}")
+
+            # Replace the base table by the new node, keeping its alias
+            for node in requirements:
+                print(f"[INFO] Replacing scan of {key[-1]} with {dummy_node_name} in {node}")
+                for occurrence in tables[node]:
+                    occurrence.replace(exp.Table(
+                        this=exp.Identifier(this=dummy_node_name),
+                        alias=exp.TableAlias(this=exp.to_identifier(occurrence.alias_or_name)),
+                    ))
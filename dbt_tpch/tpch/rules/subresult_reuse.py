@@ -0,0 +1,251 @@
+import os
+
+from rules.rewrite_rules import RewriteRule
+import sqlglot.optimizer.simplify
+from sqlglot import exp
+from sqlglot.optimizer.qualify import qualify
+from fingerprint import DEFAULT_CATALOG, DEFAULT_SCHEMA, _mapping_schema, catalog_schema, fingerprint
+from materialization import expanded_query
+from result_cache import DEFAULT_CACHE_DIR, table_key, table_version
+from selectivity import DEFAULT_REUSE_THRESHOLD
+from statistics_service import STATS_DB_PATH, StatisticsService
+from subresult_catalog import CATALOG_FILE, SubresultCatalog, base_tables, implies
+from transitive_pushdown import conjuncts_of
+from utils import REWRITER_DIALECT
+
+
+class SubresultReuseRule(RewriteRule):
+    """
+    Answer nodes, or their base table scans, from results cached by earlier runs
+    (see subresult_catalog.py).
+
+    A node whose query, with its upstream nodes expanded, has the fingerprint
+    of a catalog entry over the same base table versions is replaced by a read
+    of the cached result. Otherwise each base table the node scans may be
+    replaced by a cached select-project over it that subsumes the node's use of
+    it: every predicate of the entry is implied by the node's predicates on the
+    table (e.g. an entry filtering `x < 20` for a node filtering `x < 10`) and
+    the entry has every column the node reads. The node keeps its predicates,
+    which then act as the residual filter.
+    """
+
+    # first, so the other rules work on what is left to compute
+    priority = 0
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, threshold=DEFAULT_REUSE_THRESHOLD, db_path=STATS_DB_PATH):
+        self.threshold = threshold
+        self.db_path = db_path
+        self.catalog = None
+        if os.path.isfile(os.path.join(cache_dir, CATALOG_FILE)):
+            self.catalog = SubresultCatalog(cache_dir)
+        # base table -> version in the database being optimized against
+        self.versions = {}
+        # node -> fingerprint of its expanded query, before any rewrite
+        self.fingerprints = {}
+        # (node, entry path) -> (reuse?, benefit ratio)
+        self.decisions = {}
+        # nodes answered as a whole
+        self.reused = set()
+
+    def _stats(self):
+        return self.stats or StatisticsService(self.db_path)
+
+    def _current(self, inputs):
+        """Whether base tables still have the versions a cached result was computed from."""
+        for table, version in inputs.items():
+            if table not in self.versions:
+                catalog, db, name = table.split(".")
+                self.versions[table] = table_version(
+                    self._stats().conn, exp.table_(name, db=db, catalog=catalog, quoted=True))
+            if self.versions[table] != version:
+                return False
+        return True
+
+    def _fingerprint(self, graph, asts, node_id, memo=None):
+        if node_id not in self.fingerprints:
+            try:
+                self.fingerprints[node_id] = fingerprint(expanded_query(graph, asts, node_id, memo or {}))
+            except Exception:
+                self.fingerprints[node_id] = None
+        return self.fingerprints[node_id]
+
+    def prepare(self, graph, node_ids, asts):
+        """
+        Fingerprint every node while its upstream nodes are unchanged; the
+        optimizer also writes those of the models to the DAG file for the
+        catalog of this run.
+        """
+        if self.fingerprints:
+            return
+        memo = {}
+        for node_id in graph.nodes:
+            if node_id in asts:
+                self._fingerprint(graph, asts, node_id, memo)
+
+    def _decide(self, node_id, entry, query, column_types):
+        decision_key = (node_id, entry["path"])
+        if decision_key not in self.decisions:
+            try:
+                self.decisions[decision_key] = self._stats().should_reuse_subresult(
+                    query, entry["rows"], column_types, self.threshold)
+            except Exception as e:
+                print(f"[WARN] No cost estimate for reusing {entry['path']} in {node_id}: {e}")
+                self.decisions[decision_key] = (False, float("nan"))
+        return self.decisions[decision_key]
+
+    def _covers(self, entry, ast):
+        """Whether a cached result has every output column of the node (unknown for a SELECT *)."""
+        outputs = ast.named_selects if isinstance(ast, exp.Query) else []
+        if "*" in outputs:
+            return True
+        return {name.lower() for name in outputs} <= {name.lower() for name, _ in entry["columns"]}
+
+    def _requirements(self, ast, key, table_columns):
+        """
+        (columns, [conjuncts of each occurrence]) the node needs of base table
+        `key`, over unqualified columns; None if it cannot be analyzed.
+        """
+        try:
+            qualified = qualify(
+                ast.copy(),
+                dialect=REWRITER_DIALECT,
+                schema=_mapping_schema(self.db_path),
+                catalog=DEFAULT_CATALOG,
+                db=DEFAULT_SCHEMA,
+                validate_qualify_columns=False,
+                quote_identifiers=False,
+                identify=False,
+            )
+        except Exception:
+            return None
+        known = {c.lower(): c for c in table_columns}
+        columns = set()
+        occurrences = []
+        for table in base_tables(qualified):
+            if table_key(table) != key:
+                continue
+            alias = table.alias_or_name.lower()
+            select = table.parent.parent if isinstance(table.parent, (exp.From, exp.Join)) else None
+            if not isinstance(select, exp.Select):
+                return None
+            if any(isinstance(p, exp.Star) or (isinstance(p, exp.Column) and isinstance(p.this, exp.Star)
+                                               and p.table.lower() in ("", alias))
+                   for p in select.expressions):
+                columns.update(table_columns)
+            # columns of this alias, or unqualified, anywhere in the query (a superset is safe)
+            for column in qualified.find_all(exp.Column):
+                if column.table.lower() in ("", alias) and column.name.lower() in known:
+                    columns.add(known[column.name.lower()])
+            conjuncts = []
+            where = select.args.get("where")
+            for join in select.args.get("joins") or []:
+                if join.side or (join.kind or "").upper() not in ("", "INNER", "CROSS"):
+                    where = None
+            if where is not None:
+                for conjunct in conjuncts_of(where.this):
+                    if {c.table.lower() for c in conjunct.find_all(exp.Column)} != {alias}:
+                        continue
+                    conjunct = conjunct.copy()
+                    for column in conjunct.find_all(exp.Column):
+                        column.set("table", None)
+                    # spelled like the catalog's predicates
+                    conjuncts.append(sqlglot.optimizer.simplify.simplify(conjunct))
+            occurrences.append(conjuncts)
+        if not occurrences:
+            return None
+        return columns, occurrences
+
+    def _subsumes(self, entry, columns, occurrences):
+        """Whether a select-project entry has the columns and every occurrence's rows."""
+        definition = entry["select_project"]
+        sources = {c.lower() for c in definition["columns"].values()}
+        if not {c.lower() for c in columns} <= sources:
+            return False
+        predicates = [exp.maybe_parse(p, dialect=REWRITER_DIALECT) for p in definition["predicates"]]
+        return all(implies(conjuncts, p) for conjuncts in occurrences for p in predicates)
+
+    def match(self, graph, node_id, context=None):
+        """
+        Find a cached result of the whole node, or cached select-projects
+        subsuming its base table scans
+        """
+        if context is None:
+            context = {}
+        ast = context.get(node_id)
+        if self.catalog is None or ast is None or node_id in self.reused:
+            return False, None
+
+        key = self._fingerprint(graph, context, node_id)
+        for entry in self.catalog.matching(key) if key else []:
+            if not self._current(entry["inputs"]) or not self._covers(entry, ast):
+                continue
+            query = expanded_query(graph, context, node_id, {})
+            reuse, _ = self._decide(node_id, entry, query, [dtype for _, dtype in entry["columns"]])
+            if reuse:
+                return True, {"whole": entry}
+
+        scans = []
+        for table in {table_key(t): t for t in base_tables(ast)}.values():
+            key = table_key(table)
+            schema = catalog_schema(self.db_path)
+            table_columns = list(schema.get(table.catalog or DEFAULT_CATALOG, {}).get(table.db, {})
+                                 .get(table.name, {}))
+            entries = [e for e in self.catalog.entries_for(key) if self._current(e["inputs"])]
+            if not table_columns or not entries:
+                continue
+            requirements = self._requirements(ast, key, table_columns)
+            if requirements is None:
+                continue
+            columns, occurrences = requirements
+            candidates = sorted((e for e in entries if self._subsumes(e, columns, occurrences)),
+                                key=lambda e: e["rows"])
+            if not candidates:
+                continue
+            entry = candidates[0]
+            types = {name: dtype for name, dtype in entry["columns"]}
+            outputs = {src.lower(): out for out, src in entry["select_project"]["columns"].items()}
+            scan = exp.select(*[exp.column(c, quoted=True) for c in sorted(columns)]).from_(
+                exp.table_(table.name, db=table.db, catalog=table.catalog or None, quoted=True))
+            reuse, _ = self._decide(node_id, entry, scan, [types[outputs[c.lower()]] for c in columns])
+            if reuse:
+                scans.append((key, entry))
+        if scans:
+            return True, {"scans": scans}
+        return False, None
+
+    def _reader(self, entry, rename=None):
+        """SELECT of a cached result, cast back to its column types (and renamed)."""
+        rename = rename or {}
+        return exp.select(*[
+            exp.alias_(exp.cast(exp.column(name, quoted=True), dtype), rename.get(name, name), quoted=True)
+            for name, dtype in entry["columns"]
+        ]).from_(exp.Table(this=exp.ReadParquet(expressions=[exp.Literal.string(entry["path"])])))
+
+    def apply(self, graph, node_id, asts, context=None):
+        """Replace the node, or the scans, by reads of the cached results"""
+        if context is None or not isinstance(context, dict):
+            print(f"[ERROR] Invalid context: {context}")
+            return
+
+        if "whole" in context:
+            entry = context["whole"]
+            asts[node_id] = self._reader(entry)
+            # reads none of its parents any more
+            for parent in list(graph.predecessors(node_id)):
+                graph.remove_edge(parent, node_id)
+            self.reused.add(node_id)
+            print(f"[SubresultReuseRule] Reusing {entry['path']} ({entry['rows']} rows, "
+                  f"cached from {entry['node_id']}) for node {node_id}")
+            return
+
+        for key, entry in context["scans"]:
+            rename = entry["select_project"]["columns"]
+            for table in base_tables(asts[node_id]):
+                if table_key(table) != key:
+                    continue
+                table.replace(exp.Subquery(
+                    this=self._reader(entry, rename),
+                    alias=exp.TableAlias(this=exp.to_identifier(table.alias_or_name)),
+                ))
+            print(f"[SubresultReuseRule] Reading {key} in {node_id} from {entry['path']} "
+                  f"({entry['rows']} rows, cached from {entry['node_id']})")
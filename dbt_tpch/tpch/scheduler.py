@@ -0,0 +1,192 @@
+"""
+Critical-path-aware scheduling for the parallel DAG executor.
+
+Each node gets an expected runtime, taken from a previous benchmark run when
+available and otherwise derived from DuckDB's `EXPLAIN` cardinality estimates.
+Ready nodes are then started by decreasing length of the longest remaining path
+to a sink (the node's "bottom level"), so long chains are not starved by cheap
+siblings when there are fewer workers than ready nodes.
+"""
+
+from __future__ import annotations
+
+import csv
+import heapq
+import os
+import statistics
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import duckdb
+import networkx as nx
+import sqlglot
+
+from selectivity import estimated_plan_rows
+from utils import REWRITER_DIALECT
+
+# fallback conversion when no node has both a measured and an estimated cost
+DEFAULT_ROWS_PER_MS: float = 10_000.0
+
+
+@dataclass
+class Schedule:
+    priority: Dict[str, float]          # lower value starts first
+    costs_ms: Dict[str, float]
+    predicted_order: List[str] = field(default_factory=list)
+    predicted_makespan_ms: float = 0.0
+
+
+def table_name_of(relation: str) -> str:
+    return relation.replace('"', '').split('.')[-1]
+
+
+def load_history(csv_path: str, runs_per_value: int = 1) -> Dict[str, float]:
+    """
+    Per-table runtime (ms) from a previous `*_bench_mark_results.csv`.
+    Both the serial (`TableName,TotalCreationTimeMs...`) and the parallel
+    (`TableName,...,WallTimeMs`) layouts are understood; failed runs (-1) are skipped.
+    """
+    history = {}
+    if not csv_path or not os.path.isfile(csv_path):
+        return history
+    with open(csv_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return history
+        col = header.index("WallTimeMs") if "WallTimeMs" in header else 1
+        for row in reader:
+            if len(row) <= col or row[0] in ("DAG", "PredictedDAG") or not row[col].strip():
+                continue
+            try:
+                val = float(row[col])
+            except ValueError:
+                continue
+            if val >= 0:
+                history[row[0]] = val / runs_per_value
+    return history
+
+
+def _select_sql(sql_file: str) -> Optional[str]:
+    """The SELECT body of an emitted `CREATE ... AS SELECT` file."""
+    with open(sql_file, "r") as f:
+        ast = sqlglot.parse_one(f.read(), read=REWRITER_DIALECT)
+    body = ast.expression if isinstance(ast, sqlglot.exp.Create) else ast
+    return body.sql(dialect=REWRITER_DIALECT) if body is not None else None
+
+
+def estimate_plan_work(db_path: str, graph: nx.DiGraph) -> Dict[str, float]:
+    """
+    Estimated rows processed by each node, from `EXPLAIN` on the current database.
+    Nodes whose inputs do not exist yet (they are produced by the DAG itself)
+    cannot be planned; they fall back to the sum of their parents' estimates,
+    i.e. the rows they have to read.
+    """
+    work = {}
+    con = duckdb.connect(db_path)
+    try:
+        for node_id in nx.topological_sort(graph):
+            est = None
+            try:
+                sql = _select_sql(graph.nodes[node_id]["sql_file"])
+                if sql:
+                    est = estimated_plan_rows(con, sql)
+            except Exception:
+                est = None
+            if not est:
+                est = sum(work[p] for p in graph.predecessors(node_id))
+            work[node_id] = float(max(est, 1))
+    finally:
+        con.close()
+    return work
+
+
+def estimate_costs(
+    graph: nx.DiGraph,
+    db_path: str,
+    history: Optional[Dict[str, float]] = None,
+) -> Dict[str, float]:
+    """
+    Expected runtime (ms) per node: the measured runtime when the node's table
+    appears in `history`, otherwise its EXPLAIN work estimate scaled by the
+    median ms-per-row of the nodes that have both.
+    """
+    history = history or {}
+    costs = {}
+    missing = []
+    for node_id, data in graph.nodes(data=True):
+        name = table_name_of(data["relation"])
+        if name in history:
+            costs[node_id] = history[name]
+        else:
+            missing.append(node_id)
+    if not missing:
+        return costs
+
+    work = estimate_plan_work(db_path, graph)
+    ratios = [costs[n] / work[n] for n in costs if work.get(n)]
+    ms_per_row = statistics.median(ratios) if ratios else 1.0 / DEFAULT_ROWS_PER_MS
+    for node_id in missing:
+        costs[node_id] = work[node_id] * ms_per_row
+    return costs
+
+
+def bottom_levels(graph: nx.DiGraph, costs: Dict[str, float]) -> Dict[str, float]:
+    """Length of the most expensive path from each node (inclusive) to a sink."""
+    level = {}
+    for node_id in reversed(list(nx.topological_sort(graph))):
+        tail = max((level[c] for c in graph.successors(node_id)), default=0.0)
+        level[node_id] = costs[node_id] + tail
+    return level
+
+
+def simulate(
+    graph: nx.DiGraph,
+    costs: Dict[str, float],
+    priority: Dict[str, float],
+    workers: int,
+):
+    """
+    List-schedule the DAG on `workers` identical workers with the given priority.
+    Returns (start order, predicted makespan in ms).
+    """
+    if len(graph) == 0:
+        return [], 0.0
+    remaining = {n: graph.in_degree(n) for n in graph.nodes}
+    ready = [(priority[n], n) for n, deg in remaining.items() if deg == 0]
+    heapq.heapify(ready)
+    running = []    # (finish time, node)
+    order = []
+    now = 0.0
+    while ready or running:
+        while ready and len(running) < workers:
+            _, node_id = heapq.heappop(ready)
+            order.append(node_id)
+            heapq.heappush(running, (now + costs[node_id], node_id))
+        now, node_id = heapq.heappop(running)
+        for child in graph.successors(node_id):
+            remaining[child] -= 1
+            if remaining[child] == 0:
+                heapq.heappush(ready, (priority[child], child))
+    return order, now
+
+
+def topological_schedule(graph: nx.DiGraph, costs: Dict[str, float], workers: int) -> Schedule:
+    """Baseline: ready nodes start in the emitted topological order."""
+    priority = {n: data.get("topo_index", 0) for n, data in graph.nodes(data=True)}
+    order, makespan = simulate(graph, costs, priority, workers)
+    return Schedule(priority, costs, order, makespan)
+
+
+def critical_path_schedule(graph: nx.DiGraph, costs: Dict[str, float], workers: int) -> Schedule:
+    """Ready nodes start by decreasing bottom level (longest remaining path first)."""
+    level = bottom_levels(graph, costs)
+    priority = {n: -level[n] for n in graph.nodes}
+    order, makespan = simulate(graph, costs, priority, workers)
+    return Schedule(priority, costs, order, makespan)
+
+
+SCHEDULERS = {
+    "topo": topological_schedule,
+    "critical-path": critical_path_schedule,
+}
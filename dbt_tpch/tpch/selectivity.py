@@ -11,7 +11,7 @@ from __future__ import annotations
 import copy
 import json
 import re
-from typing import Tuple
+from typing import Optional, Tuple
 
 import duckdb
 from sqlglot import exp
@@ -20,12 +20,46 @@ import sqlglot
 
 DEFAULT_THRESHOLD: float = 0.05
 
+# common subexpression materialization: extract only if recomputing the
+# subexpression k times is at least this many times as costly as computing it
+# once, writing it and scanning it k times
+DEFAULT_CSE_THRESHOLD: float = 1.0
+# cost of writing / scanning one materialized row of REFERENCE_ROW_WIDTH bytes,
+# relative to one row flowing through an operator of the original plan
+MATERIALIZE_WRITE_COST: float = 2.0
+MATERIALIZE_SCAN_COST: float = 0.5
+REFERENCE_ROW_WIDTH: int = 64
+# bytes per value of variable-width columns (VARCHAR, BLOB, ...)
+VARIABLE_WIDTH_BYTES: int = 32
+# shared scans: read a base table once for several consumers only if scanning
+# it once per consumer is at least this many times as costly
+DEFAULT_SHARED_SCAN_THRESHOLD: float = 1.0
+# subresult reuse: read a cached result of a previous run instead of computing
+# (part of) a node only if computing it is at least this many times as costly
+DEFAULT_REUSE_THRESHOLD: float = 1.0
+# cost of reading one cached Parquet row of REFERENCE_ROW_WIDTH bytes
+SUBRESULT_SCAN_COST: float = 1.0
+# (build, probe) cost per input row of a hash join; None counts hash joins by
+# their output rows like every other operator. The constants above and this
+# may be fitted to the machine from execution profiles (see calibration.py).
+HASH_JOIN_WEIGHTS: Optional[Tuple[float, float]] = None
+
 __all__ = [
     "estimate_selectivity",  # table‑based
     "should_pushdown",       # table‑based (bool, sel)
     "estimate_selectivity_ast",  # query‑based
     "should_pushdown_on_ast",    # query‑based (bool, sel)
+    "estimated_plan_rows",       # query‑based work estimate
+    "estimated_row_width",       # query‑based output width
+    "should_materialize_cse",    # query‑based (bool, benefit ratio)
+    "pushdown_decision",         # decision on given estimates
+    "cse_decision",              # decision on given estimates
+    "shared_scan_decision",      # decision on given estimates
+    "reuse_decision",            # decision on given estimates
     "DEFAULT_THRESHOLD",
+    "DEFAULT_CSE_THRESHOLD",
+    "DEFAULT_SHARED_SCAN_THRESHOLD",
+    "DEFAULT_REUSE_THRESHOLD",
 ]
 
 
@@ -61,8 +95,8 @@ def _first_card_node(plan_obj):
     return None
 
 
-def _estimated_rows(conn: duckdb.DuckDBPyConnection, query_sql: str) -> int:
-    """Return the optimizer's estimated rows for *query_sql*.
+def _explain_plan(conn: duckdb.DuckDBPyConnection, query_sql: str):
+    """Return the parsed `EXPLAIN (FORMAT JSON)` plan of *query_sql* (None if empty).
 
     Handles the two-column EXPLAIN output `("physical_plan", json)` as well as
     single-column variants.  When the JSON comes back split across many rows we
@@ -70,7 +104,7 @@ def _estimated_rows(conn: duckdb.DuckDBPyConnection, query_sql: str) -> int:
     """
     rows = conn.execute(f"EXPLAIN (FORMAT JSON) {query_sql}").fetchall()
     if not rows:
-        return 0
+        return None
 
     # flatten all textual cells into one big string
     merged = "".join(
@@ -86,13 +120,54 @@ def _estimated_rows(conn: duckdb.DuckDBPyConnection, query_sql: str) -> int:
         raise ValueError("JSON blob not found in EXPLAIN output")
 
     json_str = merged[start:]
-    plan_obj = json.loads(json_str)
+    return json.loads(json_str)
+
+
+def _estimated_rows(conn: duckdb.DuckDBPyConnection, query_sql: str) -> int:
+    """Return the optimizer's estimated rows for *query_sql*."""
+    plan_obj = _explain_plan(conn, query_sql)
+    if plan_obj is None:
+        return 0
     print("Parsed plan_obj:", plan_obj)
 
     node = _first_card_node(plan_obj)
     print("Found node with EC:", node)
     return int(node["extra_info"]["Estimated Cardinality"]) if node else 0
 
+
+def _sum_card(plan_obj) -> int:
+    """Sum the estimated cardinality of every operator in the plan (hash joins weighted, if calibrated)."""
+    total = 0
+    if isinstance(plan_obj, dict):
+        card = plan_obj.get("extra_info", {}).get("Estimated Cardinality")
+        children = plan_obj.get("children", [])
+        if HASH_JOIN_WEIGHTS is not None and plan_obj.get("name", "").strip() == "HASH_JOIN" \
+                and len(children) == 2:
+            build_weight, probe_weight = HASH_JOIN_WEIGHTS
+            probe, build = (_first_card_node(ch) for ch in children)
+            total += round(
+                probe_weight * (int(probe["extra_info"]["Estimated Cardinality"]) if probe else 0)
+                + build_weight * (int(build["extra_info"]["Estimated Cardinality"]) if build else 0)
+            )
+        elif card is not None:
+            total += int(card)
+        for ch in children:
+            total += _sum_card(ch)
+    elif isinstance(plan_obj, list):
+        for item in plan_obj:
+            total += _sum_card(item)
+    return total
+
+
+def estimated_plan_rows(conn: duckdb.DuckDBPyConnection, query_sql: str) -> int:
+    """Rows flowing through all operators of *query_sql* (optimizer estimate).
+
+    Unlike `_estimated_rows`, which only looks at the output, this is a proxy
+    for the work a query does, e.g. a large aggregation with a tiny result.
+    """
+    plan_obj = _explain_plan(conn, query_sql)
+    return _sum_card(plan_obj) if plan_obj is not None else 0
+
 # ────────────────────────────────────────────────────────────────────────────────
 # Table‑based: DO NOT USE, JUST FOR DEMO PURPOSES
 # ────────────────────────────────────────────────────────────────────────────────
@@ -172,8 +247,149 @@ def should_pushdown_on_ast(
     predicate_sql: str,
     num_children: int,
     threshold: float = DEFAULT_THRESHOLD,
+    column_stats=None,
 ) -> Tuple[bool, float]:
-    sel = estimate_selectivity_ast(conn, base_ast, predicate_sql)
+    """
+    If `column_stats` (a `column_stats.ColumnStatistics`) is given and can
+    estimate the predicate, no EXPLAIN is run.
+    """
+    sel = column_stats.selectivity_sql(base_ast, predicate_sql) if column_stats is not None else None
+    if sel is None:
+        sel = estimate_selectivity_ast(conn, base_ast, predicate_sql)
+    return pushdown_decision(sel, num_children, threshold)
+
+
+def pushdown_decision(sel: float, num_children: int, threshold: float = DEFAULT_THRESHOLD) -> Tuple[bool, float]:
+    """Push down if the selectivity, amortized over the children sharing the predicate, is low enough."""
     print(f"Selectivity: {sel:.2%} (threshold: {threshold:.2%})")
     sel = sel / num_children
     return sel <= threshold, sel
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Common subexpressions: recompute k times vs. materialize once and scan k times
+# ────────────────────────────────────────────────────────────────────────────────
+
+_FIXED_WIDTH_BYTES = {
+    "BOOLEAN": 1, "TINYINT": 1, "UTINYINT": 1, "SMALLINT": 2, "USMALLINT": 2,
+    "INTEGER": 4, "UINTEGER": 4, "DATE": 4, "FLOAT": 4, "REAL": 4,
+    "BIGINT": 8, "UBIGINT": 8, "DOUBLE": 8, "TIMESTAMP": 8, "TIME": 8,
+    "HUGEINT": 16, "UHUGEINT": 16, "INTERVAL": 16, "UUID": 16,
+}
+
+
+def _type_width(type_name: str) -> int:
+    base = type_name.upper().split("(")[0].strip()
+    if base == "DECIMAL":
+        # DECIMAL(p, s) is stored in 2/4/8/16 bytes depending on the precision
+        try:
+            precision = int(type_name.split("(")[1].split(",")[0])
+        except (IndexError, ValueError):
+            precision = 18
+        return 2 if precision <= 4 else 4 if precision <= 9 else 8 if precision <= 18 else 16
+    if base.startswith("TIMESTAMP"):
+        return 8
+    return _FIXED_WIDTH_BYTES.get(base, VARIABLE_WIDTH_BYTES)
+
+
+def estimated_row_width(conn: duckdb.DuckDBPyConnection, query_sql: str) -> int:
+    """Approximate bytes per output row of *query_sql*, from its column types."""
+    columns = conn.execute(f"DESCRIBE {query_sql}").fetchall()
+    return max(sum(_type_width(col[1]) for col in columns), 1)
+
+
+def should_materialize_cse(
+    conn: duckdb.DuckDBPyConnection,
+    body_ast: exp.Expression,
+    num_consumers: int,
+    threshold: float = DEFAULT_CSE_THRESHOLD,
+) -> Tuple[bool, float]:
+    """Decide whether a subexpression used by *num_consumers* queries should be materialized.
+
+    recompute   = k * work
+    materialize = work + rows * width_factor * (write + k * scan)
+    where work is the estimated rows through all operators, rows the estimated
+    output rows and width_factor the row width relative to REFERENCE_ROW_WIDTH.
+    Returns (recompute / materialize >= threshold, recompute / materialize).
+    """
+    body_sql = body_ast.sql(dialect="duckdb")
+    work = estimated_plan_rows(conn, body_sql)
+    rows = _estimated_rows(conn, body_sql)
+    width = estimated_row_width(conn, body_sql)
+    return cse_decision(work, rows, width, num_consumers, threshold)
+
+
+def cse_decision(
+    work: int,
+    rows: int,
+    width: int,
+    num_consumers: int,
+    threshold: float = DEFAULT_CSE_THRESHOLD,
+) -> Tuple[bool, float]:
+    """The cost comparison of `should_materialize_cse`, on given estimates."""
+    work = max(work, 1)
+    width_factor = width / REFERENCE_ROW_WIDTH
+    recompute = num_consumers * work
+    materialize = work + rows * width_factor * (
+        MATERIALIZE_WRITE_COST + num_consumers * MATERIALIZE_SCAN_COST
+    )
+    ratio = recompute / max(materialize, 1e-9)
+    print(f"CSE cost: work={work} rows={rows} width_factor={width_factor:.2f} "
+          f"consumers={num_consumers} recompute={recompute:.0f} materialize={materialize:.0f}")
+    return ratio >= threshold, ratio
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Shared scans: k scans of a base table vs. one scan materialized for all of them
+# ────────────────────────────────────────────────────────────────────────────────
+
+def shared_scan_decision(
+    table_rows: int,
+    consumer_widths: list,
+    shared_width: int,
+    sel: float,
+    threshold: float = DEFAULT_SHARED_SCAN_THRESHOLD,
+) -> Tuple[bool, float]:
+    """Decide whether the consumers of a base table should share one scan of it.
+
+    separate = sum_i rows * width_i
+    shared   = rows * width + sel * rows * width * (write + k * scan)
+    with widths relative to REFERENCE_ROW_WIDTH, width_i the bytes of the columns
+    consumer i reads, width those of their union and sel the selectivity of the
+    OR of their filters. Returns (separate / shared >= threshold, separate / shared).
+    """
+    rows = max(table_rows, 1)
+    num_consumers = len(consumer_widths)
+    separate = sum(rows * width / REFERENCE_ROW_WIDTH for width in consumer_widths)
+    shared_scan = rows * shared_width / REFERENCE_ROW_WIDTH
+    shared = shared_scan + sel * shared_scan * (
+        MATERIALIZE_WRITE_COST + num_consumers * MATERIALIZE_SCAN_COST
+    )
+    ratio = separate / max(shared, 1e-9)
+    print(f"Shared scan cost: rows={rows} sel={sel:.2%} consumers={num_consumers} "
+          f"separate={separate:.0f} shared={shared:.0f}")
+    return ratio >= threshold, ratio
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# Subresult reuse: compute (part of) a node vs. read a cached result
+# ────────────────────────────────────────────────────────────────────────────────
+
+def reuse_decision(
+    work: int,
+    rows: int,
+    width: int,
+    threshold: float = DEFAULT_REUSE_THRESHOLD,
+) -> Tuple[bool, float]:
+    """Decide whether a cached result of *rows* rows should replace a computation.
+
+    compute = work
+    reuse   = rows * width_factor * scan
+    with work the estimated rows through all operators of the computation.
+    Returns (compute / reuse >= threshold, compute / reuse).
+    """
+    work = max(work, 1)
+    reuse = rows * width / REFERENCE_ROW_WIDTH * SUBRESULT_SCAN_COST
+    ratio = work / max(reuse, 1e-9)
+    print(f"Reuse cost: work={work} rows={rows} width={width} reuse={reuse:.0f}")
+    return ratio >= threshold, ratio
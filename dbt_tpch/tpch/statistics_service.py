@@ -0,0 +1,233 @@
+"""
+Statistics service shared by the rewrite rules of one optimizer run.
+
+The cost-based rules need DuckDB's estimates (EXPLAIN cardinalities, output row
+widths) for many queries, often the same ones: every pushdown candidate of a
+parent explains the parent's query, and a node revisited by the fixpoint engine
+asks again. Opening a connection and running `EXPLAIN` per request makes
+optimizer time scale with the number of requests, so the service
+  * keeps one read-only connection for the whole run
+  * memoizes the plan and row width per canonical SQL (the query regenerated
+    from its AST), so each distinct query is explained at most once
+  * lets rules `warm` the memo with the queries of all their candidates
+    before deciding on any of them (each query is still explained on its own;
+    this deduplicates requests, it does not batch them)
+The decisions themselves are the ones of `selectivity.py`.
+
+With `estimator="histogram"`, predicate selectivities come from the sampled
+column statistics of `column_stats.py` instead, falling back to EXPLAIN for
+predicates they cannot estimate (e.g. on derived columns).
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import duckdb
+import sqlglot
+from sqlglot import exp
+
+from selectivity import (
+    DEFAULT_CSE_THRESHOLD,
+    DEFAULT_REUSE_THRESHOLD,
+    DEFAULT_SHARED_SCAN_THRESHOLD,
+    DEFAULT_THRESHOLD,
+    _clone_with_extra_pred,
+    _explain_plan,
+    _first_card_node,
+    _sum_card,
+    _type_width,
+    cse_decision,
+    pushdown_decision,
+    reuse_decision,
+    shared_scan_decision,
+)
+from column_stats import DDL_FILE, STATS_FILE, ColumnStatistics, base_tables_from_ddl, load_stats, refresh_stats
+from utils import REWRITER_DIALECT
+
+STATS_DB_PATH = "dev.duckdb"
+ESTIMATORS = ("explain", "histogram")
+
+
+def canonical_sql(query) -> str:
+    """Memo key of a query given as AST or SQL text."""
+    if isinstance(query, str):
+        query = sqlglot.parse_one(query, read=REWRITER_DIALECT)
+    return query.sql(dialect=REWRITER_DIALECT)
+
+
+class StatisticsService:
+    def __init__(self, db_path: str = STATS_DB_PATH, estimator: str = "explain",
+                 stats_file: str = STATS_FILE, ddl_file: str = DDL_FILE):
+        assert estimator in ESTIMATORS, f"Unknown estimator: {estimator}"
+        self.db_path = db_path
+        self.estimator = estimator
+        self.stats_file = stats_file
+        self.ddl_file = ddl_file
+        self._column_stats: Optional[ColumnStatistics] = None
+        self._conn: Optional[duckdb.DuckDBPyConnection] = None
+        # canonical SQL -> (estimated output rows, estimated rows through all operators)
+        self._cardinality: Dict[str, Tuple[int, int]] = {}
+        # canonical SQL -> [(column name, DuckDB type)] of its output
+        self._output_types: Dict[str, List[Tuple[str, str]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def conn(self) -> duckdb.DuckDBPyConnection:
+        if self._conn is None:
+            self._conn = duckdb.connect(self.db_path, read_only=True)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _cardinalities(self, sql: str) -> Tuple[int, int]:
+        if sql in self._cardinality:
+            self.hits += 1
+            return self._cardinality[sql]
+        self.misses += 1
+        plan_obj = _explain_plan(self.conn, sql)
+        if plan_obj is None:
+            result = (0, 0)
+        else:
+            node = _first_card_node(plan_obj)
+            rows = int(node["extra_info"]["Estimated Cardinality"]) if node else 0
+            result = (rows, _sum_card(plan_obj))
+        self._cardinality[sql] = result
+        return result
+
+    def estimated_rows(self, query) -> int:
+        """Estimated output rows (first cardinality in the plan, as `selectivity._estimated_rows`)."""
+        return self._cardinalities(canonical_sql(query))[0]
+
+    def estimated_plan_rows(self, query) -> int:
+        """Estimated rows through all operators (as `selectivity.estimated_plan_rows`)."""
+        return self._cardinalities(canonical_sql(query))[1]
+
+    def output_types(self, query) -> List[Tuple[str, str]]:
+        """(name, DuckDB type) of each output column of the query."""
+        sql = canonical_sql(query)
+        if sql not in self._output_types:
+            self._output_types[sql] = [(col[0], col[1]) for col in self.conn.execute(f"DESCRIBE {sql}").fetchall()]
+        return self._output_types[sql]
+
+    def estimated_row_width(self, query) -> int:
+        return max(sum(_type_width(dtype) for _, dtype in self.output_types(query)), 1)
+
+    def warm(self, queries: Iterable) -> None:
+        """
+        Explain every distinct query not memoized yet, one EXPLAIN each, so the
+        decisions that follow are served from the memo. Queries that cannot be
+        planned are skipped; the error surfaces when they are requested.
+        """
+        pending = []
+        seen = set()
+        for query in queries:
+            sql = canonical_sql(query)
+            if sql not in self._cardinality and sql not in seen:
+                seen.add(sql)
+                pending.append(sql)
+        for sql in pending:
+            try:
+                self._cardinalities(sql)
+            except Exception:
+                pass
+        if pending:
+            print(f"[INFO] Statistics: warmed the memo with {len(pending)} queries")
+
+    @property
+    def column_stats(self) -> ColumnStatistics:
+        """Sampled column statistics, refreshed for the tables of the DDL file on first use."""
+        if self._column_stats is None:
+            if os.path.isfile(self.ddl_file):
+                stats = refresh_stats(self.conn, base_tables_from_ddl(self.ddl_file), self.stats_file)
+            else:
+                stats = load_stats(self.stats_file)
+            self._column_stats = ColumnStatistics(stats)
+        return self._column_stats
+
+    def _histogram_selectivity(self, base_ast: exp.Expression, predicate_sql: str) -> Optional[float]:
+        if self.estimator != "histogram":
+            return None
+        return self.column_stats.selectivity_sql(base_ast, predicate_sql)
+
+    def pushdown_queries(self, base_ast: exp.Expression, predicate_sql: str):
+        """The queries `estimate_selectivity_ast` has to explain (none if the histograms answer it)."""
+        if self._histogram_selectivity(base_ast, predicate_sql) is not None:
+            return []
+        return [base_ast, _clone_with_extra_pred(base_ast, predicate_sql)]
+
+    def estimate_selectivity_ast(self, base_ast: exp.Expression, predicate_sql: str) -> float:
+        sel = self._histogram_selectivity(base_ast, predicate_sql)
+        if sel is not None:
+            return sel
+        if self.estimator == "histogram":
+            print(f"[INFO] No column statistics for '{predicate_sql}', using EXPLAIN estimates")
+        base, filtered = base_ast, _clone_with_extra_pred(base_ast, predicate_sql)
+        rows_before = max(self.estimated_rows(base), 1)  # avoid /0
+        rows_after = self.estimated_rows(filtered)
+        return rows_after / rows_before
+
+    def should_pushdown_on_ast(
+        self,
+        base_ast: exp.Expression,
+        predicate_sql: str,
+        num_children: int,
+        threshold: float = DEFAULT_THRESHOLD,
+    ) -> Tuple[bool, float]:
+        sel = self.estimate_selectivity_ast(base_ast, predicate_sql)
+        return pushdown_decision(sel, num_children, threshold)
+
+    def should_materialize_cse(
+        self,
+        body_ast: exp.Expression,
+        num_consumers: int,
+        threshold: float = DEFAULT_CSE_THRESHOLD,
+    ) -> Tuple[bool, float]:
+        work = self.estimated_plan_rows(body_ast)
+        rows = self.estimated_rows(body_ast)
+        width = self.estimated_row_width(body_ast)
+        return cse_decision(work, rows, width, num_consumers, threshold)
+
+    def should_share_scan(
+        self,
+        table: exp.Table,
+        consumer_columns: list,
+        predicate_sql: Optional[str],
+        threshold: float = DEFAULT_SHARED_SCAN_THRESHOLD,
+    ) -> Tuple[bool, float]:
+        """
+        Whether the consumers of base table `table`, reading the given column
+        lists, should share one scan projecting the union of the columns and
+        filtering the OR of their filters (`predicate_sql`, None for all rows).
+        """
+        shared_columns = sorted(set().union(*consumer_columns))
+
+        def scan(columns):
+            return exp.select(*[exp.column(c) for c in columns]).from_(table.copy())
+
+        rows = self.estimated_rows(exp.select("*").from_(table.copy()))
+        widths = [self.estimated_row_width(scan(sorted(columns))) for columns in consumer_columns]
+        sel = self.estimate_selectivity_ast(scan(shared_columns), predicate_sql) if predicate_sql else 1.0
+        return shared_scan_decision(rows, widths, self.estimated_row_width(scan(shared_columns)), sel, threshold)
+
+    def should_reuse_subresult(
+        self,
+        query,
+        rows: int,
+        column_types: list,
+        threshold: float = DEFAULT_REUSE_THRESHOLD,
+    ) -> Tuple[bool, float]:
+        """
+        Whether reading a cached result of `rows` rows with the given column
+        types is cheaper than running `query`.
+        """
+        width = max(sum(_type_width(dtype) for dtype in column_types), 1)
+        return reuse_decision(self.estimated_plan_rows(query), rows, width, threshold)
+
+    def stats(self) -> dict:
+        return {"explains": len(self._cardinality), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,242 @@
+"""
+Catalog of materialized subresults from previous runs.
+
+When the result cache (`result_cache.py`) stores the output of a node, the
+catalog records what that output logically is, so that later DAGs can be
+answered from it (`rules/subresult_reuse.py`):
+  * the node's query with all upstream DAG nodes expanded, i.e. over base
+    tables only, and its fingerprint (`fingerprint.py`),
+  * the versions of those base tables (`result_cache.table_version`),
+  * if the expanded query flattens to a select-project over a single base
+    table: the table, the source column of each output column and the WHERE
+    conjuncts.
+Entries point to the result cache's Parquet file and are dropped once it is
+evicted. The catalog is stored as `subresults.json` in the cache directory.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional
+
+import networkx as nx
+import sqlglot
+import sqlglot.optimizer.simplify
+from sqlglot import exp
+from sqlglot.optimizer.merge_subqueries import merge_subqueries
+from sqlglot.optimizer.qualify import qualify
+
+from fingerprint import DEFAULT_CATALOG, DEFAULT_SCHEMA, fingerprint
+from materialization import expanded_query
+from result_cache import _select_of, is_volatile, table_key
+from transitive_pushdown import conjuncts_of
+from utils import REWRITER_DIALECT
+
+CATALOG_FILE = "subresults.json"
+
+_BOUNDS = {exp.LT: "<", exp.LTE: "<=", exp.GT: ">", exp.GTE: ">=", exp.EQ: "="}
+_FLIPPED = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "=": "="}
+
+
+def live_schema(con) -> dict:
+    """`{catalog: {schema: {table: {column: type}}}}` of an open DuckDB connection."""
+    schema: dict = {}
+    for catalog, db, table, column, dtype in con.execute(
+        "SELECT database_name, schema_name, table_name, column_name, data_type "
+        "FROM duckdb_columns() WHERE NOT internal ORDER BY column_index"
+    ).fetchall():
+        schema.setdefault(catalog, {}).setdefault(db, {}).setdefault(table, {})[column] = dtype
+    return schema
+
+
+def base_tables(query: exp.Expression) -> List[exp.Table]:
+    """Base table references of a query (not CTEs or table functions)."""
+    ctes = {cte.alias.lower() for cte in query.find_all(exp.CTE)}
+    return [
+        t for t in query.find_all(exp.Table)
+        if t.db and not isinstance(t.this, exp.Func) and t.name.lower() not in ctes
+    ]
+
+
+def select_project(query: exp.Expression, schema: Optional[dict] = None) -> Optional[dict]:
+    """
+    {"table", "columns": {output: source column}, "predicates": [SQL]} if `query`
+    flattens to a select-project over one base table, else None.
+    """
+    try:
+        flat = qualify(
+            query.copy(),
+            dialect=REWRITER_DIALECT,
+            schema=schema,
+            catalog=DEFAULT_CATALOG,
+            db=DEFAULT_SCHEMA,
+            validate_qualify_columns=False,
+            quote_identifiers=False,
+            identify=False,
+        )
+        flat = sqlglot.optimizer.simplify.simplify(merge_subqueries(flat))
+    except Exception:
+        return None
+    if not isinstance(flat, exp.Select):
+        return None
+    if any(flat.args.get(arg) for arg in ("with_", "joins", "group", "having", "distinct",
+                                          "limit", "offset", "qualify", "laterals")):
+        return None
+    from_ = next((v for v in flat.args.values() if isinstance(v, exp.From)), None)
+    if from_ is None or not isinstance(from_.this, exp.Table) or not from_.this.db:
+        return None
+    if flat.find(exp.AggFunc, exp.Window, exp.Subquery) or is_volatile(flat):
+        return None
+    columns = {}
+    for projection in flat.expressions:
+        source = projection.this if isinstance(projection, exp.Alias) else projection
+        if not isinstance(source, exp.Column) or isinstance(source.this, exp.Star):
+            return None
+        columns[projection.alias_or_name] = source.name
+    predicates = []
+    where = flat.args.get("where")
+    if where is not None:
+        for conjunct in conjuncts_of(where.this):
+            conjunct = conjunct.copy()
+            for column in conjunct.find_all(exp.Column):
+                column.set("table", None)
+            predicates.append(conjunct.sql(dialect=REWRITER_DIALECT))
+    return {"table": table_key(from_.this), "columns": columns, "predicates": predicates}
+
+
+def _literal_value(value: exp.Expression):
+    """(type, comparable value) of a literal bound, None if it is not one."""
+    if isinstance(value, exp.Literal):
+        if value.is_string:
+            return ("TEXT", value.name)
+        try:
+            return ("NUMBER", Decimal(value.name))
+        except InvalidOperation:
+            return None
+    if isinstance(value, exp.Cast) and isinstance(value.this, exp.Literal) and value.this.is_string:
+        # ISO dates and timestamps compare like their text
+        return (value.to.sql(dialect=REWRITER_DIALECT).upper(), value.this.name)
+    return None
+
+
+def _bound(predicate: exp.Expression):
+    """(column, operator, (type, value)) of `column <op> literal` (either side), else None."""
+    op = _BOUNDS.get(type(predicate))
+    if op is None:
+        return None
+    left, right = predicate.this, predicate.expression
+    if isinstance(right, exp.Column) and not isinstance(left, exp.Column):
+        left, right, op = right, left, _FLIPPED[op]
+    value = _literal_value(right)
+    if not isinstance(left, exp.Column) or value is None:
+        return None
+    return left.name.lower(), op, value
+
+
+def _bound_implies(have, need) -> bool:
+    """Whether `column have_op a` implies `column need_op b`."""
+    (column, have_op, (have_type, a)), (need_column, need_op, (need_type, b)) = have, need
+    if column != need_column or have_type != need_type:
+        return False
+    if need_op == "=":
+        return have_op == "=" and a == b
+    if need_op in ("<", "<="):
+        if have_op == "=" or have_op == "<=":
+            return a < b or (a == b and need_op == "<=")
+        if have_op == "<":
+            return a <= b
+        return False
+    if have_op == "=" or have_op == ">=":
+        return a > b or (a == b and need_op == ">=")
+    if have_op == ">":
+        return a >= b
+    return False
+
+
+def implies(conjuncts: List[exp.Expression], predicate: exp.Expression) -> bool:
+    """
+    Whether the AND of `conjuncts` implies `predicate` (over unqualified
+    columns): it is one of them, one of its disjuncts is implied, or it is a
+    bound on a column that one of them tightens (e.g. `x < 10` implies `x < 20`).
+    """
+    sql = predicate.sql(dialect=REWRITER_DIALECT)
+    if any(c.sql(dialect=REWRITER_DIALECT) == sql for c in conjuncts):
+        return True
+    if isinstance(predicate, exp.Or):
+        return any(implies(conjuncts, d) for d in predicate.flatten())
+    if isinstance(predicate, exp.Paren):
+        return implies(conjuncts, predicate.this)
+    need = _bound(predicate)
+    if need is None:
+        return False
+    return any(have is not None and _bound_implies(have, need) for have in map(_bound, conjuncts))
+
+
+class SubresultCatalog:
+    def __init__(self, cache_dir: str):
+        self.path = os.path.join(cache_dir, CATALOG_FILE)
+        # Parquet path -> entry
+        self.entries: Dict[str, dict] = {}
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        self.entries = {p: e for p, e in self.entries.items() if os.path.isfile(p)}
+        # node id -> definition of its output, for the current run
+        self.definitions: Dict[str, dict] = {}
+
+    def define(self, graph: nx.DiGraph, schema: dict, versions: Dict[str, str]) -> None:
+        """
+        Logical definitions of the nodes of an executable DAG (see
+        `dag_executor.load_dag`), before running it; `versions` are the base
+        table versions of the run (`ResultCache.versions`).
+        """
+        asts = {}
+        for node_id, data in graph.nodes(data=True):
+            try:
+                with open(data["sql_file"], "r") as f:
+                    asts[node_id] = _select_of(f.read())
+            except Exception as e:
+                print(f"[WARN] No subresult definition for {node_id}: {e}")
+        memo = {}
+        for node_id in asts:
+            try:
+                query = expanded_query(graph, asts, node_id, memo)
+                tables = {table_key(t) for t in base_tables(query)}
+                if is_volatile(query) or not tables <= set(versions):
+                    continue
+                self.definitions[node_id] = {
+                    "node_id": node_id,
+                    # of the query before rewriting, if the optimizer recorded it
+                    "fingerprint": graph.nodes[node_id].get("fingerprint") or fingerprint(query, schema),
+                    "inputs": {t: versions[t] for t in sorted(tables)},
+                    "select_project": select_project(query, schema),
+                }
+            except Exception as e:
+                print(f"[WARN] No subresult definition for {node_id}: {e}")
+
+    def record(self, node_id: str, path: str, columns: list, rows: int) -> None:
+        """Record the cached result of a node (called by `ResultCache.store`)."""
+        definition = self.definitions.get(node_id)
+        if definition is None:
+            return
+        self.entries[path] = dict(definition, columns=columns, rows=rows)
+
+    def entries_for(self, table: str) -> List[dict]:
+        """Select-project entries over base table `table` (see `table_key`)."""
+        return [
+            dict(e, path=p) for p, e in self.entries.items()
+            if e["select_project"] is not None and e["select_project"]["table"] == table
+            and os.path.isfile(p)
+        ]
+
+    def matching(self, key: str) -> List[dict]:
+        """Entries with the given fingerprint."""
+        return [dict(e, path=p) for p, e in self.entries.items() if e["fingerprint"] == key and os.path.isfile(p)]
+
+    def save(self) -> None:
+        self.entries = {p: e for p, e in self.entries.items() if os.path.isfile(p)}
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        print(f"[INFO] Subresult catalog: {len(self.entries)} entries")
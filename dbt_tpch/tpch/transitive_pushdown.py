@@ -0,0 +1,219 @@
+"""
+Transitive predicate pushdown along chains of models.
+
+`PredicatePushdownRule` filters a parent's output once for all children sharing
+a predicate. When the parent is itself only a projection/filter of its inputs,
+the filter can go further: the parent's query is inlined into the new node with
+the predicate rewritten to the parent's input columns, and so on up the chain
+until the predicate reaches the scan of a base table. Each hop
+  * maps output column names back through the projection (`x AS y`, `t.*`)
+  * only passes through SELECT-PROJECT-(inner) JOIN queries: it stops at
+    aggregates, window functions, DISTINCT, LIMIT, CTEs and outer joins
+  * only inlines views (recomputed on every read anyway) and tables reading a
+    single input without joins (as cheap to recompute filtered as to scan);
+    joins materialized as tables and optimizer-created nodes are read as-is
+Conjuncts over columns of several inputs stay at the level where they meet.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import networkx as nx
+from sqlglot import exp
+
+from utils import REWRITER_DIALECT, get_new_node, materialization, relation_name
+
+# Select args that make a query unsafe to filter before it is computed
+_BLOCKING_ARGS = ("with_", "group", "having", "qualify", "distinct", "limit", "offset")
+
+
+def _from(select: exp.Select) -> Optional[exp.From]:
+    # the FROM arg is keyed "from" or "from_" depending on the sqlglot version
+    return next((v for v in select.args.values() if isinstance(v, exp.From)), None)
+
+
+def conjuncts_of(predicate: exp.Expression) -> List[exp.Expression]:
+    return list(predicate.flatten()) if isinstance(predicate, exp.And) else [predicate]
+
+
+def sources_of(query: exp.Select) -> Dict[str, exp.Table]:
+    """alias -> table reference, for the tables read in the FROM/JOIN clauses."""
+    sources = {}
+    for expr in [_from(query).this] + [join.this for join in query.args.get("joins") or []]:
+        if isinstance(expr, exp.Table):
+            sources[expr.alias_or_name] = expr
+    return sources
+
+
+def single_source(conjunct: exp.Expression, query: exp.Select, sources: Dict[str, exp.Table]) -> Optional[str]:
+    """Alias of the only table `conjunct` reads, None if it reads several or none."""
+    if conjunct.find(exp.Subquery, exp.Select):
+        return None
+    tables = {column.table for column in conjunct.find_all(exp.Column)}
+    if not tables:
+        return None
+    num_inputs = 1 + len(query.args.get("joins") or [])
+    if tables == {""} and len(sources) == 1 and num_inputs == 1:
+        return next(iter(sources))
+    if len(tables) == 1 and next(iter(tables)) in sources:
+        return next(iter(tables))
+    return None
+
+
+def pushable(query: exp.Expression) -> bool:
+    """True if filtering the inputs of `query` is equivalent to filtering its output."""
+    if not isinstance(query, exp.Select) or _from(query) is None:
+        return False
+    if any(query.args.get(arg) for arg in _BLOCKING_ARGS):
+        return False
+    for projection in query.expressions:
+        if projection.find(exp.AggFunc, exp.Window, exp.Subquery):
+            return False
+    for join in query.args.get("joins") or []:
+        if join.side or (join.kind or "").upper() not in ("", "INNER", "CROSS"):
+            return False
+    return True
+
+
+def translate(predicate: exp.Expression, query: exp.Select) -> Optional[exp.Expression]:
+    """
+    Rewrite `predicate` over the output columns of `query` into a predicate over
+    its inputs, None if a column cannot be traced back unambiguously.
+    """
+    outputs = {}
+    stars = []
+    for projection in query.expressions:
+        if isinstance(projection, exp.Star):
+            stars.append(None)
+        elif isinstance(projection, exp.Column) and isinstance(projection.this, exp.Star):
+            stars.append(projection.table)
+        elif projection.alias_or_name:
+            outputs[projection.alias_or_name.lower()] = projection.unalias()
+    num_inputs = 1 + len(query.args.get("joins") or [])
+
+    def resolve(name: str) -> Optional[exp.Expression]:
+        if name.lower() in outputs:
+            return outputs[name.lower()].copy()
+        if len(stars) != 1:
+            return None
+        if stars[0] is None:
+            # a bare * only tells where a column comes from for a single input
+            return exp.column(name) if num_inputs == 1 else None
+        return exp.column(name, table=stars[0])
+
+    translated = predicate.copy()
+    for column in list(translated.find_all(exp.Column)):
+        source = resolve(column.name)
+        if source is None:
+            return None
+        if column is translated:
+            translated = source
+        else:
+            column.replace(source)
+    return translated
+
+
+def _cte_names(query: exp.Expression) -> set:
+    """Names of the CTEs visible in `query`: its own and those of the queries around it."""
+    names = set()
+    node = query
+    while node is not None:
+        with_ = node.args.get("with_")
+        if isinstance(with_, exp.With):
+            names |= {cte.alias_or_name.lower() for cte in with_.expressions}
+        node = node.parent
+    return names
+
+
+def _same_relation(table: exp.Table, relation: str) -> bool:
+    """Whether `table` names `relation`, comparing schema and catalog where `table` spells them."""
+    target = exp.to_table(relation, dialect=REWRITER_DIALECT)
+    return all(
+        not getattr(table, part) or getattr(table, part).lower() == getattr(target, part).lower()
+        for part in ("name", "db", "catalog")
+    )
+
+
+def model_of(graph: nx.DiGraph, node_id: str, table: exp.Table, query: exp.Select) -> Optional[str]:
+    """The parent of `node_id` that `table` in `query` reads, None for a CTE or another relation."""
+    if not table.db and table.name.lower() in _cte_names(query):
+        return None
+    for parent in graph.predecessors(node_id):
+        if parent.split(".")[-1].lower() != table.name.lower():
+            continue
+        relation = relation_name(parent)
+        # nodes created by the rewriter have no manifest entry; their names are unique
+        if relation is None or _same_relation(table, relation):
+            return parent
+    return None
+
+
+def _can_inline(node_id: str, asts: Dict[str, exp.Expression]) -> bool:
+    query = asts.get(node_id)
+    if query is None or get_new_node(node_id) is not None or not pushable(query):
+        return False
+    return materialization(node_id) == "view" or not query.args.get("joins")
+
+
+def push_upstream(
+    graph: nx.DiGraph,
+    node_id: str,
+    query: exp.Select,
+    conjuncts: List[exp.Expression],
+    asts: Dict[str, exp.Expression],
+) -> int:
+    """
+    Add `conjuncts` (predicates over the inputs of `query`, a SELECT of node
+    `node_id`) as far upstream as is safe, inlining the definitions of the
+    parents they pass through into `query`. Returns the number of hops of the
+    longest move (0: all conjuncts stayed in the WHERE clause of `query`).
+    """
+    sources = sources_of(query) if pushable(query) else {}
+    groups = defaultdict(list)
+    stay = []
+    for conjunct in conjuncts:
+        alias = single_source(conjunct, query, sources)
+        if alias is None:
+            stay.append(conjunct)
+        else:
+            groups[alias].append(conjunct)
+
+    hops = 0
+    for alias, group in groups.items():
+        table = sources[alias]
+        parent = model_of(graph, node_id, table, query)
+        inlined = _inline(graph, parent, group, asts) if parent else None
+        if inlined is None:
+            stay.extend(group)
+            continue
+        parent_query, depth = inlined
+        table.replace(exp.Subquery(this=parent_query, alias=exp.TableAlias(this=exp.to_identifier(alias))))
+        hops = max(hops, depth)
+
+    for conjunct in stay:
+        query.where(conjunct, copy=False)
+    return hops
+
+
+def _inline(
+    graph: nx.DiGraph,
+    node_id: str,
+    conjuncts: List[exp.Expression],
+    asts: Dict[str, exp.Expression],
+) -> Optional[Tuple[exp.Select, int]]:
+    """The query of `node_id` with `conjuncts` (over its output) pushed in, and the hops taken."""
+    if not _can_inline(node_id, asts):
+        return None
+    query = asts[node_id].copy()
+    translated = [translate(conjunct, query) for conjunct in conjuncts]
+    if any(conjunct is None for conjunct in translated):
+        return None
+    return query, 1 + push_upstream(graph, node_id, query, translated, asts)
+
+
+def referenced_models(graph: nx.DiGraph, node_id: str, query: exp.Expression) -> List[str]:
+    """Upstream models of `node_id` that `query` reads directly."""
+    tables = {table.name.lower() for table in query.find_all(exp.Table)}
+    return [n for n in nx.ancestors(graph, node_id) if n.split(".")[-1].lower() in tables]
@@ -8,6 +8,8 @@ from sqlglot import exp
 # Assume duckdb dialect for now, used both for input & output sql
 REWRITER_DIALECT = "duckdb"
 ENABLE_PARTIAL_MATCH = True
+# upper bound on the rewriter's fixpoint rounds
+MAX_REWRITE_ITERATIONS = 10
 
 #### Utils ####
 def get_compiled_path(manifest, node_id):
@@ -58,6 +60,12 @@ def relation_name(node_id: str) -> str | None:
         return _MANIFEST["nodes"][node_id]["relation_name"]
     return None
 
+def materialization(node_id: str) -> str | None:
+    """dbt materialization ("table", "view", ...) of a model, None for unknown nodes."""
+    if _MANIFEST and node_id in _MANIFEST["nodes"]:
+        return _MANIFEST["nodes"][node_id].get("config", {}).get("materialized")
+    return None
+
 def forge_relation_name(node_id: str) -> str:
     """
     Forge a relation name from a node id using the typical dbt format.
@@ -68,6 +76,13 @@ def forge_relation_name(node_id: str) -> str:
     # add double quotes around each token then join with "."
     return ".".join([f'"{token}"' for token in tokens])
 
+def new_node_name(graph: nx.DiGraph, prefix: str) -> str:
+    """First `<prefix>_<k>` (k = 0, 1, ...) that is not a node of `graph` yet."""
+    node_idx = 0
+    while f"{prefix}_{node_idx}" in graph:
+        node_idx += 1
+    return f"{prefix}_{node_idx}"
+
 from dataclasses import dataclass, asdict
 from typing import List, Dict, Any
 
@@ -86,5 +101,22 @@ def new_nodes() -> List[NewNodeRecord]:
 def get_new_node(node_id: str) -> NewNodeRecord | None:
     return _NEW_NODE_REGISTRY.get(node_id)
 
+def remove_new_node(node_id: str) -> None:
+    _NEW_NODE_REGISTRY.pop(node_id, None)
+
 def clear_new_node_registry() -> None:
-    _NEW_NODE_REGISTRY.clear()
\ No newline at end of file
+    _NEW_NODE_REGISTRY.clear()
+
+def write_dag_file(path: str, dag_nodes: List[Dict[str, Any]]) -> None:
+    """
+    Dump the executable DAG as JSON, one entry per emitted SQL file in topological
+    order. Each entry records the node id, its SQL file, the relation it creates,
+    its materialization, whether it is an optimizer-created intermediate node and
+    the node ids of its parents. Read by the parallel executor.
+    """
+    with open(path, "w") as f:
+        json.dump({"nodes": dag_nodes}, f, indent=2)
+
+def load_dag_file(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r") as f:
+        return json.load(f)["nodes"]